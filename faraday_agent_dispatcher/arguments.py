@@ -0,0 +1,100 @@
+# Copyright (C) 2019  Infobyte LLC (http://www.infobytesec.com/)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from types import MappingProxyType
+
+from faraday_agent_dispatcher.utils.control_values_utils import parse_bool
+
+STRING = "string"
+INTEGER = "integer"
+FLOAT = "float"
+BOOLEAN = "boolean"
+
+
+def coerce_bool(value):
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() not in ["true", "false", "t", "f"]:
+        raise ValueError(f"{value} is not a bool")
+    return parse_bool(str(value))
+
+
+COERCERS = {
+    STRING: str,
+    INTEGER: int,
+    FLOAT: float,
+    BOOLEAN: coerce_bool,
+}
+ARGUMENT_TYPES = list(COERCERS)
+
+
+def parse_param(value: str):
+    """Parses the ``mandatory[, type[, default]]`` value of an executor param"""
+    parts = [part.strip() for part in value.split(",", 2)]
+    mandatory = parts[0]
+    arg_type = parts[1] if len(parts) > 1 else STRING
+    default = parts[2] if len(parts) > 2 else None
+    return mandatory, arg_type, default
+
+
+class ArgumentError(ValueError):
+
+    def __init__(self, unexpected=(), missing=(), invalid=()):
+        self.unexpected = sorted(unexpected)
+        self.missing = sorted(missing)
+        self.invalid = sorted(invalid)
+        super().__init__(
+            f"Unexpected: {self.unexpected}, missing: {self.missing}, invalid: {self.invalid}"
+        )
+
+
+class ArgumentSchema:
+    """The arguments an executor accepts, built once when the executor is loaded. Arguments are matched
+    by their exact name, and the check of a RUN does not depend on the number of params"""
+
+    __slots__ = ("accepted", "mandatory", "types", "defaults")
+
+    def __init__(self, params: dict):
+        """params maps each name to its parsed ``(mandatory, type, default)``"""
+        self.accepted = frozenset(params)
+        self.mandatory = frozenset(name for name, (mandatory, _, _) in params.items() if mandatory)
+        self.types = MappingProxyType({
+            name: arg_type for name, (_, arg_type, _) in params.items() if arg_type != STRING
+        })
+        self.defaults = MappingProxyType({
+            name: COERCERS[arg_type](default)
+            for name, (_, arg_type, default) in params.items() if default is not None
+        })
+
+    def validate(self, args: dict) -> dict:
+        """Returns the args coerced to their types with the missing defaults, or raises ArgumentError"""
+        if not isinstance(args, dict):
+            raise ArgumentError(invalid=["args"])
+        unexpected = args.keys() - self.accepted
+        missing = self.mandatory - args.keys()
+        invalid = []
+        validated = dict(self.defaults)
+        for name, value in args.items():
+            arg_type = self.types.get(name)
+            if arg_type is None:
+                validated[name] = value
+                continue
+            try:
+                validated[name] = COERCERS[arg_type](value)
+            except (TypeError, ValueError):
+                invalid.append(name)
+        if unexpected or missing or invalid:
+            raise ArgumentError(unexpected, missing, invalid)
+        return validated
@@ -0,0 +1,220 @@
+# Copyright (C) 2019  Infobyte LLC (http://www.infobytesec.com/)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+
+from faraday_agent_dispatcher import logger as logging
+from faraday_agent_dispatcher.utils.json_utils import EncodedDocument
+
+logger = logging.get_logger()
+
+DEFAULT_BATCH_OBJECTS = 1
+DEFAULT_STREAM_BATCH_OBJECTS = 100
+DEFAULT_BATCH_SIZE = 1024 * 1024    # 1 MB
+DEFAULT_BATCH_DELAY = 5.0           # seconds
+
+NESTED_OBJECTS = ["services", "vulnerabilities", "credentials"]
+
+
+def count_objects(hosts: list):
+    """Counts the hosts and the services, vulnerabilities and credentials they carry"""
+    count = 0
+    for host in hosts:
+        count += 1
+        if not isinstance(host, dict):
+            continue
+        for key in NESTED_OBJECTS:
+            nested = host.get(key, [])
+            if isinstance(nested, list):
+                count += len(nested)
+                if key == "services":
+                    count += sum(len(service.get("vulnerabilities", []))
+                                 for service in nested if isinstance(service, dict))
+    return count
+
+
+def nested_list(obj: dict, key: str):
+    value = obj.get(key)
+    return value if key in NESTED_OBJECTS and isinstance(value, list) else None
+
+
+class HostTree:
+    """The hosts of a batch folded by ip, the one of the workspace of the batcher. The services of a host
+    are merged by port and protocol, its vulns and the ones of its services by name; the first value of
+    any other field is kept. Hosts without ip are kept as they are"""
+
+    def __init__(self):
+        self.hosts = []
+        self.by_ip = {}
+        self.services = {}  # (ip, port, protocol): merged service
+        self.vulns = set()  # (ip, port, protocol, name) of the vulns in the tree, port and protocol None for hosts
+        self.merged = 0     # Objects folded into others
+
+    def __len__(self):
+        return len(self.hosts)
+
+    def add(self, host) -> int:
+        """Folds the host into the tree, returns how many objects it added"""
+        if not isinstance(host, dict) or not isinstance(host.get("ip"), str):
+            self.hosts.append(host)
+            return count_objects([host])
+        ip = host["ip"]
+        merged = self.by_ip.get(ip)
+        if merged is None:
+            merged = {field: value for field, value in host.items() if nested_list(host, field) is None}
+            self.by_ip[ip] = merged
+            self.hosts.append(merged)
+            added = 1
+        else:
+            for field, value in host.items():
+                if nested_list(host, field) is None:
+                    merged.setdefault(field, value)
+            self.merged += 1
+            added = 0
+        added += self.add_vulns(merged, nested_list(host, "vulnerabilities"), (ip, None, None))
+        for service in nested_list(host, "services") or []:
+            added += self.add_service(ip, merged, service)
+        credentials = nested_list(host, "credentials")
+        if credentials:
+            merged.setdefault("credentials", []).extend(credentials)
+            added += len(credentials)
+        return added
+
+    def add_service(self, ip: str, host: dict, service) -> int:
+        services = host.setdefault("services", [])
+        if not isinstance(service, dict) or "port" not in service:
+            services.append(service)
+            return 1 + len(nested_list(service, "vulnerabilities") or []) if isinstance(service, dict) else 1
+        key = (ip, str(service["port"]), service.get("protocol"))
+        merged = self.services.get(key)
+        if merged is None:
+            merged = {field: value for field, value in service.items() if nested_list(service, field) is None}
+            self.services[key] = merged
+            services.append(merged)
+            added = 1
+        else:
+            for field, value in service.items():
+                if nested_list(service, field) is None:
+                    merged.setdefault(field, value)
+            self.merged += 1
+            added = 0
+        added += self.add_vulns(merged, nested_list(service, "vulnerabilities"), key)
+        credentials = nested_list(service, "credentials")
+        if credentials:
+            merged.setdefault("credentials", []).extend(credentials)
+            added += len(credentials)
+        return added
+
+    def add_vulns(self, parent: dict, vulns: list, key: tuple) -> int:
+        added = 0
+        for vuln in vulns or []:
+            name = vuln.get("name") if isinstance(vuln, dict) else None
+            if name is not None:
+                if (*key, name) in self.vulns:
+                    self.merged += 1
+                    continue
+                self.vulns.add((*key, name))
+            parent.setdefault("vulnerabilities", []).append(vuln)
+            added += 1
+        return added
+
+
+def is_mergeable(document):
+    return isinstance(document, dict) and list(document.keys()) == ["hosts"] and isinstance(document["hosts"], list)
+
+
+class ResultBatcher:
+    """Merges consecutive ``{"hosts": [...]}`` documents in a single bulk create payload.
+
+    The batch is sent with ``flush_f`` when it reaches ``max_objects`` objects, ``max_size`` bytes or
+    when its first document waited ``max_delay`` seconds. Any other document flushes the batch and is
+    sent on its own, so the executor output order is preserved. When the ``raw`` bytes of a document are
+    given and it is sent on its own, they are sent as they are instead of encoding the document again.
+    With ``merge_hosts`` the hosts of the batch are folded in a ``HostTree``, so the server looks up and
+    updates each host once per batch.
+    """
+
+    def __init__(self, flush_f,
+                 max_objects: int = DEFAULT_BATCH_OBJECTS,
+                 max_size: int = DEFAULT_BATCH_SIZE,
+                 max_delay: float = DEFAULT_BATCH_DELAY,
+                 merge_hosts: bool = False):
+        self.flush_f = flush_f
+        self.max_objects = max_objects
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.merge_hosts = merge_hosts
+        self.hosts = HostTree() if merge_hosts else []
+        self.objects = 0
+        self.size = 0
+        self.__lock = asyncio.Lock()
+        self.__timer = None
+
+    async def add(self, document, size: int = 0, raw: bytes = None):
+        if not is_mergeable(document):
+            await self.flush()
+            await self.__send(EncodedDocument(document, raw) if raw is not None else document)
+            return
+
+        objects = count_objects(document["hosts"])
+        if raw is not None and not self.hosts and (objects >= self.max_objects or size >= self.max_size):
+            await self.__send(EncodedDocument(document, raw))
+            return
+        if self.merge_hosts:
+            objects = sum(self.hosts.add(host) for host in document["hosts"])
+        else:
+            self.hosts.extend(document["hosts"])
+        self.objects += objects
+        self.size += size
+        if self.objects >= self.max_objects or self.size >= self.max_size:
+            await self.flush()
+        elif self.__timer is None:
+            self.__timer = asyncio.create_task(self.__flush_later())
+
+    async def flush(self):
+        self.__cancel_timer()
+        if not self.hosts:
+            return
+        if self.merge_hosts:
+            if self.hosts.merged:
+                logger.debug(f"Merged {self.hosts.merged} objects of the batch into others")
+            payload = {"hosts": self.hosts.hosts}
+            self.hosts = HostTree()
+        else:
+            payload = {"hosts": self.hosts}
+            self.hosts = []
+        self.objects = 0
+        self.size = 0
+        await self.__send(payload)
+
+    async def close(self):
+        await self.flush()
+        async with self.__lock:  # Waits for the batch a timer flush may still be sending
+            pass
+
+    async def __send(self, payload):
+        async with self.__lock:  # Keeps the batches in order
+            await self.flush_f(payload)
+
+    async def __flush_later(self):
+        await asyncio.sleep(self.max_delay)
+        self.__timer = None
+        logger.debug("Batch delay reached, flushing results")
+        await self.flush()
+
+    def __cancel_timer(self):
+        if self.__timer is not None and self.__timer is not asyncio.current_task():
+            self.__timer.cancel()
+        self.__timer = None
@@ -27,6 +27,7 @@ import traceback
 from aiohttp import ClientSession
 
 from faraday_agent_dispatcher.dispatcher import Dispatcher
+from faraday_agent_dispatcher.profiling import PROFILERS
 from faraday_agent_dispatcher.utils.text_utils import Bcolors
 from faraday_agent_dispatcher import config
 import faraday_agent_dispatcher.logger as logging
@@ -34,7 +35,7 @@ import faraday_agent_dispatcher.logger as logging
 logger = logging.get_logger()
 
 
-async def main(config_file):
+async def main(config_file, profile=None, quiet=False):
 
     if config_file is None and not os.path.exists(config.CONFIG_FILENAME):
         logger.info("Config file doesn't exist. Creating a new one")
@@ -46,7 +47,7 @@ async def main(config_file):
 
     async with ClientSession(raise_for_status=True) as session:
         try:
-            dispatcher = Dispatcher(session, config_file)
+            dispatcher = Dispatcher(session, config_file, profile, quiet)
         except ValueError as ex:
             print(f'{Bcolors.FAIL}Error configuring dispatcher: '
                   f'{Bcolors.BOLD}{str(ex)}{Bcolors.ENDC}')
@@ -62,11 +63,14 @@ async def main(config_file):
 @click.command("faraday-dispatcher")
 @click.option("-c", "--config-file", default=None, help="Path to config ini file")
 @click.option("--logdir", default="~", help="Path to logger directory")
-def main_sync(config_file, logdir):
+@click.option("--profile", type=click.Choice(PROFILERS), default=None,
+              help="Profile every execution, the results are written to the profiles folder of the logger directory")
+@click.option("--quiet", is_flag=True, default=False, help="Don't echo the executors output to the console")
+def main_sync(config_file, logdir, profile, quiet):
     logging.reset_logger(logdir)
     logger = logging.get_logger()
     try:
-        exit_code = asyncio.run(main(config_file))
+        exit_code = asyncio.run(main(config_file, profile, quiet))
     except KeyboardInterrupt:
         sys.exit(0)
     except Exception as e:
@@ -27,6 +27,7 @@ except KeyError:
 
 LOGS_PATH = FARADAY_PATH / 'logs'
 CONFIG_PATH = FARADAY_PATH / 'config'
+SPOOL_PATH = FARADAY_PATH / 'spool'
 CONFIG_FILENAME = CONFIG_PATH / 'dispatcher.ini'
 
 EXAMPLE_CONFIG_FILENAME = Path(__file__).parent / 'example_config.ini'
@@ -67,3 +68,4 @@ class Sections:
     EXECUTOR_VARENVS = "{}_varenvs"
     EXECUTOR_PARAMS = "{}_params"
     EXECUTOR_DATA = "{}"
+    TARGET = "target_{}"
@@ -0,0 +1,144 @@
+# Copyright (C) 2019  Infobyte LLC (http://www.infobytesec.com/)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import time
+import hashlib
+from collections import OrderedDict
+
+from faraday_agent_dispatcher import metrics
+from faraday_agent_dispatcher.config import instance as config, Sections
+from faraday_agent_dispatcher.utils import json_utils
+
+DEFAULT_DEDUP_SIZE = 0      # Objects remembered, 0 disables the cache
+DEFAULT_DEDUP_TTL = 3600    # seconds an object is not sent again
+
+HOST_CHILDREN = ("services", "vulnerabilities", "credentials")
+SERVICE_CHILDREN = ("vulnerabilities", "credentials")
+
+
+def own_fields(obj: dict, children):
+    return {key: value for key, value in obj.items() if key not in children}
+
+
+class DedupCache:
+    """Remembers the hash of the hosts, services, vulns and credentials sent in the last ttl seconds,
+    evicting the least recently seen ones over max_size, to skip the objects the executors print again.
+    The hash of a child includes the one of its parent, so the same vuln of two hosts is not a duplicate.
+    The objects are only remembered once sent or spooled, so the ones of a failed upload are sent again.
+    Each output process of the multiprocess mode has its own cache, the duplicates handled by two of
+    them are both sent"""
+
+    def __init__(self, max_size: int, ttl: float = DEFAULT_DEDUP_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # hash: time it was first sent
+        self.hits = 0
+        self.misses = 0
+        self.__hits_metric = metrics.DEDUP_OBJECTS.labels("hit")
+        self.__misses_metric = metrics.DEDUP_OBJECTS.labels("miss")
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def key(parent: bytes, obj) -> bytes:
+        return hashlib.blake2b(parent + json_utils.canonical_bytes(obj), digest_size=16).digest()
+
+    def seen(self, key: bytes, pending: set) -> bool:
+        """Returns whether the object was sent in the last ttl seconds or is already in the document,
+        adding it to the pending keys otherwise"""
+        sent = self.entries.get(key)
+        if key in pending or (sent is not None and time.monotonic() - sent < self.ttl):
+            if sent is not None:
+                self.entries.move_to_end(key)
+            self.hits += 1
+            self.__hits_metric.inc()
+            return True
+        pending.add(key)
+        self.misses += 1
+        self.__misses_metric.inc()
+        return False
+
+    def remember(self, keys):
+        """Records the objects as sent, once the server received them or they were spooled"""
+        now = time.monotonic()
+        for key in keys:
+            self.entries[key] = now
+            self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def filter_children(self, obj: dict, parent: bytes, children, filtered: dict, pending: set):
+        """Copies the children not sent yet to filtered, returns whether there was any"""
+        new_children = False
+        for field in children:
+            if field not in obj:
+                continue
+            if not isinstance(obj[field], list):
+                filtered[field] = obj[field]
+                continue
+            kept = []
+            for child in obj[field]:
+                if field == "services" and isinstance(child, dict):
+                    child = self.filter_service(child, parent, pending)
+                    if child is not None:
+                        kept.append(child)
+                elif not self.seen(self.key(parent, child), pending):
+                    kept.append(child)
+            filtered[field] = kept
+            new_children = new_children or bool(kept)
+        return new_children
+
+    def filter_service(self, service: dict, host_key: bytes, pending: set):
+        fields = own_fields(service, SERVICE_CHILDREN)
+        service_key = self.key(host_key, fields)
+        service_seen = self.seen(service_key, pending)
+        if self.filter_children(service, service_key, SERVICE_CHILDREN, fields, pending) or not service_seen:
+            return fields
+        return None
+
+    def filter_host(self, host, scope: bytes, pending: set):
+        if not isinstance(host, dict):
+            return host
+        fields = own_fields(host, HOST_CHILDREN)
+        host_key = self.key(scope, fields)
+        host_seen = self.seen(host_key, pending)
+        if self.filter_children(host, host_key, HOST_CHILDREN, fields, pending) or not host_seen:
+            return fields
+        return None
+
+    def filter(self, document, scope: str = ""):
+        """Returns the bulk create document without the objects already sent to the scope, the
+        workspace of the results, or None if there is nothing new in it, and the keys of the new
+        objects, to remember once the document is sent"""
+        pending = set()
+        if not isinstance(document, dict) or not isinstance(document.get("hosts"), list):
+            return document, pending
+        scope = scope.encode()
+        hosts = [
+            host for host in (self.filter_host(host, scope, pending) for host in document["hosts"])
+            if host is not None
+        ]
+        if not hosts and len(document) == 1:
+            return None, pending
+        return {**document, "hosts": hosts}, pending
+
+
+def build_dedup_cache():
+    """Returns the DedupCache set in the agent section, None if disabled"""
+    max_size = int(config[Sections.AGENT].get("dedup_size", DEFAULT_DEDUP_SIZE))
+    if max_size <= 0:
+        return None
+    return DedupCache(max_size, float(config[Sections.AGENT].get("dedup_ttl", DEFAULT_DEDUP_TTL)))
@@ -16,31 +16,83 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import os
-import json
+import copy
+import time
+import signal
 
 import asyncio
 import websockets
-from aiohttp.client_exceptions import ClientResponseError
+from collections import deque
+from aiohttp.client_exceptions import ClientResponseError, ClientError
 
+from faraday_agent_dispatcher import metrics
 from faraday_agent_dispatcher.config import reset_config
-from faraday_agent_dispatcher.executor_helper import StdErrLineProcessor, StdOutLineProcessor
+from faraday_agent_dispatcher.executor_helper import (
+    StdErrLineProcessor,
+    StdOutLineProcessor,
+    StdOutLogProcessor,
+    PipeOutput,
+    open_read_pipe,
+)
+from faraday_agent_dispatcher.profiling import profile_execution
+from faraday_agent_dispatcher.dedup import build_dedup_cache
+from faraday_agent_dispatcher.spool import Spool, DEFAULT_SPOOL_MAX_SIZE, DEFAULT_SPOOL_REPLAY_INTERVAL
+from faraday_agent_dispatcher.uploader import BulkCreateUploader
+from faraday_agent_dispatcher.executions import ExecutionRegistry, Execution, TIMEOUT, CPU_TIME, MEMORY
+from faraday_agent_dispatcher.scheduler import (
+    JobScheduler,
+    QueueFullError,
+    DEFAULT_MAX_CONCURRENT_RUNS,
+    DEFAULT_MAX_QUEUED_RUNS
+)
+from faraday_agent_dispatcher.utils.retry_utils import RetryPolicy, DEFAULT_BACKOFF, DEFAULT_MAX_BACKOFF
+from faraday_agent_dispatcher.utils.process_utils import terminate_process_group, exit_signal
 from faraday_agent_dispatcher.utils.url_utils import api_url, websocket_url
+from faraday_agent_dispatcher.utils import json_utils
 from faraday_agent_dispatcher.utils.control_values_utils import (
     control_int,
+    control_float,
     control_str,
     control_host,
+    control_optional_host,
     control_registration_token,
     control_agent_token,
-    control_list
+    control_list,
+    control_choice,
+    control_bool,
+    parse_bool
 )
+from faraday_agent_dispatcher.utils.compression_utils import COMPRESSORS
 import faraday_agent_dispatcher.logger as logging
 
-from faraday_agent_dispatcher.config import instance as config, Sections, save_config
+from faraday_agent_dispatcher.config import instance as config, Sections
 from faraday_agent_dispatcher.executor import Executor
+from faraday_agent_dispatcher.arguments import ArgumentError
+from faraday_agent_dispatcher.worker import WORKER_ENV, RESULT_CHANNEL_ENV
+from faraday_agent_dispatcher.workers import WorkerPool
+from faraday_agent_dispatcher.targets import Target
+from faraday_agent_dispatcher.output_processes import OutputProcessPool
 
 logger = logging.get_logger()
 logging.setup_logging()
 
+DEFAULT_PING_INTERVAL = 20.0    # seconds, 0 disables the keepalive pings
+DEFAULT_PING_TIMEOUT = 20.0     # seconds
+PENDING_MESSAGES = 1000         # Messages kept while the websocket is down
+
+RECONNECT_EXCEPTIONS = (websockets.ConnectionClosed, websockets.InvalidHandshake, OSError, asyncio.TimeoutError,
+                        ClientError)
+AUTHENTICATION_STATUSES = (401, 403)  # The server rejected the agent token, reconnecting does not fix it
+
+
+def response_status(exception: Exception):
+    """Returns the HTTP status of the response which raised the exception, None if there was no response"""
+    if isinstance(exception, ClientResponseError):
+        return exception.status
+    if isinstance(exception, websockets.InvalidStatus):
+        return exception.response.status_code
+    return getattr(exception, "status_code", None)  # InvalidStatusCode of the legacy websockets client
+
 
 class Dispatcher:
 
@@ -49,7 +101,17 @@ class Dispatcher:
             "host": control_host,
             "api_port": control_int(),
             "websocket_port": control_int(),
-            "workspace": control_str
+            "workspace": control_str,
+            "upload_retries": control_int(True),
+            "upload_retry_budget": control_int(True),
+            "upload_backoff": control_float(True),
+            "upload_max_backoff": control_float(True),
+            "upload_compression": control_choice(COMPRESSORS, nullable=True),
+            "reconnect_retries": control_int(True),
+            "reconnect_backoff": control_float(True),
+            "reconnect_max_backoff": control_float(True),
+            "ping_interval": control_float(True),
+            "ping_timeout": control_float(True),
         },
         Sections.TOKENS: {
             "registration": control_registration_token,
@@ -57,27 +119,138 @@ class Dispatcher:
         },
         Sections.AGENT: {
             "agent_name": control_str,
-            "executors": control_list(can_repeat=False)
+            "executors": control_list(can_repeat=False),
+            "spool_max_size": control_int(True),
+            "spool_replay_interval": control_float(True),
+            "max_concurrent_runs": control_int(True),
+            "max_queued_runs": control_int(True),
+            "metrics_port": control_int(True),
+            "metrics_host": control_optional_host,
+            "quiet": control_bool(True),
+            "json_backend": control_choice(json_utils.BACKENDS, nullable=True),
+            "multiprocess_output": control_bool(True),
+            "output_processes": control_int(True),
+            "dedup_size": control_int(True),
+            "dedup_ttl": control_float(True),
         },
     }
 
-    def __init__(self, session, config_path=None):
+    def __init__(self, session, config_path=None, profile: str = None, quiet: bool = False):
         reset_config(filepath=config_path)
         self.control_config()
+        json_utils.set_backend(config[Sections.AGENT].get("json_backend", json_utils.DEFAULT_BACKEND))
         self.config_path = config_path
-        self.host = config.get(Sections.SERVER, "host")
-        self.api_port = config.get(Sections.SERVER, "api_port")
-        self.websocket_port = config.get(Sections.SERVER, "websocket_port")
-        self.workspace = config.get(Sections.SERVER, "workspace")
-        self.agent_token = config[Sections.TOKENS].get("agent", None)
+        self.target = Target()
+        self.parent = None  # The dispatcher sharing its executors with this one, of another target
         self.agent_name = config.get(Sections.AGENT, "agent_name")
         self.session = session
+        self.profile = profile
+        self.quiet = quiet or parse_bool(config[Sections.AGENT].get("quiet", "False"))
         self.websocket = None
         self.websocket_token = None
+        self.pending_messages = deque(maxlen=PENDING_MESSAGES)
+        self.connections = 0
+        reconnect_retries = config[Sections.SERVER].get("reconnect_retries", None)
+        self.reconnect_policy = RetryPolicy(
+            max_retries=int(reconnect_retries) if reconnect_retries is not None else None,
+            budget=None,
+            backoff=float(config[Sections.SERVER].get("reconnect_backoff", DEFAULT_BACKOFF)),
+            max_backoff=float(config[Sections.SERVER].get("reconnect_max_backoff", DEFAULT_MAX_BACKOFF)),
+        )
+        self.ping_interval = float(config[Sections.SERVER].get("ping_interval", DEFAULT_PING_INTERVAL)) or None
+        self.ping_timeout = float(config[Sections.SERVER].get("ping_timeout", DEFAULT_PING_TIMEOUT))
         self.executors = {
             executor_name:
                 Executor(executor_name, config) for executor_name in config[Sections.AGENT].get("executors", []).split(",")
         }
+        self.worker_pools = {
+            executor.name: WorkerPool(executor, self.worker_spawner(executor), self.quiet)
+            for executor in self.executors.values() if executor.persistent
+        }
+        self.executions = ExecutionRegistry()
+        self.scheduler = JobScheduler(
+            max_running=int(config[Sections.AGENT].get("max_concurrent_runs", DEFAULT_MAX_CONCURRENT_RUNS)),
+            executor_limits={
+                executor.name: executor.max_concurrent_runs for executor in self.executors.values()
+            },
+            max_queued=int(config[Sections.AGENT].get("max_queued_runs", DEFAULT_MAX_QUEUED_RUNS)),
+        )
+        spool_max_size = int(config[Sections.AGENT].get("spool_max_size", DEFAULT_SPOOL_MAX_SIZE))
+        self.spool = Spool(max_size=spool_max_size) if spool_max_size > 0 else None
+        self.spool_replay_interval = float(
+            config[Sections.AGENT].get("spool_replay_interval", DEFAULT_SPOOL_REPLAY_INTERVAL)
+        )
+        self.dedup = build_dedup_cache()
+        self.output_processes = OutputProcessPool(
+            int(config[Sections.AGENT].get("output_processes", os.cpu_count() or 1)), config_path, self.quiet,
+            self.spool_of
+        ) if parse_bool(config[Sections.AGENT].get("multiprocess_output", "False")) else None
+        metrics_port = config[Sections.AGENT].get("metrics_port", None)
+        self.metrics_server = metrics.MetricsServer(
+            int(metrics_port), config[Sections.AGENT].get("metrics_host", metrics.DEFAULT_METRICS_HOST)
+        ) if metrics_port is not None else None
+        metrics.RUNNING_EXECUTIONS.set_function(lambda: self.scheduler.running)
+        metrics.QUEUED_EXECUTIONS.set_function(lambda: self.scheduler.queued)
+        metrics.UPLOAD_QUEUE_DEPTH.set_function(lambda: sum(
+            execution.upload_queue_depth
+            for dispatcher in [self, *self.targets] for execution in dispatcher.executions.executions.values()
+        ))
+        metrics.SPOOL_BYTES.set_function(lambda: sum(
+            dispatcher.spool.size for dispatcher in [self, *self.targets] if dispatcher.spool is not None
+        ))
+        metrics.PENDING_MESSAGES.set_function(lambda: sum(
+            len(dispatcher.pending_messages) for dispatcher in [self, *self.targets]
+        ))
+        self.targets = [self.for_target(Target(name)) for name in self.target_names()]
+
+    def for_target(self, target: Target):
+        """Returns a dispatcher joining another server or workspace, which shares the executors, the
+        session and the scheduler with this one. Its executions and spool are its own, so a server can
+        neither cancel the executions of another one nor hold back its results"""
+        dispatcher = copy.copy(self)
+        dispatcher.target = target
+        dispatcher.parent = self
+        dispatcher.targets = []
+        dispatcher.executions = ExecutionRegistry(self.executions.grace_period)
+        dispatcher.spool = Spool(self.spool.path / Sections.TARGET.format(target.name), self.spool.max_size) \
+            if self.spool is not None else None
+        dispatcher.websocket = None
+        dispatcher.websocket_token = None
+        dispatcher.pending_messages = deque(maxlen=PENDING_MESSAGES)
+        dispatcher.connections = 0
+        dispatcher.metrics_server = None
+        return dispatcher
+
+    def spool_of(self, target_name: str = None):
+        """Returns the spool of the results of a target, by its name"""
+        for dispatcher in [self, *self.targets]:
+            if dispatcher.target.name == target_name:
+                return dispatcher.spool
+        return self.spool
+
+    @property
+    def host(self):
+        return self.target.host
+
+    @property
+    def api_port(self):
+        return self.target.api_port
+
+    @property
+    def websocket_port(self):
+        return self.target.websocket_port
+
+    @property
+    def workspace(self):
+        return self.target.workspace
+
+    @property
+    def agent_token(self):
+        return self.target.agent_token
+
+    @agent_token.setter
+    def agent_token(self, token):
+        self.target.agent_token = token
 
     async def reset_websocket_token(self):
         # I'm built so I ask for websocket token
@@ -91,8 +264,11 @@ class Dispatcher:
 
     async def register(self):
 
+        for target in self.targets:
+            await target.register()
+
         if self.agent_token is None:
-            registration_token = self.agent_token = config.get(Sections.TOKENS, "registration")
+            registration_token = self.agent_token = self.target.registration_token
             assert registration_token is not None, "The registration token is mandatory"
             token_registration_url = api_url(self.host,
                                              self.api_port,
@@ -103,9 +279,7 @@ class Dispatcher:
                                                          json={'token': registration_token, 'name': self.agent_name})
                 assert token_response.status == 201
                 token = await token_response.json()
-                self.agent_token = token["token"]
-                config.set(Sections.TOKENS, "agent", self.agent_token)
-                save_config(self.config_path)
+                self.target.save_agent_token(token["token"], self.config_path)
             except ClientResponseError as e:
                 if e.status == 404:
                     logger.info(f'404 HTTP ERROR received: Workspace "{self.workspace}" not found')
@@ -116,12 +290,8 @@ class Dispatcher:
 
         self.websocket_token = await self.reset_websocket_token()
 
-    async def connect(self, out_func=None):
-
-        if not self.websocket_token and not out_func:
-            return
-
-        connected_data = json.dumps({
+    def join_agent_message(self):
+        return json_utils.dumps({
                     'action': 'JOIN_AGENT',
                     'workspace': self.workspace,
                     'token': self.websocket_token,
@@ -129,17 +299,130 @@ class Dispatcher:
                                   for executor in self.executors.values()]
                 })
 
-        if out_func is None:
+    async def connect(self, out_func=None):
 
-            async with websockets.connect(websocket_url(self.host, self.websocket_port)) as websocket:
-                await websocket.send(connected_data)
+        if not self.websocket_token and not out_func:
+            return
 
-                logger.info("Connection to Faraday server succeeded")
-                self.websocket = websocket
+        if out_func is not None:
+            await out_func(self.join_agent_message())
+            return
 
+        replay_tasks = [dispatcher.start_spool_replay() for dispatcher in [self, *self.targets]]
+        if self.metrics_server is not None:
+            await self.metrics_server.start()
+        for pool in self.worker_pools.values():
+            await pool.start()
+        if self.output_processes is not None:
+            self.output_processes.start()
+        tasks = [asyncio.create_task(dispatcher.keep_connected())
+                 for dispatcher in [self, *self.targets] if dispatcher.websocket_token]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            for replay_task in replay_tasks:
+                if replay_task is not None:
+                    replay_task.cancel()
+            executions = sum(len(dispatcher.executions) for dispatcher in [self, *self.targets])
+            if executions > 0:
+                logger.info(f"Shutting down, cancelling {executions} executions")
+                await asyncio.gather(*[dispatcher.executions.cancel_all() for dispatcher in [self, *self.targets]])
+            await self.close_workers()
+            for dispatcher in [self, *self.targets]:
+                if dispatcher.spool is not None:
+                    dispatcher.spool.close()
+            if self.metrics_server is not None:
+                await self.metrics_server.stop()
+
+    async def keep_connected(self):
+        """Keeps the websocket to the server of the target connected, until the reconnect retries
+        are exhausted or the server rejects the agent token"""
+        attempt = 0
+        try:
+            while True:
+                connections = self.connections
+                try:
+                    await self.connect_once()
+                except RECONNECT_EXCEPTIONS as e:
+                    if response_status(e) in AUTHENTICATION_STATUSES:
+                        logger.error(f"Faraday server {self.target} rejected the agent token ({e}), not "
+                                     f"reconnecting")
+                        raise
+                    if self.connections > connections:
+                        attempt = 0  # It was connected, start the backoff again
+                    delay = self.reconnect_policy.next_delay(attempt)
+                    if delay is None:
+                        logger.error(f"Disconnected from Faraday server {self.target} ({e}), giving up after "
+                                     f"{attempt} retries")
+                        raise
+                    logger.warning(f"Disconnected from Faraday server {self.target} ({e}), reconnecting in "
+                                   f"{delay:.2f} s")
+                    await asyncio.sleep(delay)
+                    attempt += 1
+                    metrics.WEBSOCKET_RECONNECTS.inc()
+        finally:
+            self.websocket = None
+
+    async def connect_once(self):
+        """Joins the server and handles its messages until the websocket closes. The executions keep
+        running meanwhile, and their status messages are sent after the next connection"""
+        if self.websocket_token is None:
+            self.websocket_token = await self.reset_websocket_token()  # The tokens are valid only once
+        async with websockets.connect(websocket_url(self.host, self.websocket_port),
+                                      ping_interval=self.ping_interval,
+                                      ping_timeout=self.ping_timeout) as websocket:
+            await websocket.send(self.join_agent_message())
+            self.websocket_token = None
+            logger.info(f"Connection to Faraday server {self.target} succeeded")
+            while self.pending_messages:
+                message = self.pending_messages.popleft()
+                try:
+                    await websocket.send(message)
+                except websockets.ConnectionClosed:
+                    self.pending_messages.appendleft(message)
+                    raise
+            self.websocket = websocket
+            self.connections += 1
+            try:
                 await self.run_await()  # This line can we called from outside (in main)
-        else:
-            await out_func(connected_data)
+            finally:
+                self.websocket = None
+
+    async def send(self, message: str):
+        """Sends a message to the server, or keeps it until the next connection if the websocket is down"""
+        if self.websocket is not None:
+            try:
+                await self.websocket.send(message)
+                return
+            except websockets.ConnectionClosed:
+                pass
+        if len(self.pending_messages) == self.pending_messages.maxlen:
+            logger.warning("Too many messages waiting for the connection to Faraday server, dropping the oldest")
+        self.pending_messages.append(message)
+
+    def start_spool_replay(self):
+        """Replays the spool of this target, so the results of a server that is down do not hold back the
+        ones of the others"""
+        if self.spool is None:
+            return None
+        if self.spool.pending:
+            logger.info(f"Replaying {self.spool.size} bytes of spooled results of {self.target}")
+        root = self.parent or self
+        replay_uploaders = {
+            dispatcher.target.name: BulkCreateUploader(self.session, retry_policy=RetryPolicy(max_retries=0),
+                                                       target=dispatcher.target)
+            for dispatcher in [root, *root.targets]
+        }
+
+        async def replay_send(workspace, data, target=None):
+            if target not in replay_uploaders:
+                logger.error(f"Spooled results of the {target} target, which is not configured, dropped")
+                return True
+            return await replay_uploaders[target].send(workspace, data)
+
+        return asyncio.create_task(self.spool.replay_forever(replay_send, self.spool_replay_interval))
 
     async def run_await(self):
         while True:
@@ -148,24 +431,28 @@ class Dispatcher:
             asyncio.create_task(self.run_once(data))
 
     async def run_once(self, data:str= None, out_func=None):
-        out_func = out_func if out_func is not None else self.websocket.send
+        out_func = out_func if out_func is not None else self.send
         logger.info('Parsing data: %s', data)
-        data_dict = json.loads(data)
+        data_dict = json_utils.loads(data)
         if "action" not in data_dict:
             logger.info("Data not contains action to do")
-            await out_func(json.dumps({"error": "'action' key is mandatory in this websocket connection"}))
+            await out_func(json_utils.dumps({"error": "'action' key is mandatory in this websocket connection"}))
             return
 
-        if data_dict["action"] not in ["RUN"]:  # ONLY SUPPORTED COMMAND FOR NOW
+        if data_dict["action"] not in ["RUN", "CANCEL"]:
             logger.info("Unrecognized action")
-            await out_func(json.dumps({f"{data_dict['action']}_RESPONSE": "Error: Unrecognized action"}))
+            await out_func(json_utils.dumps({f"{data_dict['action']}_RESPONSE": "Error: Unrecognized action"}))
+            return
+
+        if data_dict["action"] == "CANCEL":
+            await self.cancel(data_dict, out_func)
             return
 
         if data_dict["action"] == "RUN":
             if "executor" not in data_dict:
                 logger.error("No executor selected")
                 await out_func(
-                    json.dumps({
+                    json_utils.dumps({
                         "action": "RUN_STATUS",
                         "running": False,
                         "message": f"No executor selected to {self.agent_name} agent"
@@ -176,7 +463,7 @@ class Dispatcher:
             if data_dict["executor"] not in self.executors:
                 logger.error("The selected executor not exists")
                 await out_func(
-                    json.dumps({
+                    json_utils.dumps({
                         "action": "RUN_STATUS",
                         "executor_name": data_dict['executor'],
                         "running": False,
@@ -188,107 +475,338 @@ class Dispatcher:
 
             executor = self.executors[data_dict["executor"]]
 
-            params = list(executor.params.keys()).copy()
-            passed_params = data_dict['args'] if 'args' in data_dict else {}
-            [params.remove(param) for param in config.defaults()]
-
-            all_accepted = all(
-                [
-                    any([
-                        param in passed_param           # Control any available param
-                        for param in params             # was passed
-                        ])
-                    for passed_param in passed_params   # For all passed params
-                ])
-            if not all_accepted:
-                logger.error("Unexpected argument passed to {} executor".format(executor.name))
+            try:
+                passed_params = executor.arguments.validate(data_dict.get("args", {}))
+            except ArgumentError as e:
+                await self.invalid_arguments_status(executor, e, out_func)
+                return
+
+            try:
+                priority = int(data_dict.get("priority", 0))
+            except (TypeError, ValueError):
+                priority = 0
+
+            async def notify_queued(position):
+                logger.info(f"Executor {executor.name} queued, {position} executions ahead")
                 await out_func(
-                    json.dumps({
+                    json_utils.dumps({
                         "action": "RUN_STATUS",
                         "executor_name": executor.name,
                         "running": False,
-                        "message": f"Unexpected argument(s) passed to {executor.name} executor from {self.agent_name} "
-                                   f"agent"
+                        "queued": True,
+                        "message": f"Executor {executor.name} from {self.agent_name} agent queued, "
+                                   f"waiting for a free slot"
                     })
                 )
-            mandatory_full = all(
-                [
-                    not executor.params[param]  # All params is not mandatory
-                    or any([
-                        param in passed_param for passed_param in passed_params  # Or was passed
-                        ])
-                    for param in params
-                ]
-            )
-            if not mandatory_full:
-                logger.error("Mandatory argument not passed to {} executor".format(executor.name))
+
+            execution = self.executions.add(executor.name, passed_params, data_dict.get("execution_id"),
+                                            asyncio.current_task())
+            try:
+                profile = executor.profile or self.profile
+                async with self.scheduler.slot(executor.name, priority, notify_queued):
+                    if profile is None:
+                        outcome = await self.run_executor(executor, passed_params, out_func, execution)
+                    else:
+                        async with profile_execution(profile, f"{executor.name}-{execution.id}"):
+                            outcome = await self.run_executor(executor, passed_params, out_func, execution)
+                metrics.RUNS.labels(executor.name, outcome).inc()
+            except asyncio.CancelledError:
+                if not execution.cancelled:
+                    raise
+                metrics.RUNS.labels(executor.name, "cancelled").inc()
+                await out_func(self.cancelled_status(executor, execution))
+            except QueueFullError as e:
+                metrics.RUNS.labels(executor.name, "queue_full").inc()
+                logger.error(f"Executor {executor.name} not run: {e}")
                 await out_func(
-                    json.dumps({
+                    json_utils.dumps({
                         "action": "RUN_STATUS",
                         "executor_name": executor.name,
                         "running": False,
-                        "message": f"Mandatory argument(s) not passed to {executor.name} executor from "
-                                   f"{self.agent_name} agent"
+                        "message": f"Too many executions waiting in {self.agent_name} agent, "
+                                   f"{executor.name} executor not run"
                     })
                 )
+            finally:
+                self.executions.remove(execution)
+
+    async def invalid_arguments_status(self, executor: Executor, error: ArgumentError, out_func):
+        if error.unexpected:
+            logger.error(f"Unexpected argument passed to {executor.name} executor: {', '.join(error.unexpected)}")
+            await out_func(
+                json_utils.dumps({
+                    "action": "RUN_STATUS",
+                    "executor_name": executor.name,
+                    "running": False,
+                    "message": f"Unexpected argument(s) passed to {executor.name} executor from {self.agent_name} "
+                               f"agent"
+                })
+            )
+        if error.missing:
+            logger.error(f"Mandatory argument not passed to {executor.name} executor: {', '.join(error.missing)}")
+            await out_func(
+                json_utils.dumps({
+                    "action": "RUN_STATUS",
+                    "executor_name": executor.name,
+                    "running": False,
+                    "message": f"Mandatory argument(s) not passed to {executor.name} executor from "
+                               f"{self.agent_name} agent"
+                })
+            )
+        if error.invalid:
+            logger.error(f"Invalid argument passed to {executor.name} executor: {', '.join(error.invalid)}")
+            await out_func(
+                json_utils.dumps({
+                    "action": "RUN_STATUS",
+                    "executor_name": executor.name,
+                    "running": False,
+                    "message": f"Invalid argument(s) passed to {executor.name} executor from {self.agent_name} "
+                               f"agent"
+                })
+            )
 
-            if mandatory_full and all_accepted:
-                running_msg = f"Running {executor.name} executor from {self.agent_name} agent"
-                logger.info("Running {} executor".format(executor.name))
+    def cancelled_status(self, executor: Executor, execution: Execution):
+        return json_utils.dumps({
+            "action": "RUN_STATUS",
+            "executor_name": executor.name,
+            "successful": False,
+            "cancelled": True,
+            "message": f"Executor {executor.name} from {self.agent_name} was cancelled",
+            **execution.status_fields()
+        })
+
+    def limit_reached_status(self, executor: Executor, execution: Execution):
+        return json_utils.dumps({
+            "action": "RUN_STATUS",
+            "executor_name": executor.name,
+            "successful": False,
+            "limit_reached": execution.limit_reached,
+            "message": f"Executor {executor.name} from {self.agent_name} was stopped, "
+                       f"it reached its {execution.limit_reached} limit",
+            **execution.status_fields()
+        })
+
+    async def cancel(self, data_dict: dict, out_func):
+        if "execution_id" in data_dict:
+            execution = self.executions.get(data_dict["execution_id"])
+            executions = [execution] if execution is not None else []
+        elif "executor" in data_dict:
+            executions = self.executions.by_executor(data_dict["executor"])
+        else:
+            logger.error("No execution selected to cancel")
+            await out_func(json_utils.dumps({
+                "action": "CANCEL_STATUS",
+                "cancelled": False,
+                "message": f"No execution_id or executor selected to cancel in {self.agent_name} agent"
+            }))
+            return
 
-                process = await self.create_process(executor, passed_params)
-                tasks = [StdOutLineProcessor(process, self.session).process_f(),
-                         StdErrLineProcessor(process).process_f(),
-                         ]
-                await out_func(
-                    json.dumps({
-                        "action": "RUN_STATUS",
-                        "executor_name": executor.name,
-                        "running": True,
-                        "message": running_msg
-                    })
-                )
-                await asyncio.gather(*tasks)
-                await process.communicate()
-                assert process.returncode is not None
-                if process.returncode == 0:
-                    logger.info("Executor {} finished successfully".format(executor.name))
-                    await out_func(
-                        json.dumps({
-                            "action": "RUN_STATUS",
-                            "executor_name": executor.name,
-                            "successful": True,
-                            "message": f"Executor {executor.name} from {self.agent_name} finished successfully"
-                        }))
-                else:
-                    logger.warning(
-                        f"Executor {executor.name} finished with exit code {process.returncode}")
-                    await out_func(
-                        json.dumps({
-                            "action": "RUN_STATUS",
-                            "executor_name": executor.name,
-                            "successful": False,
-                            "message": f"Executor {executor.name} from {self.agent_name} failed"
-                        }))
-
-    async def create_process(self, executor: Executor, args):
-        env = os.environ.copy()
-        if isinstance(args, dict):
-            for k in args:
-                env[f"EXECUTOR_CONFIG_{k.upper()}"] = str(args[k])
+        if not executions:
+            logger.error("No running execution to cancel")
+            await out_func(json_utils.dumps({
+                "action": "CANCEL_STATUS",
+                "cancelled": False,
+                "message": f"No running execution to cancel in {self.agent_name} agent"
+            }))
+            return
+
+        await asyncio.gather(*[self.executions.cancel(execution) for execution in executions])
+        await out_func(json_utils.dumps({
+            "action": "CANCEL_STATUS",
+            "cancelled": True,
+            "execution_ids": [execution.id for execution in executions],
+            "message": f"{len(executions)} execution(s) cancelled in {self.agent_name} agent"
+        }))
+
+    async def run_executor(self, executor: Executor, passed_params, out_func, execution: Execution):
+        """Runs the executor and reports its status, returns its outcome"""
+        running_msg = f"Running {executor.name} executor from {self.agent_name} agent"
+        logger.info("Running {} executor".format(executor.name))
+
+        if executor.persistent:
+            returncode = await self.run_in_worker(executor, passed_params, out_func, execution, running_msg)
         else:
+            returncode = await self.run_process(executor, passed_params, out_func, execution, running_msg)
+        metrics.EXECUTION_DURATION.labels(executor.name).observe(time.time() - execution.start_time)
+        if execution.limit_reached is None:
+            execution.limit_reached = self.limit_reached(executor, returncode)
+        if execution.cancelled:
+            logger.info(f"Executor {executor.name} cancelled")
+            await out_func(self.cancelled_status(executor, execution))
+            return "cancelled"
+        elif execution.limit_reached is not None:
+            logger.warning(f"Executor {executor.name} reached its {execution.limit_reached} limit")
+            await out_func(self.limit_reached_status(executor, execution))
+            return execution.limit_reached
+        elif returncode == 0:
+            logger.info("Executor {} finished successfully".format(executor.name))
+            await out_func(
+                json_utils.dumps({
+                    "action": "RUN_STATUS",
+                    "executor_name": executor.name,
+                    "successful": True,
+                    "message": f"Executor {executor.name} from {self.agent_name} finished successfully",
+                    **execution.status_fields()
+                }))
+            return "successful"
+        else:
+            logger.warning(
+                f"Executor {executor.name} finished with exit code {returncode}")
+            await out_func(
+                json_utils.dumps({
+                    "action": "RUN_STATUS",
+                    "executor_name": executor.name,
+                    "successful": False,
+                    "message": f"Executor {executor.name} from {self.agent_name} failed",
+                    **execution.status_fields()
+                }))
+            return "failed"
+
+    async def run_process(self, executor: Executor, passed_params, out_func, execution: Execution, running_msg):
+        """Runs the executor in a new process, returns its exit code. Its results, read from its stdout or
+        its result channel, are processed here or, in multiprocess output mode, by an output process
+        which gets the read end of their pipe"""
+        read_fd = write_fd = None
+        if executor.result_channel or self.output_processes is not None:
+            read_fd, write_fd = os.pipe()
+        try:
+            if executor.result_channel:
+                process = await self.create_process(executor, passed_params, results=write_fd)
+            else:
+                process = await self.create_process(executor, passed_params, stdout=write_fd)
+        except BaseException:
+            if read_fd is not None:
+                os.close(read_fd)
+            raise
+        finally:
+            if write_fd is not None:
+                os.close(write_fd)
+        execution.started(process)
+        results_transport = None
+        if self.output_processes is not None:
+            stdout_task = self.output_processes.process(executor, self.target, read_fd, execution.read_output)
+        else:
+            output = process
+            if executor.result_channel:
+                reader, results_transport = await open_read_pipe(read_fd, executor.max_size)
+                output = PipeOutput(reader)
+            stdout_processor = StdOutLineProcessor(output, self.session, executor, self.spool, self.quiet,
+                                                   self.target, self.dedup)
+            execution.stdout_processor = stdout_processor
+            stdout_task = stdout_processor.process_f()
+        tasks = [stdout_task,
+                 StdErrLineProcessor(process, self.quiet).process_f(),
+                 ]
+        if executor.result_channel:
+            tasks.append(StdOutLogProcessor(process, self.quiet).process_f())
+        await out_func(self.running_status(executor, execution, running_msg))
+        timeout_task = asyncio.create_task(self.stop_on_timeout(executor, execution)) \
+            if executor.timeout is not None else None
+        try:
+            await asyncio.gather(*tasks)
+            await process.communicate()
+        except asyncio.CancelledError:
+            await terminate_process_group(process, self.executions.grace_period)
+            raise
+        finally:
+            if timeout_task is not None:
+                timeout_task.cancel()
+            if results_transport is not None:
+                results_transport.close()
+        return process.returncode
+
+    async def run_in_worker(self, executor: Executor, passed_params, out_func, execution: Execution, running_msg):
+        """Runs the executor as a job of one of its warm workers, returns the exit code of the job"""
+        stdout_processor = StdOutLineProcessor(None, self.session, executor, self.spool, self.quiet,
+                                               self.target, self.dedup)
+        execution.stdout_processor = stdout_processor
+        timeout_task = None
+
+        async def on_start(process):
+            nonlocal timeout_task
+            execution.started(process)
+            await out_func(self.running_status(executor, execution, running_msg))
+            if executor.timeout is not None:
+                timeout_task = asyncio.create_task(self.stop_on_timeout(executor, execution))
+
+        start = time.monotonic()
+        try:
+            return await self.worker_pools[executor.name].run(passed_params, stdout_processor.process_result,
+                                                              on_start)
+        finally:
+            if timeout_task is not None:
+                timeout_task.cancel()
+            await stdout_processor.close(time.monotonic() - start)
+
+    def running_status(self, executor: Executor, execution: Execution, running_msg):
+        return json_utils.dumps({
+            "action": "RUN_STATUS",
+            "executor_name": executor.name,
+            "running": True,
+            "message": running_msg,
+            **execution.status_fields()
+        })
+
+    async def stop_on_timeout(self, executor: Executor, execution: Execution):
+        await asyncio.sleep(executor.timeout)
+        logger.warning(f"Executor {executor.name} still running after {executor.timeout} seconds, stopping it")
+        execution.limit_reached = TIMEOUT
+        await terminate_process_group(execution.process, self.executions.grace_period)
+
+    @staticmethod
+    def limit_reached(executor: Executor, returncode: int):
+        """Guesses the limit that stopped the executor from the signal that killed it. An executor that
+        handles a failed allocation and exits by itself is just a failed one"""
+        sig = exit_signal(returncode)
+        if sig == signal.SIGXCPU and executor.cpu_time is not None:
+            return CPU_TIME
+        if sig in [signal.SIGKILL, signal.SIGSEGV, signal.SIGABRT] and \
+                (executor.max_memory is not None or executor.max_rss is not None):
+            return MEMORY
+        return None
+
+    def worker_spawner(self, executor: Executor):
+        async def spawn():
+            return await self.create_process(executor, {}, worker=True)
+        return spawn
+
+    async def close_workers(self):
+        await asyncio.gather(*[pool.close() for pool in self.worker_pools.values()])
+        if self.output_processes is not None:
+            await self.output_processes.close()
+
+    async def create_process(self, executor: Executor, args, worker: bool = False, stdout: int = None,
+                             results: int = None):
+        """Starts the executor, or one of its persistent workers, which gets the jobs through its stdin.
+        Its stdout is a new pipe unless stdout is given. The results file descriptor is inherited as its
+        result channel"""
+        if not isinstance(args, dict):
             logger.error("Args from data received has a not supported type")
             raise ValueError("Args from data received has a not supported type")
-        for varenv, value in executor.varenvs.items():
-            env[f"{varenv.upper()}"] = value
-        process = await asyncio.create_subprocess_shell(
-            executor.cmd,
-            stdout=asyncio.subprocess.PIPE,
+        env = executor.base_env.copy()
+        for k in args:
+            env[f"EXECUTOR_CONFIG_{k.upper()}"] = str(args[k])
+        if worker:
+            env[WORKER_ENV] = "1"
+        if results is not None:
+            env[RESULT_CHANNEL_ENV] = f"/dev/fd/{results}"
+        options = dict(
+            stdin=asyncio.subprocess.PIPE if worker else None,
+            stdout=stdout if stdout is not None else asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE,
             env=env,
-            limit=executor.max_size
+            limit=executor.max_size,
             # If the config is not set, use async.io default
+            start_new_session=True,  # Its own process group, to cancel its children too
+            preexec_fn=executor.worker_preexec_fn if worker else executor.preexec_fn,
+            pass_fds=(results,) if results is not None else (),
         )
+        start = time.monotonic()
+        if executor.argv is not None:
+            process = await asyncio.create_subprocess_exec(*executor.argv, **options)
+        else:
+            process = await asyncio.create_subprocess_shell(executor.cmd, **options)
+        metrics.SPAWN_DURATION.labels(executor.name).observe(time.monotonic() - start)
         return process
 
     def control_config(self):
@@ -300,3 +818,12 @@ class Dispatcher:
                     raise ValueError(err)
                 value = config.get(section, option) if option in config[section] else None
                 self.__control_dict[section][option](option, value)
+        targets = config[Sections.AGENT].get("targets", None)
+        if targets is not None:
+            control_list(can_repeat=False)("targets", targets)
+            for name in self.target_names():
+                Target.control_config(name)
+
+    @staticmethod
+    def target_names():
+        return [name.strip() for name in config[Sections.AGENT].get("targets", "").split(",") if name.strip()]
@@ -0,0 +1,121 @@
+# Copyright (C) 2019  Infobyte LLC (http://www.infobytesec.com/)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import time
+import uuid
+import asyncio
+
+from faraday_agent_dispatcher import logger as logging
+from faraday_agent_dispatcher.utils.process_utils import terminate_process_group
+
+logger = logging.get_logger()
+
+CANCEL_GRACE_PERIOD = 5.0  # seconds between SIGTERM and SIGKILL
+
+# Limits an execution can reach
+TIMEOUT = "timeout"
+CPU_TIME = "cpu_time"
+MEMORY = "memory"
+
+
+class Execution:
+    """An execution requested by the server, either waiting for a slot or running"""
+
+    def __init__(self, executor_name: str, args: dict, execution_id: str = None, task: asyncio.Task = None):
+        self.id = execution_id or uuid.uuid4().hex
+        self.id_from_server = execution_id is not None
+        self.executor_name = executor_name
+        self.args = args
+        self.task = task
+        self.process = None
+        self.stdout_processor = None
+        self.output_read = {}  # Lines, bytes and results queued by an output process, in multiprocess mode
+        self.start_time = None
+        self.cancelled = False
+        self.limit_reached = None
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process is not None else None
+
+    @property
+    def bytes_processed(self):
+        if self.stdout_processor is not None:
+            return self.stdout_processor.read_bytes
+        return self.output_read.get("bytes", 0)
+
+    @property
+    def upload_queue_depth(self):
+        if self.stdout_processor is not None:
+            return self.stdout_processor.upload_queue.queue.qsize()
+        return self.output_read.get("queued", 0)
+
+    def read_output(self, stats: dict):
+        self.output_read = stats
+
+    def status_fields(self):
+        """Fields added to the RUN_STATUS messages, the server only knows the ids it sent"""
+        return {"execution_id": self.id} if self.id_from_server else {}
+
+    def started(self, process):
+        self.process = process
+        self.start_time = time.time()
+
+    def to_dict(self):
+        return {
+            "execution_id": self.id,
+            "executor_name": self.executor_name,
+            "args": self.args,
+            "pid": self.pid,
+            "start_time": self.start_time,
+            "bytes_processed": self.bytes_processed,
+        }
+
+
+class ExecutionRegistry:
+
+    def __init__(self, grace_period: float = CANCEL_GRACE_PERIOD):
+        self.grace_period = grace_period
+        self.executions = {}
+
+    def __len__(self):
+        return len(self.executions)
+
+    def add(self, executor_name: str, args: dict, execution_id: str = None, task: asyncio.Task = None):
+        execution = Execution(executor_name, args, execution_id, task)
+        self.executions[execution.id] = execution
+        return execution
+
+    def remove(self, execution: Execution):
+        self.executions.pop(execution.id, None)
+
+    def get(self, execution_id: str):
+        return self.executions.get(execution_id)
+
+    def by_executor(self, executor_name: str):
+        return [execution for execution in self.executions.values() if execution.executor_name == executor_name]
+
+    async def cancel(self, execution: Execution):
+        execution.cancelled = True
+        if execution.process is None:
+            logger.info(f"Cancelling queued execution {execution.id} of {execution.executor_name}")
+            if execution.task is not None:
+                execution.task.cancel()
+        else:
+            logger.info(f"Cancelling execution {execution.id} of {execution.executor_name} (pid {execution.pid})")
+            await terminate_process_group(execution.process, self.grace_period)
+
+    async def cancel_all(self):
+        await asyncio.gather(*[self.cancel(execution) for execution in list(self.executions.values())])
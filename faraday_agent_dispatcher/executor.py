@@ -1,16 +1,60 @@
+import os
+
 from faraday_agent_dispatcher.config import Sections
 from faraday_agent_dispatcher.utils.control_values_utils import (
     control_int,
+    control_float,
     control_str,
-    control_bool
+    control_bool,
+    control_choice,
+    parse_bool
+)
+from faraday_agent_dispatcher.batcher import (
+    DEFAULT_BATCH_OBJECTS,
+    DEFAULT_STREAM_BATCH_OBJECTS,
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_BATCH_DELAY
 )
+from faraday_agent_dispatcher.uploader import DEFAULT_UPLOAD_WORKERS, DEFAULT_UPLOAD_QUEUE_SIZE
+from faraday_agent_dispatcher.utils.process_utils import resource_limits, limits_setter, resolve_argv
+from faraday_agent_dispatcher.profiling import PROFILERS
+from faraday_agent_dispatcher.workers import DEFAULT_WORKERS, DEFAULT_MAX_JOBS, DEFAULT_HEALTH_INTERVAL
+from faraday_agent_dispatcher.arguments import ArgumentSchema, ARGUMENT_TYPES, COERCERS, parse_param
+
+
+def optional(value, type_f):
+    return type_f(value) if value is not None else None
 
 
 class Executor:
     __control_dict = {
         Sections.EXECUTOR_DATA: {
            "cmd": control_str,
-           "max_size": control_int(True)
+           "shell": control_bool(True),
+           "max_size": control_int(True),
+           "stream_results": control_bool(True),
+           "passthrough": control_bool(True),
+           "validate_results": control_bool(True),
+           "result_channel": control_bool(True),
+           "framed_output": control_bool(True),
+           "batch_objects": control_int(True),
+           "batch_size": control_int(True),
+           "batch_delay": control_float(True),
+           "merge_hosts": control_bool(True),
+           "upload_workers": control_int(True),
+           "upload_queue_size": control_int(True),
+           "max_concurrent_runs": control_int(True),
+           "timeout": control_float(True),
+           "cpu_time": control_int(True),
+           "max_memory": control_int(True),
+           "max_rss": control_int(True),
+           "max_open_files": control_int(True),
+           "nice": control_int(True),
+           "profile": control_choice(PROFILERS, nullable=True),
+           "persistent": control_bool(True),
+           "workers": control_int(True),
+           "max_jobs": control_int(True),
+           "health_interval": control_float(True),
         }
     }
 
@@ -23,9 +67,56 @@ class Executor:
         varenvs_section = Sections.EXECUTOR_VARENVS.format(name)
         self.cmd = config.get(executor_section, "cmd")
         self.max_size = int(config[executor_section].get("max_size", 64 * 1024))
-        self.params = dict(config[params_section]) if params_section in config else {}
-        self.params = {key: value.lower() in ["t", "true"] for key, value in self.params.items()}
+        self.stream_results = parse_bool(config[executor_section].get("stream_results", "False"))
+        self.passthrough = parse_bool(config[executor_section].get("passthrough", "False"))
+        self.validate_results = parse_bool(config[executor_section].get("validate_results", "True"))
+        self.result_channel = parse_bool(config[executor_section].get("result_channel", "False"))
+        self.framed_output = parse_bool(config[executor_section].get("framed_output", "False"))
+        self.merge_hosts = parse_bool(config[executor_section].get("merge_hosts", "False"))
+        self.batch_objects = int(config[executor_section].get(
+            "batch_objects",
+            DEFAULT_STREAM_BATCH_OBJECTS if self.stream_results or self.merge_hosts else DEFAULT_BATCH_OBJECTS
+        ))
+        self.batch_size = int(config[executor_section].get("batch_size", DEFAULT_BATCH_SIZE))
+        self.batch_delay = float(config[executor_section].get("batch_delay", DEFAULT_BATCH_DELAY))
+        self.upload_workers = int(config[executor_section].get("upload_workers", DEFAULT_UPLOAD_WORKERS))
+        self.upload_queue_size = int(config[executor_section].get("upload_queue_size", DEFAULT_UPLOAD_QUEUE_SIZE))
+        self.max_concurrent_runs = optional(config[executor_section].get("max_concurrent_runs", None), int)
+        self.timeout = optional(config[executor_section].get("timeout", None), float)
+        self.cpu_time = optional(config[executor_section].get("cpu_time", None), int)
+        self.max_memory = optional(config[executor_section].get("max_memory", None), int)
+        self.max_rss = optional(config[executor_section].get("max_rss", None), int)
+        self.max_open_files = optional(config[executor_section].get("max_open_files", None), int)
+        self.nice = optional(config[executor_section].get("nice", None), int)
+        self.profile = config[executor_section].get("profile", None)
+        self.persistent = parse_bool(config[executor_section].get("persistent", "False"))
+        self.workers = int(config[executor_section].get("workers", DEFAULT_WORKERS))
+        self.max_jobs = int(config[executor_section].get("max_jobs", DEFAULT_MAX_JOBS)) or None
+        self.health_interval = float(config[executor_section].get("health_interval", DEFAULT_HEALTH_INTERVAL))
+        self.limits = resource_limits(self.cpu_time, self.max_memory, self.max_rss, self.max_open_files)
+        params = dict(config[params_section]) if params_section in config else {}
+        params = {key: parse_param(value) for key, value in params.items()}
+        params = {key: (parse_bool(mandatory), arg_type, default)
+                  for key, (mandatory, arg_type, default) in params.items()}
+        self.params = {key: mandatory for key, (mandatory, _, _) in params.items()}
+        self.arguments = ArgumentSchema({
+            key: value for key, value in params.items() if key not in config.defaults()
+        })
         self.varenvs = dict(config[varenvs_section]) if varenvs_section in config else {}
+        self.shell = parse_bool(config[executor_section].get("shell", "True"))
+        self.argv = resolve_argv(self.cmd) if not self.shell else None
+        # The environment of every run, which only adds its EXECUTOR_CONFIG_* arguments
+        self.base_env = {**os.environ, **{varenv.upper(): value for varenv, value in self.varenvs.items()}}
+
+    @property
+    def preexec_fn(self):
+        return limits_setter(self.limits, self.nice)
+
+    @property
+    def worker_preexec_fn(self):
+        """The limits of a persistent worker, without the CPU time one, which adds up over all its jobs
+        and is set by the worker for each job instead"""
+        return limits_setter(resource_limits(None, self.max_memory, self.max_rss, self.max_open_files), self.nice)
 
     def control_config(self, name, config):
         if " " in name:
@@ -40,5 +131,12 @@ class Executor:
         params_section = Sections.EXECUTOR_PARAMS.format(name)
         if params_section in config:
             for option in config[params_section]:
-                value = config.get(params_section, option)
-                control_bool(option, value)
\ No newline at end of file
+                mandatory, arg_type, default = parse_param(config.get(params_section, option))
+                control_bool()(option, mandatory)
+                control_choice(ARGUMENT_TYPES)(f"{option} type", arg_type)
+                if default is not None:
+                    try:
+                        COERCERS[arg_type](default)
+                    except ValueError:
+                        raise ValueError(f"Trying to parse {option} default with value {default} and should "
+                                         f"be a {arg_type}")
\ No newline at end of file
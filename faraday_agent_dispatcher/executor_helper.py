@@ -13,18 +13,59 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import json
-from json import JSONDecodeError
+import os
+import time
+import codecs
+import asyncio
 
 from faraday_agent_dispatcher import logger as logging
-from faraday_agent_dispatcher.config import instance as config
+from faraday_agent_dispatcher import metrics
+from faraday_agent_dispatcher.batcher import ResultBatcher
+from faraday_agent_dispatcher.uploader import BulkCreateUploader, UploadQueue
 from faraday_agent_dispatcher.utils.text_utils import Bcolors
-from faraday_agent_dispatcher.utils.url_utils import api_url
+from faraday_agent_dispatcher.utils import json_utils
+from faraday_agent_dispatcher.utils.json_utils import JSONDecodeError
+from faraday_agent_dispatcher.utils.json_stream import HostsStreamParser, HOST_EVENT, DOCUMENT_EVENT
+from faraday_agent_dispatcher.validation import validate_document
+from faraday_agent_dispatcher.utils.framing import read_frame, RESULT, LOG, PROGRESS
 
 from aiohttp import ClientSession
 
 logger = logging.get_logger()
 
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class PipeOutput:
+    """Stands for the executor process where only a pipe with its results is read, as its stdout"""
+
+    def __init__(self, stdout: asyncio.StreamReader):
+        self.stdout = stdout
+
+
+async def open_read_pipe(fd: int, limit: int):
+    """Returns a StreamReader of the read end of a pipe, and the transport to close when done"""
+    reader = asyncio.StreamReader(limit=limit)
+    transport, _ = await asyncio.get_running_loop().connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(fd, "rb", 0)
+    )
+    return reader, transport
+
+
+async def read_whole_line(reader: asyncio.StreamReader) -> bytes:
+    """Like readline, without the limit of the reader"""
+    chunks = []
+    while True:
+        try:
+            chunks.append(await reader.readuntil(b"\n"))
+            break
+        except asyncio.LimitOverrunError as e:
+            chunks.append(await reader.readexactly(e.consumed))
+        except asyncio.IncompleteReadError as e:
+            chunks.append(e.partial)
+            break
+    return b"".join(chunks)
+
 
 class FileLineProcessor:
 
@@ -60,55 +101,187 @@ class FileLineProcessor:
 
 class StdOutLineProcessor(FileLineProcessor):
 
-    def __init__(self, process, session: ClientSession):
+    def __init__(self, process, session: ClientSession, executor=None, spool=None, quiet: bool = False,
+                 target=None, dedup=None):
         super().__init__("stdout")
         self.process = process
-        self.__session = session
+        self.quiet = quiet  # Neither echoes nor logs each line, for high throughput executors
+        self.uploader = BulkCreateUploader(session, spool, target=target, dedup=dedup)
+        if executor is not None:
+            self.upload_queue = UploadQueue(self.uploader.upload,
+                                            workers=executor.upload_workers,
+                                            max_size=executor.upload_queue_size)
+            self.batcher = ResultBatcher(self.upload_queue.put,
+                                         max_objects=executor.batch_objects,
+                                         max_size=executor.batch_size,
+                                         max_delay=executor.batch_delay,
+                                         merge_hosts=executor.merge_hosts)
+        else:
+            self.upload_queue = UploadQueue(self.uploader.upload)
+            self.batcher = ResultBatcher(self.upload_queue.put)
+        self.stream_results = executor is not None and executor.stream_results
+        self.framed_output = executor is not None and executor.framed_output
+        self.passthrough = executor is not None and executor.passthrough
+        self.validate_results = executor is None or executor.validate_results
+        self.max_size = executor.max_size if executor is not None else None
+        # The results of the result channel are read without the max_size limit
+        self.whole_lines = executor is not None and executor.result_channel
+        self.read_lines = 0
+        self.read_bytes = 0
+        executor_name = executor.name if executor is not None else ""
+        self.executor_name = executor_name
+        self.progress = None  # The last progress record of a framed output
+        self.lines_metric = metrics.STDOUT_LINES.labels(executor_name)
+        self.bytes_metric = metrics.STDOUT_BYTES.labels(executor_name)
+        self.parse_errors_metric = metrics.PARSE_ERRORS.labels(executor_name)
+        self.invalid_objects_metric = metrics.INVALID_OBJECTS.labels(executor_name)
 
     async def next_line(self):
-        line = await self.process.stdout.readline()
+        if self.whole_lines:
+            line = await read_whole_line(self.process.stdout)
+        else:
+            line = await self.process.stdout.readline()
+        self.read_lines += 1
+        self.read_bytes += len(line)
+        self.lines_metric.inc()
+        self.bytes_metric.inc(len(line))
         line = line.decode('utf-8')
         return line[:-1]
 
     @staticmethod
     def post_url():
-        host = config.get('server', 'host')
-        port = config.get('server', 'api_port')
-        return api_url(host, port, postfix=f"/_api/v2/ws/{config.get('server', 'workspace')}/bulk_create/")
+        return BulkCreateUploader.post_url()
+
+    async def process_f(self):
+        start = time.monotonic()
+        try:
+            if self.framed_output:
+                return await self.process_frames()
+            if self.stream_results:
+                return await self.process_stream()
+            return await super().process_f()
+        finally:
+            await self.close(time.monotonic() - start)
+
+    async def close(self, read_time):
+        """Sends the pending results and waits for their uploads"""
+        try:
+            await self.batcher.close()
+        finally:
+            await self.upload_queue.close()
+            self.log_stats(read_time)
+
+    async def process_result(self, payload: bytes):
+        """Processes a result received through a channel other than the stdout of the process"""
+        self.read_lines += 1
+        self.read_bytes += len(payload)
+        self.lines_metric.inc()
+        self.bytes_metric.inc(len(payload))
+        try:
+            line = payload.decode('utf-8')
+        except UnicodeDecodeError as e:
+            self.parse_errors_metric.inc()
+            logger.error(f"Result of {self.executor_name} discarded, it is not valid UTF-8: {e}")
+            return
+        await self.processing(line)
 
     async def processing(self, line):
         try:
-            loaded_json = json.loads(line)
-            print(f"{Bcolors.OKBLUE}{line}{Bcolors.ENDC}")
-            headers = [("authorization", "agent {}".format(config.get("tokens", "agent")))]
-
-            res = await self.__session.post(
-                self.post_url(),
-                json=loaded_json,
-                headers=headers,
-                raise_for_status=False,
-            )
-            if res.status == 201:
-                logger.info("Data sent to bulk create")
-            else:
-                logger.error(
-                    "Invalid data supplied by the executor to the bulk create "
-                    "endpoint. Server responded: {} {}".format(res.status, await res.text())
-                    )
+            loaded_json = json_utils.loads(line)
+            if not self.quiet:
+                print(f"{Bcolors.OKBLUE}{line}{Bcolors.ENDC}")
+            await self.add_result(loaded_json, len(line), line.encode() if self.passthrough else None)
 
         except JSONDecodeError as e:
+            self.parse_errors_metric.inc()
             logger.error("JSON Parsing error: {}".format(e))
             print(f"{Bcolors.WARNING}JSON Parsing error: {e}{Bcolors.ENDC}")
 
+    async def process_frames(self):
+        """Reads the output as length prefixed records, so the results are read with exact size reads,
+        neither limited by max_size nor split by their newlines"""
+        while True:
+            try:
+                frame = await read_frame(self.process.stdout)
+            except ValueError as e:
+                self.parse_errors_metric.inc()
+                logger.error(f"Framed output of {self.executor_name} broken, discarding the rest of it: {e}")
+                while await self.process.stdout.read(STREAM_CHUNK_SIZE):
+                    pass  # So the executor is not blocked writing
+                break
+            if frame is None:
+                break
+            frame_type, payload = frame
+            if frame_type == RESULT:
+                await self.process_result(payload)
+            elif frame_type == PROGRESS:
+                self.progress = payload.decode('utf-8', errors='replace')
+                logger.info(f"Progress of {self.executor_name}: {self.progress}")
+            elif frame_type == LOG:
+                logger.info(f"{self.executor_name}: {payload.decode('utf-8', errors='replace')}")
+
+    async def add_result(self, document, size: int = 0, raw: bytes = None):
+        """Batches the document without the objects the bulk create endpoint would reject, so they do not
+        make it reject the rest of the batch"""
+        if self.validate_results:
+            valid_document, errors = validate_document(document)
+            for error in errors:
+                self.invalid_objects_metric.inc()
+                logger.error(f"Invalid result discarded: {error}")
+                print(f"{Bcolors.WARNING}Invalid result discarded: {error}{Bcolors.ENDC}")
+            if valid_document is None:
+                return
+            if valid_document is not document:
+                document, raw = valid_document, None  # The raw bytes have the discarded objects
+        await self.batcher.add(document, size, raw)
+
+    async def process_stream(self):
+        """Parses the output as a stream of bulk create documents, sending the hosts as soon as
+        they are read, so the output does not need to fit in max_size"""
+        parser = HostsStreamParser(self.max_size)
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        while True:
+            chunk = await self.process.stdout.read(STREAM_CHUNK_SIZE)
+            self.read_bytes += len(chunk)
+            self.bytes_metric.inc(len(chunk))
+            events = parser.feed(decoder.decode(chunk, final=not chunk)) if chunk else parser.close()
+            for event, value, size in events:
+                await self.processing_event(event, value, size)
+            if not chunk:
+                break
+        print(f"{Bcolors.WARNING}{self.name} sent empty data, {Bcolors.ENDC}")
+
+    async def processing_event(self, event, value, size):
+        if event == HOST_EVENT:
+            if not self.quiet:
+                logger.debug(f"Output host: {value.get('ip') if isinstance(value, dict) else value}")
+            await self.add_result({"hosts": [value]}, size)
+        elif event == DOCUMENT_EVENT:
+            if value:  # Other keys of the document, as the command
+                await self.add_result({"hosts": [], **value})
+        else:
+            self.parse_errors_metric.inc()
+            logger.error("JSON Parsing error: {}".format(value))
+            print(f"{Bcolors.WARNING}JSON Parsing error: {value}{Bcolors.ENDC}")
+
     def log(self, line):
-        logger.debug(f"Output line: {line}")
+        if not self.quiet:
+            logger.debug(f"Output line: {line}")
+
+    def log_stats(self, read_time):
+        read_time = max(read_time, 1e-6)
+        logger.info(f"Stdout: {self.read_lines} lines ({self.read_bytes} bytes) read in {read_time:.2f} s, "
+                    f"{self.read_lines / read_time:.1f} lines/s, {self.read_bytes / read_time:.1f} bytes/s, "
+                    f"{self.upload_queue.put_wait:.2f} s waiting for the upload queue")
+        self.uploader.log_stats()
 
 
 class StdErrLineProcessor(FileLineProcessor):
 
-    def __init__(self, process):
+    def __init__(self, process, quiet: bool = False):
         super().__init__("stderr")
         self.process = process
+        self.quiet = quiet
 
     async def next_line(self):
         line = await self.process.stderr.readline()
@@ -116,7 +289,30 @@ class StdErrLineProcessor(FileLineProcessor):
         return line[:-1]
 
     async def processing(self, line):
-        print(f"{Bcolors.FAIL}{line}{Bcolors.ENDC}")
+        if not self.quiet:
+            print(f"{Bcolors.FAIL}{line}{Bcolors.ENDC}")
+
+    def log(self, line):
+        if not self.quiet:
+            logger.debug(f"Error line: {line}")
+
+
+class StdOutLogProcessor(StdErrLineProcessor):
+    """Logs the stdout of the executors which send their results through the result channel"""
+
+    def __init__(self, process, quiet: bool = False):
+        super().__init__(process, quiet)
+        self.name = "stdout"
+
+    async def next_line(self):
+        line = await self.process.stdout.readline()
+        line = line.decode('utf-8')
+        return line[:-1]
+
+    async def processing(self, line):
+        if not self.quiet:
+            print(line)
 
     def log(self, line):
-        logger.debug(f"Error line: {line}")
+        if not self.quiet:
+            logger.debug(f"Output line: {line}")
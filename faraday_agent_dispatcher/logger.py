@@ -14,6 +14,8 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import os
+import queue
+import atexit
 import logging
 import logging.handlers
 import errno
@@ -31,6 +33,7 @@ MAX_LOG_FILE_BACKUP_COUNT = 5
 ROOT_LOGGER = u'faraday_agent_dispatcher'
 LOGGING_HANDLERS = []
 LVL_SETTABLE_HANDLERS = []
+LISTENER = None
 
 
 def setup_logging():
@@ -44,8 +47,7 @@ def setup_logging():
     else:
         formatter = logging.Formatter(
             '%(asctime)s - %(name)s - %(levelname)s {%(threadName)s} [%(filename)s:%(lineno)s - %(funcName)s()]  %(message)s')
-    setup_console_logging(formatter)
-    setup_file_logging(formatter)
+    setup_queue_logging([setup_console_logging(formatter), setup_file_logging(formatter)])
 
 
 def setup_console_logging(formatter):
@@ -53,8 +55,8 @@ def setup_console_logging(formatter):
     console_handler.setFormatter(formatter)
     console_handler.setLevel(config.LOGGING_LEVEL)
     console_handler.name = "CONSOLE_HANDLER"
-    add_handler(console_handler)
     LVL_SETTABLE_HANDLERS.append(console_handler)
+    return console_handler
 
 
 def setup_file_logging(formatter):
@@ -64,7 +66,38 @@ def setup_file_logging(formatter):
     file_handler.setFormatter(formatter)
     file_handler.setLevel(logging.DEBUG)
     file_handler.name = "FILE_HANDLER"
-    add_handler(file_handler)
+    return file_handler
+
+
+def setup_queue_logging(handlers):
+    """The records are only queued by the logging calls, a background thread writes them to the console
+    and the log file, so a slow terminal or disk doesn't block the event loop"""
+    global LISTENER
+    stop_queue_logging()
+    records = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(records)
+    queue_handler.name = "QUEUE_HANDLER"
+    add_handler(queue_handler)
+    LOGGING_HANDLERS.extend(handlers)
+    LISTENER = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    LISTENER.start()
+
+
+def stop_queue_logging():
+    """Writes the queued records and stops the background writer"""
+    global LISTENER
+    if LISTENER is not None:
+        LISTENER.stop()
+        for handler in LISTENER.handlers:
+            handler.close()
+            if handler in LVL_SETTABLE_HANDLERS:
+                LVL_SETTABLE_HANDLERS.remove(handler)
+            if handler in LOGGING_HANDLERS:
+                LOGGING_HANDLERS.remove(handler)
+        LISTENER = None
+
+
+atexit.register(stop_queue_logging)
 
 
 def add_handler(handler):
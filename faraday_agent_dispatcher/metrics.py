@@ -0,0 +1,301 @@
+# Copyright (C) 2019  Infobyte LLC (http://www.infobytesec.com/)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import bisect
+
+from aiohttp import web
+
+from faraday_agent_dispatcher import logger as logging
+
+logger = logging.get_logger()
+
+DEFAULT_METRICS_HOST = "127.0.0.1"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DURATION_BUCKETS = (1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 1800.0, 3600.0, 7200.0, 21600.0)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra=None):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A metric with its children by label values. The hot paths keep the child returned by ``labels``,
+    so an observation is only an attribute update"""
+
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self.new_child()
+        return child
+
+    def new_child(self):
+        raise NotImplementedError("Must be implemented")
+
+    def samples(self):
+        raise NotImplementedError("Must be implemented")
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(f"{name}{labels} {format_value(value)}" for name, labels, value in self.samples())
+        return "\n".join(lines)
+
+    def clear(self):
+        self.children = {}
+
+    def snapshot(self):
+        """Returns the values of the children by their label values, None if the metric is not added up
+        over processes"""
+        return None
+
+
+class CounterChild:
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def new_child(self):
+        return CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def snapshot(self):
+        return {values: child.value for values, child in self.children.items()}
+
+    @staticmethod
+    def subtract(value, previous):
+        return value - previous
+
+    def merge(self, values, value):
+        self.labels(*values).inc(value)
+
+    def samples(self):
+        for values, child in self.children.items():
+            yield self.name, format_labels(self.labelnames, values), child.value
+
+
+class GaugeChild(CounterChild):
+
+    def set(self, value):
+        self.value = value
+
+
+class Gauge(Metric):
+    """A gauge either set by the code or read from ``function`` when the metrics are collected"""
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.function = None
+
+    def new_child(self):
+        return GaugeChild()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def set_function(self, function):
+        self.function = function
+
+    def samples(self):
+        if self.function is not None:
+            yield self.name, "", self.function()
+            return
+        for values, child in self.children.items():
+            yield self.name, format_labels(self.labelnames, values), child.value
+
+
+class HistogramChild:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def new_child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def snapshot(self):
+        return {values: (tuple(child.counts), child.sum) for values, child in self.children.items()}
+
+    @staticmethod
+    def subtract(value, previous):
+        return tuple(count - previous_count for count, previous_count in zip(value[0], previous[0])), \
+            value[1] - previous[1]
+
+    def merge(self, values, value):
+        child = self.labels(*values)
+        for bucket, added in enumerate(value[0]):
+            child.counts[bucket] += added
+        child.sum += value[1]
+
+    def samples(self):
+        for values, child in self.children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                le = f'le="{format_value(bound)}"'
+                yield f"{self.name}_bucket", format_labels(self.labelnames, values, le), cumulative
+            yield f"{self.name}_sum", format_labels(self.labelnames, values), child.sum
+            yield f"{self.name}_count", format_labels(self.labelnames, values), cumulative
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: Metric):
+        self.metrics.append(metric)
+
+    def snapshot(self):
+        """Returns the values of the counters and histograms, the gauges are only kept by the process
+        which sets them"""
+        snapshots = {metric.name: metric.snapshot() for metric in self.metrics}
+        return {name: snapshot for name, snapshot in snapshots.items() if snapshot is not None}
+
+    def delta(self, snapshot: dict, previous: dict):
+        """Returns what the values of the snapshot added to the previous one"""
+        metrics = {metric.name: metric for metric in self.metrics}
+        delta = {}
+        for name, values in snapshot.items():
+            previous_values = previous.get(name, {})
+            changed = {
+                labels: metrics[name].subtract(value, previous_values[labels]) if labels in previous_values else value
+                for labels, value in values.items() if previous_values.get(labels) != value
+            }
+            if changed:
+                delta[name] = changed
+        return delta
+
+    def merge(self, delta: dict):
+        """Adds the values collected by another process, as its output processes"""
+        metrics = {metric.name: metric for metric in self.metrics}
+        for name, values in delta.items():
+            for labels, value in values.items():
+                metrics[name].merge(labels, value)
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+    def clear(self):
+        for metric in self.metrics:
+            metric.clear()
+
+
+REGISTRY = MetricsRegistry()
+
+RUNS = Counter("faraday_dispatcher_runs_total", "Executions requested by the server, by outcome",
+               ["executor", "outcome"])
+EXECUTION_DURATION = Histogram("faraday_dispatcher_execution_duration_seconds",
+                               "Duration of the executions, from the spawn to the exit",
+                               ["executor"], buckets=DURATION_BUCKETS)
+SPAWN_DURATION = Histogram("faraday_dispatcher_spawn_duration_seconds", "Time to spawn the executor processes",
+                           ["executor"])
+STDOUT_LINES = Counter("faraday_dispatcher_stdout_lines_total", "Lines read from the executors stdout",
+                       ["executor"])
+STDOUT_BYTES = Counter("faraday_dispatcher_stdout_bytes_total", "Bytes read from the executors stdout",
+                       ["executor"])
+PARSE_ERRORS = Counter("faraday_dispatcher_json_parse_errors_total", "Executor outputs that are not valid JSON",
+                       ["executor"])
+INVALID_OBJECTS = Counter("faraday_dispatcher_invalid_objects_total",
+                          "Executor results discarded because the bulk create endpoint would reject them",
+                          ["executor"])
+BULK_CREATE_DURATION = Histogram("faraday_dispatcher_bulk_create_duration_seconds",
+                                 "Latency of the bulk create requests")
+BULK_CREATE_RESPONSES = Counter("faraday_dispatcher_bulk_create_responses_total",
+                                "Bulk create responses by status code, error for connection errors", ["status"])
+RUNNING_EXECUTIONS = Gauge("faraday_dispatcher_running_executions", "Executions running")
+QUEUED_EXECUTIONS = Gauge("faraday_dispatcher_queued_executions", "Executions waiting for a free slot")
+UPLOAD_QUEUE_DEPTH = Gauge("faraday_dispatcher_upload_queue_depth", "Results waiting to be uploaded")
+SPOOL_BYTES = Gauge("faraday_dispatcher_spool_bytes", "Bytes of results spooled to disk")
+PENDING_MESSAGES = Gauge("faraday_dispatcher_pending_messages", "Messages waiting for the websocket connection")
+WEBSOCKET_RECONNECTS = Counter("faraday_dispatcher_websocket_reconnects_total", "Websocket reconnections")
+DEDUP_OBJECTS = Counter("faraday_dispatcher_dedup_objects_total",
+                        "Hosts, services, vulns and credentials looked up in the dedup cache, by hit or miss",
+                        ["result"])
+
+
+class MetricsServer:
+    """Serves the metrics in the Prometheus text format at /metrics"""
+
+    def __init__(self, port: int, host: str = DEFAULT_METRICS_HOST, registry: MetricsRegistry = REGISTRY):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self.runner = None
+
+    async def handle(self, request):
+        return web.Response(body=self.registry.render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        logger.info(f"Serving metrics at http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
@@ -0,0 +1,319 @@
+# Copyright (C) 2019  Infobyte LLC (http://www.infobytesec.com/)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import asyncio
+import itertools
+import threading
+import logging as std_logging
+import multiprocessing
+from multiprocessing.reduction import send_handle, recv_handle
+
+from aiohttp import ClientSession
+
+from faraday_agent_dispatcher import logger as logging
+from faraday_agent_dispatcher import metrics
+from faraday_agent_dispatcher.config import instance as config, Sections, reset_config
+from faraday_agent_dispatcher.dedup import build_dedup_cache
+from faraday_agent_dispatcher.executor import Executor
+from faraday_agent_dispatcher.executor_helper import StdOutLineProcessor, PipeOutput, open_read_pipe
+from faraday_agent_dispatcher.targets import Target
+from faraday_agent_dispatcher.utils import json_utils
+
+logger = logging.get_logger()
+
+# Messages between the dispatcher and its output processes
+PROCESS = "process"  # The stdout of an execution, followed by its file descriptor
+DONE = "done"
+SPOOL = "spool"
+LOG = "log"
+METRICS = "metrics"  # What the counters and histograms added, and the output read and queued by each job
+STOP = None
+
+STOP_TIMEOUT = 30  # seconds waiting the output processes to finish their uploads
+METRICS_INTERVAL = 5  # seconds between the metrics sent by the output processes
+
+
+class ForwardingHandler(std_logging.Handler):
+    """Sends the log records of an output process to the dispatcher, which writes them"""
+
+    def __init__(self, send):
+        super().__init__()
+        self.send = send
+
+    def emit(self, record):
+        try:
+            self.send((LOG, {
+                "name": record.name,
+                "levelno": record.levelno,
+                "levelname": record.levelname,
+                "msg": record.getMessage(),
+                "pathname": record.pathname,
+                "filename": record.filename,
+                "lineno": record.lineno,
+                "funcName": record.funcName,
+                "created": record.created,
+                "threadName": f"output-{os.getpid()}",
+            }))
+        except Exception:
+            self.handleError(record)
+
+
+class SpoolForwarder:
+    """Spool of the output processes, the results are appended to the spool of the dispatcher"""
+
+    pending = False  # Only the dispatcher knows it, so the results are sent meanwhile
+
+    def __init__(self, send):
+        self.send = send
+
+    def append(self, workspace: str, data, target: str = None):
+        self.send((SPOOL, workspace, data, target))
+
+
+class OutputWorker:
+    """Processes and uploads the stdout of the executions sent by the dispatcher, in its own event loop"""
+
+    def __init__(self, connection, quiet: bool):
+        self.connection = connection
+        self.quiet = quiet
+        self.send_lock = threading.Lock()
+        self.executors = {}
+        self.jobs = set()
+        self.processors = {}  # job id: StdOutLineProcessor of the running jobs
+        self.metrics_snapshot = {}  # Values of the metrics last sent to the dispatcher
+        self.session = None
+        self.stopped = None
+        self.dedup = build_dedup_cache()  # Each output process remembers the results it uploaded
+
+    def send(self, message):
+        with self.send_lock:
+            self.connection.send(message)
+
+    def send_metrics(self):
+        """Sends what the metrics added since the last call, the dispatcher adds it to its own ones"""
+        snapshot = metrics.REGISTRY.snapshot()
+        delta = metrics.REGISTRY.delta(snapshot, self.metrics_snapshot)
+        self.metrics_snapshot = snapshot
+        read = {
+            job_id: {"lines": processor.read_lines, "bytes": processor.read_bytes,
+                     "queued": processor.upload_queue.queue.qsize()}
+            for job_id, processor in self.processors.items()
+        }
+        if delta or read:
+            self.send((METRICS, delta, read))
+
+    async def report_metrics(self):
+        while True:
+            await asyncio.sleep(METRICS_INTERVAL)
+            self.send_metrics()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.stopped = loop.create_future()
+        loop.add_reader(self.connection.fileno(), self.on_message)
+        reporter = asyncio.create_task(self.report_metrics())
+        try:
+            async with ClientSession() as session:
+                self.session = session
+                await self.stopped
+                if self.jobs:
+                    await asyncio.gather(*self.jobs)
+        finally:
+            reporter.cancel()
+            loop.remove_reader(self.connection.fileno())
+
+    def on_message(self):
+        try:
+            message = self.connection.recv()
+        except (EOFError, OSError):
+            message = STOP  # The dispatcher is gone
+        if message is STOP:
+            if not self.stopped.done():
+                self.stopped.set_result(None)
+            return
+        _, job_id, executor_name, target_name, agent_token = message
+        fd = recv_handle(self.connection)
+        task = asyncio.create_task(self.process(job_id, executor_name, target_name, agent_token, fd))
+        self.jobs.add(task)
+        task.add_done_callback(self.jobs.discard)
+
+    def executor(self, name: str):
+        if name not in self.executors:
+            self.executors[name] = Executor(name, config)
+        return self.executors[name]
+
+    async def process(self, job_id: int, executor_name: str, target_name: str, agent_token: str, fd: int):
+        transport = None
+        try:
+            executor = self.executor(executor_name)
+            target = Target(target_name)
+            target.agent_token = agent_token
+            reader, transport = await open_read_pipe(fd, executor.max_size)
+            processor = StdOutLineProcessor(PipeOutput(reader), self.session, executor, SpoolForwarder(self.send),
+                                            self.quiet, target, self.dedup)
+            self.processors[job_id] = processor
+            await processor.process_f()
+            stats = {"lines": processor.read_lines, "bytes": processor.read_bytes}
+        except Exception as e:
+            logger.exception(f"Error processing the output of {executor_name} executor")
+            stats = {"error": str(e)}
+        finally:
+            self.processors.pop(job_id, None)
+            if transport is not None:
+                transport.close()
+        self.send_metrics()  # Before the result, so the dispatcher has them once the execution ends
+        self.send((DONE, job_id, stats))
+
+
+def forward_logs(send):
+    """Sends the log records of this output process to the dispatcher instead of writing them. The spawned
+    process imports the main module again, which may have set up the logging of the dispatcher"""
+    logging.stop_queue_logging()
+    root_logger = std_logging.getLogger(logging.ROOT_LOGGER)
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+        handler.close()
+    root_logger.propagate = False
+    root_logger.setLevel(std_logging.DEBUG)
+    root_logger.addHandler(ForwardingHandler(send))
+
+
+def output_process_main(connection, config_path, quiet: bool):
+    reset_config(config_path)
+    json_utils.set_backend(config[Sections.AGENT].get("json_backend", json_utils.DEFAULT_BACKEND))
+    worker = OutputWorker(connection, quiet)
+    forward_logs(worker.send)
+    asyncio.run(worker.run())
+
+
+class OutputProcess:
+
+    def __init__(self, process, connection):
+        self.process = process
+        self.connection = connection
+        self.jobs = {}
+        self.on_read = {}  # job id: callback taking the lines and bytes read so far
+
+
+class OutputProcessPool:
+    """Processes which parse and upload the output of the executions, so a noisy executor does not
+    delay the websocket nor the other executions. The dispatcher only spawns the executors and passes
+    the read end of their stdout to the output process with less executions"""
+
+    def __init__(self, size: int, config_path, quiet: bool = False, spool_of=None):
+        self.size = size
+        self.config_path = config_path
+        self.quiet = quiet
+        self.spool_of = spool_of  # Returns the spool of a target by its name
+        self.context = multiprocessing.get_context("spawn")  # Forking a running event loop is unsafe
+        self.processes = []
+        self.job_ids = itertools.count()
+        self.closing = False
+
+    def start(self):
+        """Starts the missing output processes"""
+        loop = asyncio.get_event_loop()
+        while len(self.processes) < self.size:
+            connection, child_connection = self.context.Pipe()
+            process = self.context.Process(target=output_process_main,
+                                           args=(child_connection, str(self.config_path), self.quiet),
+                                           name="dispatcher-output", daemon=True)
+            process.start()
+            child_connection.close()
+            output_process = OutputProcess(process, connection)
+            loop.add_reader(connection.fileno(), self.on_message, output_process)
+            self.processes.append(output_process)
+            logger.info(f"Started output process {process.pid}")
+
+    async def process(self, executor: Executor, target: Target, fd: int, on_read=None):
+        """Processes the output read from the file descriptor, which is closed in this process, in an
+        output process. Returns when it is uploaded. on_read is called with the lines and bytes read and
+        the results waiting to be uploaded meanwhile, every METRICS_INTERVAL seconds"""
+        try:
+            self.start()
+            output_process = min(self.processes, key=lambda candidate: len(candidate.jobs))
+            job_id = next(self.job_ids)
+            future = asyncio.get_event_loop().create_future()
+            output_process.jobs[job_id] = future
+            if on_read is not None:
+                output_process.on_read[job_id] = on_read
+            output_process.connection.send((PROCESS, job_id, executor.name, target.name, target.agent_token))
+            send_handle(output_process.connection, fd, output_process.process.pid)
+        finally:
+            os.close(fd)
+        stats = await future
+        if "error" in stats:
+            raise RuntimeError(f"Output of {executor.name} executor not processed: {stats['error']}")
+        if on_read is not None:
+            on_read({**stats, "queued": 0})
+        return stats
+
+    def on_message(self, output_process: OutputProcess):
+        try:
+            message = output_process.connection.recv()
+        except (EOFError, OSError):
+            self.remove(output_process)
+            return
+        if message[0] == LOG:
+            logger.handle(std_logging.makeLogRecord(message[1]))
+        elif message[0] == SPOOL:
+            _, workspace, data, target = message
+            spool = self.spool_of(target) if self.spool_of is not None else None
+            if spool is not None:
+                spool.append(workspace, data, target)
+        elif message[0] == METRICS:
+            _, delta, read = message
+            metrics.REGISTRY.merge(delta)
+            for job_id, stats in read.items():
+                if job_id in output_process.on_read:
+                    output_process.on_read[job_id](stats)
+        elif message[0] == DONE:
+            _, job_id, stats = message
+            output_process.on_read.pop(job_id, None)
+            future = output_process.jobs.pop(job_id, None)
+            if future is not None and not future.done():
+                future.set_result(stats)
+
+    def remove(self, output_process: OutputProcess):
+        """Forgets an output process which exited, the next execution starts another one"""
+        asyncio.get_event_loop().remove_reader(output_process.connection.fileno())
+        if output_process in self.processes:
+            self.processes.remove(output_process)
+            if not self.closing:
+                logger.warning(f"Output process {output_process.process.pid} exited")
+        for future in output_process.jobs.values():
+            if not future.done():
+                future.set_result({"error": "its output process exited"})
+        output_process.jobs.clear()
+        output_process.on_read.clear()
+        output_process.connection.close()
+
+    async def close(self):
+        self.closing = True
+        processes = list(self.processes)
+        for output_process in processes:
+            try:
+                output_process.connection.send(STOP)
+            except OSError:
+                pass
+        loop = asyncio.get_event_loop()
+        for output_process in processes:
+            await loop.run_in_executor(None, output_process.process.join, STOP_TIMEOUT)
+            if output_process.process.is_alive():
+                output_process.process.kill()
+            if output_process in self.processes:
+                self.remove(output_process)
+        self.closing = False
@@ -0,0 +1,214 @@
+# Copyright (C) 2019  Infobyte LLC (http://www.infobytesec.com/)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import sys
+import json
+import time
+import asyncio
+import cProfile
+import threading
+from pathlib import Path
+from collections import Counter
+from contextlib import asynccontextmanager
+
+from faraday_agent_dispatcher import config
+from faraday_agent_dispatcher import logger as logging
+
+logger = logging.get_logger()
+
+CPROFILE = "cprofile"
+SAMPLING = "sampling"
+PROFILERS = [CPROFILE, SAMPLING]
+
+SAMPLING_INTERVAL = 0.005   # seconds between stack samples
+LAG_INTERVAL = 0.05         # seconds between event loop lag probes
+SLOW_CALLBACK = 0.1         # seconds blocking the event loop to be reported
+MAX_SLOW_CALLBACKS = 1000   # Slow callbacks kept in the report
+
+
+def profiles_path():
+    return Path(config.LOGS_PATH).expanduser() / "profiles"
+
+
+def sample_stack(thread_id: int, current_line: bool = False):
+    """Returns the stack the thread is running, outermost frame first, with the first line of each
+    function or the line it is running"""
+    frame = sys._current_frames().get(thread_id)
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno if current_line else code.co_firstlineno})")
+        frame = frame.f_back
+    return stack[::-1]
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up a sleeping task, which is the time spent in callbacks
+    that block it. A watchdog thread samples the stack of the event loop thread when it is blocked over
+    the threshold, to tell which callback blocks it. Unlike the asyncio debug mode, it costs nothing
+    outside the profiled execution"""
+
+    def __init__(self, interval: float = LAG_INTERVAL, threshold: float = SLOW_CALLBACK):
+        self.interval = interval
+        self.threshold = threshold
+        self.probes = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self.slow_callbacks = []
+        self.__task = None
+        self.__thread_id = None
+        self.__lock = threading.Lock()
+        self.__tick = None   # When the monitor task went to sleep
+        self.__stack = None  # Stack of the event loop thread while blocked since the tick
+        self.__stop = threading.Event()
+        self.__watchdog = None
+
+    def start(self):
+        self.__thread_id = threading.get_ident()
+        self.__tick = time.monotonic()
+        self.__task = asyncio.create_task(self.__monitor())
+        self.__watchdog = threading.Thread(target=self.__watch, name="dispatcher-lag-watchdog", daemon=True)
+        self.__watchdog.start()
+
+    def stop(self):
+        if self.__task is not None:
+            self.__task.cancel()
+            self.__task = None
+        if self.__watchdog is not None:
+            self.__stop.set()
+            self.__watchdog.join()
+            self.__watchdog = None
+
+    def __watch(self):
+        while not self.__stop.wait(self.interval):
+            with self.__lock:
+                if self.__stack is None and time.monotonic() - self.__tick - self.interval >= self.threshold:
+                    self.__stack = sample_stack(self.__thread_id, current_line=True)
+
+    async def __monitor(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - start - self.interval)
+            with self.__lock:
+                stack, self.__stack = self.__stack, None
+                self.__tick = time.monotonic()
+            self.probes += 1
+            self.total_lag += lag
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.threshold:
+                blocker = f" by {stack[-1]}" if stack else ""
+                logger.debug(f"Event loop blocked for {1000 * lag:.1f} ms{blocker}")
+                if len(self.slow_callbacks) < MAX_SLOW_CALLBACKS:
+                    self.slow_callbacks.append({"time": time.time(), "lag": lag, "stack": stack})
+
+    def report(self):
+        return {
+            "probes": self.probes,
+            "mean_lag": self.total_lag / self.probes if self.probes else 0.0,
+            "max_lag": self.max_lag,
+            "slow_callback_threshold": self.threshold,
+            "slow_callbacks": self.slow_callbacks,
+        }
+
+
+class SamplingProfiler:
+    """Samples the stack of the event loop thread from another thread. The stacks are written in the
+    collapsed format read by flamegraph.pl and speedscope"""
+
+    extension = "folded"
+
+    def __init__(self, interval: float = SAMPLING_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.__thread_id = None
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def start(self):
+        self.__thread_id = threading.get_ident()
+        self.__thread = threading.Thread(target=self.__sample, name="dispatcher-profiler", daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop.set()
+        self.__thread.join()
+
+    def __sample(self):
+        while not self.__stop.wait(self.interval):
+            stack = sample_stack(self.__thread_id)
+            if stack:
+                self.stacks[";".join(stack)] += 1
+
+    def dump(self, path: Path):
+        with path.open("w") as output:
+            for stack, count in self.stacks.most_common():
+                output.write(f"{stack} {count}\n")
+
+
+class CProfiler:
+    """Deterministic profile of everything the event loop runs meanwhile, readable with pstats or
+    snakeviz. Python only has one profiler per thread, so concurrent executions are not profiled"""
+
+    extension = "prof"
+    active = False
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        if CProfiler.active:
+            raise RuntimeError("Another execution is being profiled with cProfile")
+        CProfiler.active = True
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        CProfiler.active = False
+
+    def dump(self, path: Path):
+        self.profile.dump_stats(str(path))
+
+
+@asynccontextmanager
+async def profile_execution(mode: str, name: str):
+    """Profiles the event loop while the block runs, and writes the results in the profiles folder
+    of the log dir"""
+    profiler = CProfiler() if mode == CPROFILE else SamplingProfiler()
+    try:
+        profiler.start()
+    except RuntimeError as e:
+        logger.warning(f"Execution {name} not profiled: {e}")
+        yield
+        return
+    monitor = LoopLagMonitor()
+    monitor.start()
+    start = time.time()
+    try:
+        yield
+    finally:
+        profiler.stop()
+        monitor.stop()
+        folder = profiles_path()
+        folder.mkdir(parents=True, exist_ok=True)
+        prefix = f"{name}-{time.strftime('%Y%m%d-%H%M%S', time.localtime(start))}"
+        profile_file = folder / f"{prefix}.{profiler.extension}"
+        lag_file = folder / f"{prefix}.lag.json"
+        profiler.dump(profile_file)
+        with lag_file.open("w") as output:
+            json.dump({"name": name, "profiler": mode, "duration": time.time() - start, **monitor.report()},
+                      output, indent=2)
+        logger.info(f"Profile of {name} written to {profile_file}, event loop lag to {lag_file}")
@@ -0,0 +1,102 @@
+# Copyright (C) 2019  Infobyte LLC (http://www.infobytesec.com/)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import bisect
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+
+DEFAULT_MAX_CONCURRENT_RUNS = os.cpu_count() or 4
+DEFAULT_MAX_QUEUED_RUNS = 100
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class JobScheduler:
+    """Limits the executions running at the same time, globally and by executor.
+
+    Jobs that can't start wait in a queue ordered by priority (higher first) and then by
+    arrival. A job only waits for the limits it is blocked by, so a busy executor doesn't
+    block the jobs of the other ones.
+    """
+
+    def __init__(self,
+                 max_running: int = DEFAULT_MAX_CONCURRENT_RUNS,
+                 executor_limits: dict = None,
+                 max_queued: int = DEFAULT_MAX_QUEUED_RUNS):
+        self.max_running = max_running
+        self.executor_limits = executor_limits or {}
+        self.max_queued = max_queued
+        self.running = 0
+        self.running_by_executor = {}
+        self.waiting = []
+        self.__counter = itertools.count()
+
+    @property
+    def queued(self):
+        return len(self.waiting)
+
+    def can_run(self, executor_name: str):
+        if self.running >= self.max_running:
+            return False
+        limit = self.executor_limits.get(executor_name)
+        return limit is None or self.running_by_executor.get(executor_name, 0) < limit
+
+    def __start(self, executor_name: str):
+        self.running += 1
+        self.running_by_executor[executor_name] = self.running_by_executor.get(executor_name, 0) + 1
+
+    def release(self, executor_name: str):
+        self.running -= 1
+        self.running_by_executor[executor_name] -= 1
+        for waiter in list(self.waiting):
+            _, _, waiter_executor, future = waiter
+            if self.can_run(waiter_executor):
+                self.waiting.remove(waiter)
+                if not future.done():
+                    self.__start(waiter_executor)
+                    future.set_result(None)
+
+    async def acquire(self, executor_name: str, priority: int = 0, on_queued=None):
+        if self.can_run(executor_name):
+            self.__start(executor_name)
+            return
+        if self.queued >= self.max_queued:
+            raise QueueFullError(f"There are already {self.queued} executions waiting")
+
+        future = asyncio.get_event_loop().create_future()
+        waiter = (-priority, next(self.__counter), executor_name, future)
+        bisect.insort(self.waiting, waiter)
+        try:
+            if on_queued is not None:
+                await on_queued(self.waiting.index(waiter))
+            await future
+        except BaseException:
+            if waiter in self.waiting:
+                self.waiting.remove(waiter)
+            elif future.done() and not future.cancelled():
+                self.release(executor_name)
+            raise
+
+    @asynccontextmanager
+    async def slot(self, executor_name: str, priority: int = 0, on_queued=None):
+        await self.acquire(executor_name, priority, on_queued)
+        try:
+            yield
+        finally:
+            self.release(executor_name)
@@ -0,0 +1,209 @@
+# Copyright (C) 2019  Infobyte LLC (http://www.infobytesec.com/)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import time
+import asyncio
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from faraday_agent_dispatcher import config
+from faraday_agent_dispatcher import logger as logging
+from faraday_agent_dispatcher.utils import json_utils
+
+logger = logging.get_logger()
+
+DEFAULT_SPOOL_MAX_SIZE = 100 * 1024 * 1024     # 100 MB
+DEFAULT_SPOOL_REPLAY_INTERVAL = 30.0            # seconds
+SEGMENT_SIZE = 4 * 1024 * 1024                  # 4 MB
+FSYNC_EVERY = 32                                # records
+FSYNC_INTERVAL = 1.0                            # seconds
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".jsonl"
+
+
+class Spool:
+    """Append-only on-disk queue for the results the server could not receive.
+
+    Records are appended as JSON lines to numbered segment files, synced to disk every
+    ``FSYNC_EVERY`` records or ``FSYNC_INTERVAL`` seconds, and replayed oldest first. When the
+    spool grows over ``max_size`` bytes the oldest segments are evicted. The files are written by a
+    single writer thread, in the order of the calls, so appending never blocks the event loop on disk.
+    """
+
+    def __init__(self, path=None, max_size: int = DEFAULT_SPOOL_MAX_SIZE, segment_size: int = SEGMENT_SIZE):
+        self.path = Path(path or config.SPOOL_PATH).expanduser()
+        self.max_size = max_size
+        self.segment_size = segment_size
+        self.segments = self.__existing_segments()
+        self.__sizes = {segment: segment.stat().st_size for segment in self.segments}
+        self.size = sum(self.__sizes.values())
+        self.__writing = None  # The segment the records are appended to
+        self.__file = None     # Its file, only used by the writer thread
+        self.__unsynced = 0
+        self.__last_sync = time.monotonic()
+        self.__replay_offset = 0
+        self.__appended = asyncio.Event()
+        self.__writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="spool-writer")
+
+    def __existing_segments(self):
+        if not self.path.is_dir():
+            return []
+        return sorted(
+            segment for segment in self.path.iterdir()
+            if segment.name.startswith(SEGMENT_PREFIX) and segment.name.endswith(SEGMENT_SUFFIX)
+        )
+
+    @property
+    def pending(self):
+        return len(self.segments) > 0
+
+    def __segment_path(self):
+        number = int(self.segments[-1].name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) + 1 if self.segments else 0
+        return self.path / f"{SEGMENT_PREFIX}{number:012d}{SEGMENT_SUFFIX}"
+
+    def __submit(self, function, *args):
+        self.__writer.submit(function, *args).add_done_callback(self.__log_error)
+
+    @staticmethod
+    def __log_error(future):
+        if future.exception() is not None:
+            logger.error(f"Error writing the spool: {future.exception()}")
+
+    def append(self, workspace: str, data, target: str = None):
+        if self.__writing is None:
+            self.__writing = self.__segment_path()
+            self.segments.append(self.__writing)
+            self.__sizes[self.__writing] = 0
+            self.__submit(self.__open, self.__writing)
+
+        record = {"workspace": workspace, "data": data}
+        if target is not None:
+            record["target"] = target
+        record = json_utils.dumps_bytes(record) + b"\n"
+        self.__submit(self.__write, record)
+        self.size += len(record)
+        self.__sizes[self.__writing] += len(record)
+        self.__unsynced += 1
+        if self.__unsynced >= FSYNC_EVERY or time.monotonic() - self.__last_sync >= FSYNC_INTERVAL:
+            self.sync()
+        if self.__sizes[self.__writing] >= self.segment_size:
+            self.seal()
+        self.__evict()
+        self.__appended.set()
+
+    def sync(self):
+        if self.__writing is not None and self.__unsynced > 0:
+            self.__submit(self.__fsync)
+        self.__unsynced = 0
+        self.__last_sync = time.monotonic()
+
+    def seal(self):
+        """Closes the segment being written, the next record opens a new one"""
+        if self.__writing is not None:
+            self.__submit(self.__close)
+            self.__writing = None
+            self.__unsynced = 0
+            self.__last_sync = time.monotonic()
+
+    def drain(self):
+        """Blocks until the writer thread wrote the appended records"""
+        self.__writer.submit(lambda: None).result()
+
+    async def written(self):
+        """Waits for the writer thread to write the appended records"""
+        await asyncio.wrap_future(self.__writer.submit(lambda: None))
+
+    def close(self):
+        self.seal()
+        self.drain()
+
+    # The methods below run in the writer thread
+
+    def __open(self, segment: Path):
+        os.makedirs(segment.parent, exist_ok=True)
+        self.__file = open(segment, "ab")
+
+    def __write(self, record: bytes):
+        self.__file.write(record)
+        self.__file.flush()
+
+    def __fsync(self):
+        os.fsync(self.__file.fileno())
+
+    def __close(self):
+        self.__fsync()
+        self.__file.close()
+        self.__file = None
+
+    @staticmethod
+    def __unlink(segment: Path):
+        segment.unlink(missing_ok=True)
+
+    def __remove_oldest(self):
+        segment = self.segments.pop(0)
+        segment_size = self.__sizes.pop(segment)
+        self.__submit(self.__unlink, segment)
+        self.size -= segment_size
+        self.__replay_offset = 0
+        return segment_size
+
+    def __evict(self):
+        while self.size > self.max_size and len(self.segments) > 1:
+            segment_size = self.__remove_oldest()
+            logger.warning(f"Spool is over {self.max_size} bytes, {segment_size} bytes of the oldest results "
+                           f"were dropped")
+
+    async def replay(self, send_f):
+        """Sends the spooled records in order with ``send_f(workspace, data)``, or
+        ``send_f(workspace, data, target)`` for the results of another target than the default one,
+        which must return ``False`` if the server is still unreachable. Returns whether the spool was
+        emptied."""
+        while self.segments:
+            segment = self.segments[0]
+            if self.__writing == segment:
+                self.seal()
+            await self.written()
+            with open(segment, "rb") as reader:
+                reader.seek(self.__replay_offset)
+                for line in reader:
+                    try:
+                        record = json_utils.loads(line)
+                    except ValueError:
+                        logger.error(f"Corrupted record in spool segment {segment.name}, skipping it")
+                    else:
+                        target = (record["target"],) if "target" in record else ()
+                        if not await send_f(record["workspace"], record["data"], *target):
+                            return False
+                        if not self.segments or self.segments[0] != segment:  # Evicted while sending
+                            break
+                    self.__replay_offset += len(line)
+            if self.segments and self.segments[0] == segment:
+                self.__remove_oldest()
+            self.__replay_offset = 0
+            logger.info(f"Spool segment {segment.name} replayed")
+        await self.written()  # The replayed segments are removed from the disk too
+        return True
+
+    async def replay_forever(self, send_f, interval: float = DEFAULT_SPOOL_REPLAY_INTERVAL):
+        while True:
+            self.__appended.clear()
+            if self.pending and not await self.replay(send_f):
+                await asyncio.sleep(interval)
+                continue
+            try:
+                await asyncio.wait_for(self.__appended.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
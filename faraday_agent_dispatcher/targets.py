@@ -0,0 +1,83 @@
+# Copyright (C) 2019  Infobyte LLC (http://www.infobytesec.com/)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from faraday_agent_dispatcher.config import instance as config, Sections, save_config
+from faraday_agent_dispatcher.utils.url_utils import api_url
+from faraday_agent_dispatcher.utils.control_values_utils import (
+    control_int,
+    control_str,
+    control_registration_token,
+    control_agent_token,
+)
+
+# Options of a target section, the ones it does not set are taken from the server and tokens sections
+TARGET_OPTIONS = {
+    "host": (Sections.SERVER, control_str),
+    "api_port": (Sections.SERVER, control_int()),
+    "websocket_port": (Sections.SERVER, control_int()),
+    "workspace": (Sections.SERVER, control_str),
+    "registration": (Sections.TOKENS, control_registration_token),
+    "agent": (None, control_agent_token),  # Each target registers its own agent
+}
+
+
+class Target:
+    """A Faraday server and workspace the agent joins. The default one is configured in the server and
+    tokens sections, the others in a target_<name> section each"""
+
+    def __init__(self, name: str = None):
+        self.name = name
+        self.section = Sections.TARGET.format(name) if name is not None else None
+        self.host = self.get("host")
+        self.api_port = self.get("api_port")
+        self.websocket_port = self.get("websocket_port")
+        self.workspace = self.get("workspace")
+        self.agent_token = self.get("agent")
+
+    def get(self, option: str):
+        default_section, _ = TARGET_OPTIONS[option]
+        if self.section is None:
+            return config[default_section or Sections.TOKENS].get(option, None)
+        value = config[self.section].get(option, None)
+        if value is None and default_section is not None:
+            value = config[default_section].get(option, None)
+        return value
+
+    @property
+    def registration_token(self):
+        return self.get("registration")
+
+    def bulk_create_url(self, workspace: str = None):
+        workspace = workspace or self.workspace
+        return api_url(self.host, self.api_port, postfix=f"/_api/v2/ws/{workspace}/bulk_create/")
+
+    def save_agent_token(self, token: str, config_path):
+        self.agent_token = token
+        config.set(self.section or Sections.TOKENS, "agent", token)
+        save_config(config_path)
+
+    def __str__(self):
+        return f"{self.host}:{self.api_port}/{self.workspace}"
+
+    @staticmethod
+    def control_config(name: str):
+        section = Sections.TARGET.format(name)
+        if section not in config:
+            raise ValueError(f"{name} is a target name but there is no {section} section")
+        for option, (default_section, control) in TARGET_OPTIONS.items():
+            value = config[section].get(option, None)
+            if value is None and default_section is not None:
+                value = config[default_section].get(option, None)
+            control(option, value)
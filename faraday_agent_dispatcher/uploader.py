@@ -0,0 +1,249 @@
+# Copyright (C) 2019  Infobyte LLC (http://www.infobytesec.com/)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import time
+import asyncio
+
+from aiohttp import ClientSession, ClientError
+
+from faraday_agent_dispatcher import logger as logging
+from faraday_agent_dispatcher import metrics
+from faraday_agent_dispatcher.config import instance as config, Sections
+from faraday_agent_dispatcher.utils.url_utils import api_url
+from faraday_agent_dispatcher.utils.compression_utils import compress
+from faraday_agent_dispatcher.utils import json_utils
+from faraday_agent_dispatcher.utils.json_utils import EncodedDocument
+from faraday_agent_dispatcher.utils.retry_utils import (
+    RetryPolicy,
+    RETRYABLE_EXCEPTIONS,
+    DEFAULT_MAX_RETRIES,
+    DEFAULT_RETRY_BUDGET,
+    DEFAULT_BACKOFF,
+    DEFAULT_MAX_BACKOFF,
+    is_retryable_status,
+    parse_retry_after,
+)
+
+logger = logging.get_logger()
+
+DEFAULT_UPLOAD_WORKERS = 1
+DEFAULT_UPLOAD_QUEUE_SIZE = 64
+
+
+def compression_rejected(status: int, text: str, encoding: str):
+    """Whether the server answered it does not understand a compressed body, a 400 is only taken as
+    that when it names the encoding, as it is also the answer to invalid data"""
+    if status == 415:
+        return True
+    text = text.lower()
+    return status == 400 and ("encoding" in text or encoding in text)
+
+
+class BulkCreateUploader:
+    """Posts the executor results to the bulk create endpoint, keeping latency stats"""
+
+    def __init__(self, session: ClientSession, spool=None, retry_policy: RetryPolicy = None, target=None,
+                 dedup=None):
+        self.__session = session
+        self.spool = spool
+        self.target = target  # The server and workspace of the results, the ones of the config if None
+        self.dedup = dedup  # DedupCache of the objects already sent, None to send everything
+        self.retry_policy = retry_policy or self.build_retry_policy()
+        self.compression = config[Sections.SERVER].get("upload_compression", None)
+        self.requests = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    @staticmethod
+    def build_retry_policy():
+        server_config = config[Sections.SERVER]
+        return RetryPolicy(
+            max_retries=int(server_config.get("upload_retries", DEFAULT_MAX_RETRIES)),
+            budget=int(server_config.get("upload_retry_budget", DEFAULT_RETRY_BUDGET)),
+            backoff=float(server_config.get("upload_backoff", DEFAULT_BACKOFF)),
+            max_backoff=float(server_config.get("upload_max_backoff", DEFAULT_MAX_BACKOFF)),
+        )
+
+    @staticmethod
+    def post_url(workspace: str = None):
+        host = config.get('server', 'host')
+        port = config.get('server', 'api_port')
+        workspace = workspace or config.get('server', 'workspace')
+        return api_url(host, port, postfix=f"/_api/v2/ws/{workspace}/bulk_create/")
+
+    def url(self, workspace: str = None):
+        if self.target is None:
+            return self.post_url(workspace)
+        return self.target.bulk_create_url(workspace)
+
+    @property
+    def agent_token(self):
+        return self.target.agent_token if self.target is not None else config.get("tokens", "agent")
+
+    async def upload(self, loaded_json):
+        workspace = self.target.workspace if self.target is not None else config.get('server', 'workspace')
+        target = self.target.name if self.target is not None else None
+        document = loaded_json.document if isinstance(loaded_json, EncodedDocument) else loaded_json
+        new_keys = None
+        if self.dedup is not None:
+            scope = str(self.target) if self.target is not None else workspace
+            filtered, new_keys = self.dedup.filter(document, scope)
+            if filtered is None:
+                logger.debug("Skipping results already sent")
+                return
+            if filtered != document:
+                loaded_json = document = filtered  # The raw bytes are no longer the ones to send
+        if self.spool is not None and self.spool.pending:
+            # Keeps the order with the results waiting in the spool
+            self.spool.append(workspace, document, target)
+            self.remember(new_keys)
+            return
+        if not await self.send(workspace, loaded_json, new_keys) and self.spool is not None:
+            self.spool.append(workspace, document, target)
+            self.remember(new_keys)
+            logger.warning("Data spooled, it will be sent when the server is reachable again")
+
+    def remember(self, new_keys):
+        if new_keys:
+            self.dedup.remember(new_keys)
+
+    async def send(self, workspace, loaded_json, new_keys=None):
+        """Sends the data, returns ``False`` if it could not be sent but could be in a later retry. The
+        new_keys of the dedup cache are only remembered if the server received the data"""
+        if isinstance(loaded_json, EncodedDocument):
+            body = loaded_json.raw  # Already validated, sent as the executor printed it
+        else:
+            body = json_utils.dumps_bytes(loaded_json)
+        encoding = self.compression
+        compressed_body = await compress(body, encoding) if encoding is not None else None
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                status, text, headers = await self.post(workspace, compressed_body or body, encoding)
+            except RETRYABLE_EXCEPTIONS as e:
+                metrics.BULK_CREATE_RESPONSES.labels("error").inc()
+                error = f"{e.__class__.__name__} {e}"
+            else:
+                if encoding is not None and compression_rejected(status, text, encoding):
+                    logger.warning(f"Server responded {status} to a {encoding} body, sending it uncompressed")
+                    encoding = compressed_body = None
+                    continue
+                if status == 201:
+                    logger.info("Data sent to bulk create")
+                    self.remember(new_keys)
+                    if self.compression is not None and encoding is None:
+                        logger.warning(f"Server does not accept {self.compression} bodies, disabling compression")
+                        self.compression = None
+                    return True
+                if not is_retryable_status(status):
+                    logger.error(
+                        "Invalid data supplied by the executor to the bulk create "
+                        "endpoint. Server responded: {} {}".format(status, text)
+                    )
+                    return True
+                error = f"{status} {text}"
+                retry_after = parse_retry_after(headers.get("Retry-After"))
+
+            delay = self.retry_policy.next_delay(attempt, retry_after)
+            if delay is None:
+                logger.error(f"Data not sent to bulk create after {attempt} retries. Server responded: {error}")
+                return False
+            logger.warning(f"Bulk create failed ({error}), retrying in {delay:.2f} s")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def post(self, workspace, body: bytes, encoding: str = None):
+        headers = {
+            "authorization": "agent {}".format(self.agent_token),
+            "content-type": "application/json",
+        }
+        if encoding is not None:
+            headers["content-encoding"] = encoding
+
+        start = time.monotonic()
+        async with self.__session.post(
+            self.url(workspace),
+            data=body,
+            headers=headers,
+            raise_for_status=False,
+        ) as res:
+            text = await res.text() if res.status != 201 else ""
+            self.__observe(time.monotonic() - start)
+            metrics.BULK_CREATE_RESPONSES.labels(res.status).inc()
+            return res.status, text, res.headers
+
+    def __observe(self, latency):
+        metrics.BULK_CREATE_DURATION.observe(latency)
+        self.requests += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    def log_stats(self):
+        if self.requests == 0:
+            return
+        logger.info(f"Bulk create: {self.requests} requests, "
+                    f"mean latency {1000 * self.total_latency / self.requests:.1f} ms, "
+                    f"max latency {1000 * self.max_latency:.1f} ms")
+
+
+class UploadQueue:
+    """Bounded queue drained by ``workers`` upload tasks.
+
+    ``put`` only blocks when the queue is full, so the reader keeps draining the executor
+    output while the server is slow, and backpressure reaches the pipe only after that.
+    """
+
+    def __init__(self, upload_f, workers: int = DEFAULT_UPLOAD_WORKERS, max_size: int = DEFAULT_UPLOAD_QUEUE_SIZE):
+        self.upload_f = upload_f
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=max_size)
+        self.put_wait = 0.0
+        self.__tasks = []
+
+    def start(self):
+        if not self.__tasks:
+            self.__tasks = [asyncio.create_task(self.__work()) for _ in range(self.workers)]
+
+    async def put(self, payload):
+        self.start()
+        if self.queue.full():
+            start = time.monotonic()
+            await self.queue.put(payload)
+            self.put_wait += time.monotonic() - start
+        else:
+            self.queue.put_nowait(payload)
+
+    async def close(self):
+        try:
+            if self.__tasks:
+                await self.queue.join()
+        finally:
+            for task in self.__tasks:
+                task.cancel()
+            await asyncio.gather(*self.__tasks, return_exceptions=True)
+            self.__tasks = []
+
+    async def __work(self):
+        while True:
+            payload = await self.queue.get()
+            try:
+                await self.upload_f(payload)
+            except (ClientError, asyncio.TimeoutError) as e:
+                logger.error(f"Error sending data to bulk create: {e}")
+            except Exception as e:  # A dead worker would hang close()
+                logger.error(f"Unexpected error sending data to bulk create: {e}")
+            finally:
+                self.queue.task_done()
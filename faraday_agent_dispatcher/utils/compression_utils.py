@@ -0,0 +1,19 @@
+import gzip
+import zlib
+import asyncio
+import functools
+
+COMPRESSORS = {
+    "gzip": functools.partial(gzip.compress, compresslevel=6),
+    "deflate": functools.partial(zlib.compress, level=6),
+}
+
+# Bodies bigger than this are compressed in the default executor, not in the event loop
+OFFLOAD_SIZE = 64 * 1024
+
+
+async def compress(body: bytes, encoding: str):
+    compressor = COMPRESSORS[encoding]
+    if len(body) < OFFLOAD_SIZE:
+        return compressor(body)
+    return await asyncio.get_event_loop().run_in_executor(None, compressor, body)
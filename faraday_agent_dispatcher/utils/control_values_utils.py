@@ -12,6 +12,20 @@ def control_int(nullable=False):
     return control
 
 
+def control_float(nullable=False):
+    def control(field_name, value):
+        if value is None and nullable:
+            return
+        if value is None:
+            raise ValueError(f"Trying to parse {field_name} with None value and should be a float")
+        try:
+            float(value)
+        except ValueError:
+            raise ValueError(f"Trying to parse {field_name} with value {value} and should be a float")
+
+    return control
+
+
 def control_str(field_name, value):
     if not isinstance(value, str):
         raise ValueError(f"{field_name} must be a string")
@@ -21,6 +35,11 @@ def control_host(field_name, value):
     control_str(field_name, value)
 
 
+def control_optional_host(field_name, value):
+    if value is not None:
+        control_host(field_name, value)
+
+
 
 def control_list(can_repeat=True):
     def control(field_name, value):
@@ -33,9 +52,29 @@ def control_list(can_repeat=True):
     return control
 
 
-def control_bool(field_name, value):
-    if value.lower() not in ["true", "false", "t", "f"]:
-        raise ValueError(f"Trying to parse {field_name} with value {value} and should be a bool")
+def control_bool(nullable=False):
+    def control(field_name, value):
+        if value is None and nullable:
+            return
+        if value is None or value.lower() not in ["true", "false", "t", "f"]:
+            raise ValueError(f"Trying to parse {field_name} with value {value} and should be a bool")
+
+    return control
+
+
+def parse_bool(value: str):
+    return value.lower() in ["t", "true"]
+
+
+def control_choice(choices, nullable=False):
+    def control(field_name, value):
+        if value is None and nullable:
+            return
+        if value not in choices:
+            raise ValueError(f"Trying to parse {field_name} with value {value} and should be one of "
+                             f"{', '.join(choices)}")
+
+    return control
 
 
 def control_registration_token(field_name, value):
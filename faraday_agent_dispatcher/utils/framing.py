@@ -0,0 +1,53 @@
+import struct
+import asyncio
+
+# Each frame is its payload length, its type and the payload
+HEADER = struct.Struct(">IB")
+MAX_FRAME_SIZE = 2 ** 32 - 1
+
+JOB = 1
+RESULT = 2
+LOG = 3
+DONE = 4
+PING = 5
+PONG = 6
+PROGRESS = 7
+FRAME_TYPES = {JOB, RESULT, LOG, DONE, PING, PONG, PROGRESS}
+
+
+def encode_frame(frame_type: int, payload: bytes = b"") -> bytes:
+    if len(payload) > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame of {len(payload)} bytes is bigger than {MAX_FRAME_SIZE} bytes")
+    return HEADER.pack(len(payload), frame_type) + payload
+
+
+async def read_frame(reader: asyncio.StreamReader):
+    """Returns the (type, payload) of the next frame, or None at the end of the stream"""
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise ValueError("Stream closed in the middle of a frame header")
+        return None
+    size, frame_type = HEADER.unpack(header)
+    if frame_type not in FRAME_TYPES:
+        raise ValueError(f"Unknown frame type {frame_type}")
+    try:
+        payload = await reader.readexactly(size)
+    except asyncio.IncompleteReadError:
+        raise ValueError(f"Stream closed in the middle of a frame of {size} bytes")
+    return frame_type, payload
+
+
+def read_frame_sync(stream):
+    """Blocking version of read_frame for a binary file object, used by the worker processes"""
+    header = stream.read(HEADER.size)
+    if not header:
+        return None
+    if len(header) < HEADER.size:
+        raise ValueError("Stream closed in the middle of a frame header")
+    size, frame_type = HEADER.unpack(header)
+    payload = stream.read(size)
+    if len(payload) < size:
+        raise ValueError(f"Stream closed in the middle of a frame of {size} bytes")
+    return frame_type, payload
@@ -0,0 +1,239 @@
+import re
+
+from faraday_agent_dispatcher.utils import json_utils
+
+STRUCTURE_RE = re.compile(r'["{}\[\]]')
+STRING_RE = re.compile(r'["\\]')
+SCALAR_RE = re.compile(r'[^,\]}\s]+')
+WHITESPACE_RE = re.compile(r'\s*')
+
+# Parser states
+TOP, KEY, COLON, VALUE, HOSTS_START, HOSTS, SKIP_LINE, SKIP_ELEMENT = range(8)
+
+HOST_EVENT = "host"
+DOCUMENT_EVENT = "document"
+ERROR_EVENT = "error"
+
+
+class HostsStreamParser:
+    """Incremental parser of bulk create documents.
+
+    Each element of the ``hosts`` array is returned as soon as it is complete, so only one host
+    needs to be in memory at a time, no matter how large the whole document is. The other keys
+    of the document are returned when the document ends. ``feed`` returns a list of
+    ``(event, value, size)`` tuples with a ``HOST_EVENT``, ``DOCUMENT_EVENT`` or ``ERROR_EVENT``.
+    """
+
+    def __init__(self, max_element_size: int = None):
+        self.max_element_size = max_element_size
+        self.buffer = ""
+        self.pos = 0
+        self.state = TOP
+        self.key = None
+        self.document = {}
+        self.__scan_pos = None
+        self.__scan_depth = 0
+        self.__skip_state = None  # The state to go back to after skipping an element
+
+    def feed(self, data: str):
+        self.buffer = self.buffer[self.pos:] + data
+        if self.__scan_pos is not None:
+            self.__scan_pos -= self.pos
+        self.pos = 0
+        events = []
+        while self.__step(events):
+            pass
+        return events
+
+    def close(self):
+        events = self.feed("")
+        if self.buffer[self.pos:].strip() or self.state not in [TOP, SKIP_LINE]:
+            events.append((ERROR_EVENT, "Incomplete JSON document at the end of the output", 0))
+        self.reset()
+        return events
+
+    def reset(self):
+        self.buffer = ""
+        self.pos = 0
+        self.state = TOP
+        self.key = None
+        self.document = {}
+        self.__scan_pos = None
+        self.__scan_depth = 0
+        self.__skip_state = None
+
+    def __skip_whitespace(self):
+        self.pos = WHITESPACE_RE.match(self.buffer, self.pos).end()
+        return self.pos < len(self.buffer)
+
+    def __step(self, events):
+        if self.state == SKIP_LINE:
+            end = self.buffer.find("\n", self.pos)
+            if end == -1:
+                self.pos = len(self.buffer)
+                return False
+            self.pos = end + 1
+            self.state = TOP
+            return True
+        if self.state == SKIP_ELEMENT:
+            end = self.__structure_end()
+            if end is None:
+                self.pos = self.__scan_pos  # Only the unfinished string of the element is kept
+                return False
+            self.pos = end
+            self.state = self.__skip_state
+            self.__skip_state = None
+            return True
+        if not self.__skip_whitespace():
+            return False
+        char = self.buffer[self.pos]
+
+        if self.state == TOP:
+            if char == "{":
+                self.pos += 1
+                self.state = KEY
+                self.document = {}
+                return True
+            end = self.buffer.find("\n", self.pos)
+            if end == -1:
+                return False
+            events.append((ERROR_EVENT, f"Expecting a JSON document: {self.buffer[self.pos:end][:80]}", 0))
+            self.pos = end + 1
+            return True
+
+        if self.state == KEY:
+            if char == ",":
+                self.pos += 1
+                return True
+            if char == "}":
+                self.pos += 1
+                self.state = TOP
+                events.append((DOCUMENT_EVENT, self.document, 0))
+                self.document = {}
+                return True
+            if char != '"':
+                return self.__error(events, f"Expecting property name, found {char!r}")
+            end = self.__value_end()
+            if end is None:
+                return False
+            try:
+                self.key = json_utils.loads(self.buffer[self.pos:end])
+            except ValueError as e:
+                return self.__error(events, str(e))
+            self.pos = end
+            self.state = COLON
+            return True
+
+        if self.state == COLON:
+            if char != ":":
+                return self.__error(events, f"Expecting ':' delimiter, found {char!r}")
+            self.pos += 1
+            self.state = HOSTS_START if self.key == "hosts" else VALUE
+            return True
+
+        if self.state == HOSTS_START:
+            if char != "[":
+                self.state = VALUE
+                return True
+            self.pos += 1
+            self.state = HOSTS
+            return True
+
+        if self.state == HOSTS:
+            if char == ",":
+                self.pos += 1
+                return True
+            if char == "]":
+                self.pos += 1
+                self.state = KEY
+                return True
+
+        # A whole value, either a host or any other key of the document
+        start = self.pos
+        end = self.__value_end()
+        if end is None:
+            if self.max_element_size is not None and len(self.buffer) - start > self.max_element_size:
+                return self.__skip_element(events)
+            return False
+        try:
+            value = json_utils.loads(self.buffer[start:end])
+        except ValueError as e:
+            return self.__error(events, str(e))
+        self.pos = end
+        if self.state == HOSTS:
+            events.append((HOST_EVENT, value, end - start))
+        else:
+            self.document[self.key] = value
+            self.state = KEY
+        return True
+
+    def __error(self, events, message):
+        """Drops the current document and goes on with the next line"""
+        events.append((ERROR_EVENT, message, 0))
+        self.state = SKIP_LINE
+        self.document = {}
+        return True
+
+    def __skip_element(self, events):
+        """Skips the rest of an element bigger than max_element_size, going on with the next one"""
+        message = f"JSON element bigger than {self.max_element_size} bytes, skipping it"
+        if self.__scan_pos is None:  # A string or scalar, skipped with its document
+            return self.__error(events, message)
+        events.append((ERROR_EVENT, message, 0))
+        self.__skip_state = HOSTS if self.state == HOSTS else KEY
+        self.state = SKIP_ELEMENT
+        self.pos = self.__scan_pos
+        return True
+
+    def __value_end(self):
+        """Returns the end of the JSON value starting at pos, or None if it is not complete yet"""
+        buffer = self.buffer
+        char = buffer[self.pos]
+        if char == '"':
+            return self.__string_end(self.pos)
+        if char not in "{[":
+            match = SCALAR_RE.match(buffer, self.pos)
+            if match is None or match.end() == len(buffer):
+                return None if match is not None else self.pos + 1
+            return match.end()
+
+        if self.__scan_pos is None:
+            self.__scan_pos, self.__scan_depth = self.pos, 0
+        return self.__structure_end()
+
+    def __structure_end(self):
+        """Goes on scanning the object or array from where the last call stopped"""
+        buffer = self.buffer
+        index, depth = self.__scan_pos, self.__scan_depth
+        while True:
+            match = STRUCTURE_RE.search(buffer, index)
+            if match is None:
+                self.__scan_pos, self.__scan_depth = len(buffer), depth
+                return None
+            char = match.group()
+            if char == '"':
+                end = self.__string_end(match.start())
+                if end is None:
+                    self.__scan_pos, self.__scan_depth = match.start(), depth
+                    return None
+                index = end
+                continue
+            index = match.end()
+            depth += 1 if char in "{[" else -1
+            if depth == 0:
+                self.__scan_pos = None
+                return index
+
+    def __string_end(self, start):
+        buffer = self.buffer
+        index = start + 1
+        while True:
+            match = STRING_RE.search(buffer, index)
+            if match is None:
+                return None
+            if match.group() == "\\":
+                index = match.end() + 1
+                if index > len(buffer):
+                    return None
+                continue
+            return match.end()
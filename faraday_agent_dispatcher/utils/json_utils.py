@@ -0,0 +1,75 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+AUTO = "auto"
+JSON = "json"
+ORJSON = "orjson"
+BACKENDS = [AUTO, JSON, ORJSON]
+# orjson is faster, but rejects integers over 64 bits and the NaN and Infinity the json module accepts,
+# so it is only used when selected, not to change which executor output is valid when it is installed
+DEFAULT_BACKEND = JSON
+
+# orjson.JSONDecodeError is a subclass of this one
+JSONDecodeError = json.JSONDecodeError
+
+backend = None
+loads = None
+dumps = None
+dumps_bytes = None
+canonical_bytes = None  # Same bytes for equal objects, whatever the order of their keys
+
+
+def set_backend(name: str = DEFAULT_BACKEND):
+    """Selects the codec used to decode the executors output and to encode the bulk create bodies and the
+    websocket messages. ``auto`` uses orjson when it is installed"""
+    global backend, loads, dumps, dumps_bytes, canonical_bytes
+    if name == AUTO:
+        name = ORJSON if orjson is not None else JSON
+    if name == ORJSON:
+        if orjson is None:
+            raise ValueError("The orjson JSON backend is selected but orjson is not installed")
+        loads = orjson.loads
+        dumps_bytes = orjson.dumps
+        dumps = _orjson_dumps
+        canonical_bytes = _orjson_canonical_bytes
+    elif name == JSON:
+        loads = json.loads
+        dumps = json.dumps
+        dumps_bytes = _json_dumps_bytes
+        canonical_bytes = _json_canonical_bytes
+    else:
+        raise ValueError(f"Unknown JSON backend {name}, it should be one of {', '.join(BACKENDS)}")
+    backend = name
+
+
+def _orjson_dumps(obj):
+    return orjson.dumps(obj).decode()
+
+
+def _json_dumps_bytes(obj):
+    return json.dumps(obj).encode()
+
+
+def _orjson_canonical_bytes(obj):
+    return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+
+
+def _json_canonical_bytes(obj):
+    return json.dumps(obj, sort_keys=True, separators=(",", ":")).encode()
+
+
+class EncodedDocument:
+    """A document with the original bytes it was parsed from, so it can be sent without encoding it again"""
+
+    __slots__ = ("document", "raw")
+
+    def __init__(self, document, raw: bytes):
+        self.document = document
+        self.raw = raw
+
+
+set_backend(DEFAULT_BACKEND)
@@ -0,0 +1,83 @@
+import os
+import shlex
+import shutil
+import signal
+import asyncio
+import resource
+
+CPU_TIME_GRACE = 5  # seconds between the SIGXCPU of the soft limit and the SIGKILL of the hard one
+SHELL_SIGNAL_OFFSET = 128  # The shell exits with 128 + signal when its command is killed
+
+
+def signal_process_group(process, sig):
+    try:
+        os.killpg(process.pid, sig)  # The executors are started in their own session
+    except ProcessLookupError:
+        pass
+
+
+async def terminate_process_group(process, grace_period: float):
+    """Sends SIGTERM to the process group, and SIGKILL if it is still alive after the grace period"""
+    if process.returncode is not None:
+        return
+    signal_process_group(process, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(process.wait(), grace_period)
+    except asyncio.TimeoutError:
+        signal_process_group(process, signal.SIGKILL)
+
+
+def resolve_argv(cmd: str):
+    """Splits the command as the shell would and looks up its program in the PATH, to exec it
+    without a shell"""
+    argv = shlex.split(cmd)
+    if not argv:
+        raise ValueError("The executor command is empty")
+    program = shutil.which(argv[0])
+    if program is None:
+        raise ValueError(f"Command {argv[0]} not found")
+    return [program] + argv[1:]
+
+
+def exit_signal(returncode: int):
+    """Returns the signal that killed the process, either directly or as the command of the shell"""
+    if returncode is None:
+        return None
+    if returncode < 0:
+        return -returncode
+    if returncode > SHELL_SIGNAL_OFFSET:
+        return returncode - SHELL_SIGNAL_OFFSET
+    return None
+
+
+def resource_limits(cpu_time: int = None, max_memory: int = None, max_rss: int = None,
+                    max_open_files: int = None):
+    """Returns the (resource, (soft, hard)) rlimits to set in the executor process"""
+    limits = []
+    if cpu_time is not None:
+        limits.append((resource.RLIMIT_CPU, (cpu_time, cpu_time + CPU_TIME_GRACE)))
+    if max_memory is not None:
+        limits.append((resource.RLIMIT_AS, (max_memory, max_memory)))
+    if max_rss is not None:
+        limits.append((resource.RLIMIT_RSS, (max_rss, max_rss)))
+    if max_open_files is not None:
+        limits.append((resource.RLIMIT_NOFILE, (max_open_files, max_open_files)))
+    return limits
+
+
+def limits_setter(limits: list, nice: int = None):
+    """Returns the function applying the limits in the child process before the exec, or None if there
+    is nothing to apply. Limits above the current hard limit are lowered to it, only root can raise it"""
+    if not limits and not nice:
+        return None
+
+    def set_limits():
+        for limit, (soft, hard) in limits:
+            _, current_hard = resource.getrlimit(limit)
+            if current_hard != resource.RLIM_INFINITY:
+                soft, hard = min(soft, current_hard), min(hard, current_hard)
+            resource.setrlimit(limit, (soft, hard))
+        if nice:
+            os.nice(nice)
+
+    return set_limits
@@ -0,0 +1,63 @@
+import random
+import asyncio
+import datetime
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+from aiohttp import ClientConnectionError
+
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_RETRY_BUDGET = 50
+DEFAULT_BACKOFF = 1.0           # seconds
+DEFAULT_MAX_BACKOFF = 60.0      # seconds
+
+MAX_BACKOFF_EXPONENT = 32
+
+RETRYABLE_EXCEPTIONS = (ClientConnectionError, ConnectionResetError, asyncio.TimeoutError)
+
+
+def is_retryable_status(status: int):
+    return status == 429 or 500 <= status < 600
+
+
+def parse_retry_after(value: Optional[str]):
+    """Parses a Retry-After header, given in seconds or as an HTTP date"""
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (date - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+class RetryPolicy:
+    """Jittered exponential backoff with a retry budget shared by every request of a run. None as
+    max_retries or budget means there is no limit"""
+
+    def __init__(self,
+                 max_retries: int = DEFAULT_MAX_RETRIES,
+                 budget: int = DEFAULT_RETRY_BUDGET,
+                 backoff: float = DEFAULT_BACKOFF,
+                 max_backoff: float = DEFAULT_MAX_BACKOFF):
+        self.max_retries = max_retries
+        self.budget = budget
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def next_delay(self, attempt: int, retry_after: Optional[float] = None):
+        """Returns the seconds to wait before retrying, or None if the request must not be retried"""
+        if self.max_retries is not None and attempt >= self.max_retries:
+            return None
+        if self.budget is not None:
+            if self.budget <= 0:
+                return None
+            self.budget -= 1
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** min(attempt, MAX_BACKOFF_EXPONENT)))
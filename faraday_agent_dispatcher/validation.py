@@ -0,0 +1,139 @@
+# Copyright (C) 2019  Infobyte LLC (http://www.infobytesec.com/)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+def is_string(value):
+    return isinstance(value, str)
+
+
+def is_list(value):
+    return isinstance(value, list)
+
+
+def is_string_list(value):
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+
+def is_port(value):
+    if isinstance(value, str) and value.isdigit():
+        value = int(value)
+    return isinstance(value, int) and not isinstance(value, bool) and 0 <= value <= 65535
+
+
+def compile_fields(spec: dict):
+    """Turns ``{field: (check, required)}`` in the tuple the validator loops over, checking the
+    required fields first"""
+    return tuple(sorted(
+        ((field, check, required) for field, (check, required) in spec.items()),
+        key=lambda item: not item[2]
+    ))
+
+
+# Fields the bulk create endpoint rejects when missing or of another type, the others are not checked
+HOST_FIELDS = compile_fields({
+    "ip": (is_string, True),
+    "hostnames": (is_string_list, False),
+    "services": (is_list, False),
+    "vulnerabilities": (is_list, False),
+    "credentials": (is_list, False),
+})
+SERVICE_FIELDS = compile_fields({
+    "name": (is_string, True),
+    "port": (is_port, True),
+    "protocol": (is_string, True),
+    "vulnerabilities": (is_list, False),
+    "credentials": (is_list, False),
+})
+VULNERABILITY_FIELDS = compile_fields({
+    "name": (is_string, True),
+    "severity": (is_string, False),
+})
+CREDENTIAL_FIELDS = compile_fields({
+    "username": (is_string, True),
+    "password": (is_string, True),
+})
+
+
+def check(obj, fields):
+    """Returns why the object is not valid, None if it is"""
+    if not isinstance(obj, dict):
+        return "is not an object"
+    for field, check_f, required in fields:
+        if field not in obj:
+            if required:
+                return f"{field} is missing"
+        elif not check_f(obj[field]):
+            return f"{field} is not valid"
+    return None
+
+
+def valid_children(obj: dict, field: str, fields, path: str, errors: list, children_f=None):
+    """Returns the list of valid children of the object, the same list if all of them are valid"""
+    children = obj.get(field)
+    if not children:
+        return children
+    valid = []
+    for index, child in enumerate(children):
+        child_path = f"{path}.{field}[{index}]" if path else f"{field}[{index}]"
+        error = check(child, fields)
+        if error is not None:
+            errors.append(f"{child_path} {error}")
+            continue
+        valid.append(children_f(child, child_path, errors) if children_f is not None else child)
+    if len(valid) == len(children) and all(new is old for new, old in zip(valid, children)):
+        return children
+    return valid
+
+
+def replace_children(obj: dict, children: dict):
+    """Returns the object with the given children, the same object if none changed"""
+    changed = {field: value for field, value in children.items() if obj.get(field) is not value}
+    return {**obj, **changed} if changed else obj
+
+
+def valid_service(service: dict, path: str, errors: list):
+    return replace_children(service, {
+        "vulnerabilities": valid_children(service, "vulnerabilities", VULNERABILITY_FIELDS, path, errors),
+        "credentials": valid_children(service, "credentials", CREDENTIAL_FIELDS, path, errors),
+    })
+
+
+def valid_host(host: dict, path: str, errors: list):
+    return replace_children(host, {
+        "services": valid_children(host, "services", SERVICE_FIELDS, path, errors, valid_service),
+        "vulnerabilities": valid_children(host, "vulnerabilities", VULNERABILITY_FIELDS, path, errors),
+        "credentials": valid_children(host, "credentials", CREDENTIAL_FIELDS, path, errors),
+    })
+
+
+def validate_document(document):
+    """Checks a bulk create document before sending it, so an invalid object does not make the server
+    reject the whole request. Returns the document without the invalid objects, the same one if all of
+    them are valid or None if nothing is left to send, and the errors found"""
+    errors = []
+    if not isinstance(document, dict):
+        return None, ["The document is not an object"]
+    if "hosts" not in document:
+        return document, errors
+    if not isinstance(document["hosts"], list):
+        errors.append("hosts is not a list")
+        rest = {key: value for key, value in document.items() if key != "hosts"}
+        return rest or None, errors
+    hosts = valid_children(document, "hosts", HOST_FIELDS, "", errors, valid_host)
+    if hosts is document["hosts"]:
+        return document, errors
+    if not hosts and len(document) == 1:
+        return None, errors
+    return {**document, "hosts": hosts}, errors
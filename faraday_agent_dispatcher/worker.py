@@ -0,0 +1,141 @@
+# Copyright (C) 2019  Infobyte LLC (http://www.infobytesec.com/)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Helper for persistent executors, which import their heavy dependencies once and run many jobs.
+
+    from faraday_agent_dispatcher.worker import serve
+
+    def run(args, results):
+        results.send({"hosts": [...]})
+        return 0
+
+    if __name__ == '__main__':
+        serve(run)
+
+and for the executors with framed_output, which send framed records instead of lines:
+
+    from faraday_agent_dispatcher.worker import framed_results
+
+    results = framed_results()
+    results.progress("Scanning 10.0.0.0/24")
+    results.send({"hosts": [...]})
+"""
+import os
+import sys
+import json
+import math
+import resource
+import traceback
+
+from faraday_agent_dispatcher.utils.framing import (
+    encode_frame,
+    read_frame_sync,
+    JOB,
+    RESULT,
+    LOG,
+    PROGRESS,
+    DONE,
+    PING,
+    PONG,
+)
+
+WORKER_ENV = "FARADAY_AGENT_WORKER"
+RESULT_CHANNEL_ENV = "FARADAY_AGENT_RESULTS"  # Path of the result channel of the executors with one
+
+
+def result_channel():
+    """Returns the file where a (not persistent) executor writes its results, one JSON document per
+    line: the result channel when the executor has one, so its stdout is only logged, or its stdout"""
+    path = os.environ.get(RESULT_CHANNEL_ENV)
+    return open(path, "w", buffering=1) if path else sys.stdout
+
+
+class Results:
+    """Sends the results of the running job to the dispatcher"""
+
+    def __init__(self, output):
+        self.output = output
+
+    def write(self, frame_type: int, payload: bytes):
+        self.output.write(encode_frame(frame_type, payload))
+        self.output.flush()
+
+    def send(self, document: dict):
+        self.write(RESULT, json.dumps(document).encode())
+
+    def log(self, message: str):
+        self.write(LOG, message.encode())
+
+    def progress(self, message: str):
+        self.write(PROGRESS, message.encode())
+
+
+def framed_results():
+    """Returns the Results of an executor with framed_output, written to its result channel or to its
+    stdout. In the latter, the stdout of the executor and its children goes to stderr from now on, so
+    stray prints can not break the frames"""
+    path = os.environ.get(RESULT_CHANNEL_ENV)
+    if path:
+        return Results(open(path, "wb"))
+    output = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    return Results(output)
+
+
+def limit_job_cpu_time(cpu_time: int = None):
+    """Sets the CPU time soft limit of the worker to cpu_time seconds over the ones it already used, so
+    the limit of the executor applies to each job and not to the whole life of the worker. None lifts it"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if cpu_time is None:
+        soft = hard
+    else:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        soft = math.ceil(usage.ru_utime + usage.ru_stime) + cpu_time
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def serve(handler):
+    """Runs handler(args, results) for each job sent by the dispatcher until it closes the channel. The
+    exit code of a job is the value returned by the handler, or 1 if it raises. The stdout of the
+    worker and its children goes to stderr, so stray prints can not break the channel"""
+    jobs = os.fdopen(os.dup(sys.stdin.fileno()), "rb")
+    output = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    results = Results(output)
+    while True:
+        frame = read_frame_sync(jobs)
+        if frame is None:
+            break
+        frame_type, payload = frame
+        if frame_type == PING:
+            results.write(PONG, payload)
+            continue
+        if frame_type != JOB:
+            continue
+        job = json.loads(payload)
+        if job.get("cpu_time") is not None:
+            limit_job_cpu_time(job["cpu_time"])
+        try:
+            exit_code = handler(job.get("args", {}), results) or 0
+        except Exception:
+            traceback.print_exc()
+            exit_code = 1
+        if job.get("cpu_time") is not None:
+            limit_job_cpu_time(None)
+        sys.stdout.flush()
+        results.write(DONE, json.dumps({"exit_code": exit_code}).encode())
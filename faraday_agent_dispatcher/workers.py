@@ -0,0 +1,209 @@
+# Copyright (C) 2019  Infobyte LLC (http://www.infobytesec.com/)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+from collections import deque
+
+from faraday_agent_dispatcher import logger as logging
+from faraday_agent_dispatcher.executor_helper import StdErrLineProcessor
+from faraday_agent_dispatcher.utils import json_utils
+from faraday_agent_dispatcher.utils.framing import (
+    encode_frame,
+    read_frame,
+    JOB,
+    RESULT,
+    LOG,
+    PROGRESS,
+    DONE,
+    PING,
+    PONG,
+)
+from faraday_agent_dispatcher.utils.process_utils import terminate_process_group
+
+logger = logging.get_logger()
+
+DEFAULT_WORKERS = 1
+DEFAULT_MAX_JOBS = 1000       # jobs run by a worker before replacing it
+DEFAULT_HEALTH_INTERVAL = 30  # seconds between the pings to the idle workers
+PING_TIMEOUT = 5
+STOP_GRACE_PERIOD = 5
+
+
+class Worker:
+    """A long lived executor process, running the jobs sent through its stdin"""
+
+    def __init__(self, process, quiet: bool = False):
+        self.process = process
+        self.jobs = 0
+        self.stderr_task = asyncio.create_task(StdErrLineProcessor(process, quiet).process_f())
+
+    @property
+    def alive(self):
+        return self.process.returncode is None
+
+    async def send(self, frame_type: int, payload: bytes = b""):
+        self.process.stdin.write(encode_frame(frame_type, payload))
+        await self.process.stdin.drain()
+
+    async def next_frame(self):
+        return await read_frame(self.process.stdout)
+
+    async def ping(self, timeout: float = PING_TIMEOUT):
+        try:
+            await self.send(PING)
+            frame = await asyncio.wait_for(self.next_frame(), timeout)
+        except (asyncio.TimeoutError, ConnectionError, ValueError):
+            return False
+        return frame is not None and frame[0] == PONG
+
+    async def stop(self, grace_period: float = STOP_GRACE_PERIOD):
+        """Closes its stdin so it exits by itself, and terminates it if it does not"""
+        if self.alive:
+            try:
+                self.process.stdin.close()
+                await asyncio.wait_for(self.process.wait(), grace_period)
+            except (asyncio.TimeoutError, ConnectionError):
+                await terminate_process_group(self.process, grace_period)
+        await self.stderr_task
+
+
+class WorkerPool:
+    """Warm processes of a persistent executor. Each job takes an idle worker or starts a new one, up to
+    the pool size, and the workers are replaced after max_jobs jobs or when they die or do not answer
+    the health checks"""
+
+    def __init__(self, executor, spawn, quiet: bool = False):
+        self.name = executor.name
+        self.size = executor.workers
+        self.max_jobs = executor.max_jobs
+        self.health_interval = executor.health_interval
+        self.cpu_time = executor.cpu_time  # Limit of each job, set by the worker as it runs many of them
+        self.spawn = spawn  # Coroutine function starting a worker process
+        self.quiet = quiet
+        self.idle = deque()
+        self.workers = set()
+        self.restarts = 0
+        self.__slots = None
+        self.__health_task = None
+
+    @property
+    def slots(self):
+        if self.__slots is None:  # Created in the loop running it
+            self.__slots = asyncio.Semaphore(self.size)
+        return self.__slots
+
+    async def start(self):
+        """Starts the workers before the first job, and checks them periodically"""
+        while len(self.workers) < self.size:
+            self.idle.append(await self.start_worker())
+        if self.__health_task is None:
+            self.__health_task = asyncio.create_task(self.check_health())
+
+    async def start_worker(self):
+        worker = Worker(await self.spawn(), self.quiet)
+        self.workers.add(worker)
+        logger.info(f"Started worker {worker.process.pid} of {self.name} executor")
+        return worker
+
+    async def acquire(self):
+        while self.idle:
+            worker = self.idle.popleft()
+            if worker.alive:
+                return worker
+            self.discard(worker)
+        return await self.start_worker()
+
+    def release(self, worker: Worker, finished: bool):
+        if not finished or not worker.alive:
+            self.discard(worker)
+            return
+        worker.jobs += 1
+        if self.max_jobs is not None and worker.jobs >= self.max_jobs:
+            logger.info(f"Worker {worker.process.pid} of {self.name} executor ran {worker.jobs} jobs, replacing it")
+            self.workers.discard(worker)
+            asyncio.create_task(worker.stop())
+        else:
+            self.idle.append(worker)
+
+    def discard(self, worker: Worker):
+        if worker in self.workers:
+            self.workers.discard(worker)
+            self.restarts += 1
+            logger.warning(f"Worker {worker.process.pid} of {self.name} executor discarded")
+        asyncio.create_task(worker.stop())
+
+    async def run(self, args: dict, on_result, on_start=None):
+        """Runs a job in a worker, calling on_result with each result it sends, and returns the exit code
+        of the job. A worker dying in the middle of a job returns the exit code of its process"""
+        async with self.slots:
+            worker = await self.acquire()
+            finished = False
+            try:
+                if on_start is not None:
+                    await on_start(worker.process)
+                await worker.send(JOB, json_utils.dumps_bytes({"args": args, "cpu_time": self.cpu_time}))
+                while True:
+                    frame = await worker.next_frame()
+                    if frame is None:
+                        break
+                    frame_type, payload = frame
+                    if frame_type == RESULT:
+                        await on_result(payload)
+                    elif frame_type == LOG:
+                        logger.info(f"Worker {worker.process.pid} of {self.name}: "
+                                    f"{payload.decode(errors='replace')}")
+                    elif frame_type == PROGRESS:
+                        logger.info(f"Progress of {self.name}: {payload.decode(errors='replace')}")
+                    elif frame_type == DONE:
+                        finished = True
+                        return json_utils.loads(payload).get("exit_code", 0)
+            except (ConnectionError, ValueError) as e:
+                logger.error(f"Worker {worker.process.pid} of {self.name} executor broke the channel: {e}")
+                await terminate_process_group(worker.process, STOP_GRACE_PERIOD)
+            finally:
+                self.release(worker, finished)
+            await worker.process.wait()
+            logger.warning(f"Worker {worker.process.pid} of {self.name} executor died running a job")
+            return worker.process.returncode
+
+    async def check_health(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            for _ in range(len(self.idle)):
+                # A worker under check takes a slot as a job, so acquire does not start another one meanwhile
+                async with self.slots:
+                    if not self.idle:
+                        break
+                    worker = self.idle.popleft()
+                    if worker.alive and await worker.ping():
+                        self.idle.append(worker)
+                    else:
+                        logger.warning(f"Worker {worker.process.pid} of {self.name} executor failed its health "
+                                       f"check")
+                        self.discard(worker)
+            try:
+                while len(self.workers) < self.size:
+                    self.idle.append(await self.start_worker())
+            except OSError as e:
+                logger.error(f"Can not start a worker of {self.name} executor: {e}")
+
+    async def close(self):
+        if self.__health_task is not None:
+            self.__health_task.cancel()
+            self.__health_task = None
+        workers = list(self.workers)
+        self.workers.clear()
+        self.idle.clear()
+        await asyncio.gather(*[worker.stop() for worker in workers])
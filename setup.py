@@ -40,6 +40,8 @@ setup_requirements = ['pytest-runner', 'click', 'setuptools_scm']
 
 test_requirements = ['pytest', 'pytest-aiohttp']
 
+extras_requirements = {'orjson': ['orjson']}
+
 setup(
     author="Eric Horvat",
     author_email='erich@infobytesec.com',
@@ -59,6 +61,7 @@ setup(
         ],
     },
     install_requires=requirements,
+    extras_require=extras_requirements,
     license="GNU General Public License v3",
     long_description=readme + '\n\n' + history,
     include_package_data=True,
@@ -0,0 +1,219 @@
+"""End to end throughput benchmarks of the dispatcher.
+
+Each scenario runs ``Dispatcher.run_once`` against the stand-in Faraday server of the tests with the
+synthetic ``tests/data/benchmark_executor.py`` executor, in its own process so the peak RSS is its own.
+
+    python -m tests.benchmarks.benchmark_dispatcher --output results.json
+    python -m tests.benchmarks.benchmark_dispatcher --compare results.json --tolerance 0.2
+
+With ``--compare`` the exit code is 1 when a throughput dropped, or the upload latency grew, more than
+``--tolerance`` against the baseline results.
+"""
+import sys
+import json
+import time
+import shutil
+import asyncio
+import tempfile
+import resource
+import argparse
+import subprocess
+from pathlib import Path
+
+from aiohttp import web, ClientSession, TraceConfig
+
+from faraday_agent_dispatcher import logger as logging
+from faraday_agent_dispatcher.batcher import count_objects
+from faraday_agent_dispatcher.config import EXAMPLE_CONFIG_FILENAME, Sections, reset_config, instance as configuration
+from faraday_agent_dispatcher.dispatcher import Dispatcher
+from tests.data.basic_executor import host_data, vuln_data
+from tests.utils.testing_faraday_server import FaradayTestConfig, TmpConfig, faraday_app
+
+ROOT_PATH = Path(__file__).parent.parent.parent
+EXECUTOR_PATH = ROOT_PATH / "tests" / "data" / "benchmark_executor.py"
+
+SCENARIOS = {
+    "many_small_lines": {"lines": 20000, "hosts": 1, "runs": 1,
+                         "executor_config": {"batch_objects": "200"}},
+    "few_huge_lines": {"lines": 4, "hosts": 20000, "runs": 1,
+                       "executor_config": {"max_size": str(64 * 1024 * 1024)}},
+    "concurrent_runs": {"lines": 2000, "hosts": 1, "runs": 8,
+                        "executor_config": {"batch_objects": "200"}},
+    "slow_server": {"lines": 400, "hosts": 1, "runs": 1, "bulk_create_delay": 0.05, "workspace": "slow",
+                    "executor_config": {"upload_workers": "4"}},
+}
+
+# Metrics compared with --compare, and whether a higher value is better
+COMPARED_METRICS = {
+    "lines_per_s": True,
+    "mb_per_s": True,
+    "objects_per_s": True,
+    "upload_latency_p50": False,
+    "upload_latency_p99": False,
+}
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def peak_rss():
+    """Peak RSS in bytes of the benchmark and of its biggest executor"""
+    factor = 1 if sys.platform == "darwin" else 1024  # ru_maxrss is in KB on Linux
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * factor,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * factor)
+
+
+def latency_tracer(latencies: list):
+    trace = TraceConfig()
+
+    async def on_request_start(session, context, params):
+        context.start = time.monotonic()
+
+    async def on_request_end(session, context, params):
+        if "bulk_create" in params.url.path:
+            latencies.append(time.monotonic() - context.start)
+
+    trace.on_request_start.append(on_request_start)
+    trace.on_request_end.append(on_request_end)
+    return trace
+
+
+def configure(test_config: FaradayTestConfig, port: int, scenario: dict):
+    configuration.set(Sections.SERVER, "api_port", str(port))
+    configuration.set(Sections.SERVER, "host", "127.0.0.1")
+    configuration.set(Sections.SERVER, "workspace", scenario.get("workspace", test_config.workspace))
+    configuration.set(Sections.TOKENS, "registration", test_config.registration_token)
+    configuration.set(Sections.TOKENS, "agent", test_config.agent_token)
+    executor_section = Sections.EXECUTOR_DATA.format("ex1")
+    params_section = Sections.EXECUTOR_PARAMS.format("ex1")
+    configuration.set(executor_section, "cmd", f"{sys.executable} {EXECUTOR_PATH}")
+    for option, value in scenario.get("executor_config", {}).items():
+        configuration.set(executor_section, option, value)
+    for param in ["lines", "hosts"]:
+        configuration.set(params_section, param, "False")
+
+
+async def run_scenario(scenario: dict):
+    test_config = FaradayTestConfig()
+    test_config.bulk_create_delay = scenario.get("bulk_create_delay", 0)
+    runner = web.AppRunner(faraday_app(test_config), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    port = runner.addresses[0][1]
+
+    tmp_config = TmpConfig()
+    shutil.copyfile(EXAMPLE_CONFIG_FILENAME, tmp_config.config_file_path)
+    reset_config(tmp_config.config_file_path)
+    configure(test_config, port, scenario)
+    tmp_config.save()
+
+    latencies = []
+    statuses = []
+
+    async def out_func(message):
+        statuses.append(json.loads(message))
+
+    try:
+        async with ClientSession(trace_configs=[latency_tracer(latencies)]) as session:
+            dispatcher = Dispatcher(session, tmp_config.config_file_path)
+            run = json.dumps({
+                "action": "RUN", "agent_id": 1, "executor": "ex1",
+                "args": {"lines": str(scenario["lines"]), "hosts": str(scenario["hosts"])}
+            })
+            start = time.monotonic()
+            await asyncio.gather(*[dispatcher.run_once(run, out_func) for _ in range(scenario["runs"])])
+            elapsed = time.monotonic() - start
+    finally:
+        await runner.cleanup()
+        tmp_config.clean()
+
+    failed = [status for status in statuses if status.get("successful") is False]
+    host = dict(host_data, vulnerabilities=[vuln_data])
+    line_size = len(json.dumps({"hosts": [host] * scenario["hosts"]})) + 1
+    lines = scenario["lines"] * scenario["runs"]
+    rss, executor_rss = peak_rss()
+    return {
+        "elapsed": elapsed,
+        "lines": lines,
+        "bytes": lines * line_size,
+        "objects": lines * count_objects([host] * scenario["hosts"]),
+        "lines_per_s": lines / elapsed,
+        "mb_per_s": lines * line_size / elapsed / 1024 ** 2,
+        "objects_per_s": lines * count_objects([host] * scenario["hosts"]) / elapsed,
+        "uploads": len(latencies),
+        "upload_latency_p50": percentile(latencies, 0.5),
+        "upload_latency_p99": percentile(latencies, 0.99),
+        "peak_rss": rss,
+        "executor_peak_rss": executor_rss,
+        "failed_runs": len(failed),
+    }
+
+
+def run_in_subprocess(name: str):
+    with tempfile.NamedTemporaryFile(suffix=".json") as result_file:
+        process = subprocess.run(
+            [sys.executable, "-m", "tests.benchmarks.benchmark_dispatcher", "--scenario", name,
+             "--result-file", result_file.name],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, cwd=ROOT_PATH,
+        )
+        if process.returncode != 0:
+            sys.stderr.write(process.stderr.decode())
+            raise RuntimeError(f"Benchmark {name} failed")
+        with open(result_file.name) as result:
+            return json.load(result)
+
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    """Returns the regressions of the results against the baseline"""
+    regressions = []
+    for name, metrics in results.items():
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            value, base = metrics.get(metric), baseline.get(name, {}).get(metric)
+            if value is None or not base:
+                continue
+            change = (value - base) / base
+            if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+                regressions.append(f"{name} {metric}: {base:.4g} -> {value:.4g} ({100 * change:+.1f}%)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dispatcher throughput benchmarks")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS),
+                        help="Scenario to run, all of them by default")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Baseline JSON results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Accepted relative regression")
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)  # Used by the scenario subprocesses
+    args = parser.parse_args(argv)
+
+    if args.result_file is not None:
+        scenario, = args.scenario
+        logging.reset_logger(tempfile.mkdtemp())
+        result = asyncio.run(run_scenario(SCENARIOS[scenario]))
+        with open(args.result_file, "w") as result_file:
+            json.dump(result, result_file)
+        return 0
+
+    results = {name: run_in_subprocess(name) for name in args.scenario or SCENARIOS}
+    output = json.dumps(results, indent=2)
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            output_file.write(output)
+    print(output)
+
+    if args.compare is not None:
+        with open(args.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -16,6 +16,7 @@
 import os
 import sys
 import json
+import time
 
 
 host_data = {
@@ -44,7 +45,13 @@ if __name__ == '__main__':
     spaced_before = os.getenv("EXECUTOR_CONFIG_SPACED_BEFORE") is not None
     spaced_middle = os.getenv("EXECUTOR_CONFIG_SPACED_MIDDLE") is not None
     spare = os.getenv("EXECUTOR_CONFIG_SPARE") is not None
+    indent = 2 if os.getenv("EXECUTOR_CONFIG_PRETTY") is not None else None
     omit_everything = os.getenv("DO_NOTHING", None)
+    sleep = float(os.getenv("EXECUTOR_CONFIG_SLEEP", 0))
+    results_path = os.getenv("FARADAY_AGENT_RESULTS")
+    results = open(results_path, "w") if results_path else sys.stdout
+    if results_path:
+        print("Log noise, only logged by the dispatcher")
     if out and omit_everything is None:
         host_data_ = host_data.copy()
         host_data_['vulnerabilities'] = [vuln_data]
@@ -52,16 +59,20 @@ if __name__ == '__main__':
         if out == "json":
             prefix = '\n' if spaced_before else ''
             suffix = '\n' if spaced_middle else ''
-            suffix += ('\n' if spare else '').join([''] + [json.dumps(data) for _ in range(int(count) - 1)])
-            print(f"{prefix}{json.dumps(data)}{suffix}")
+            copies = [json.dumps(data, indent=indent) for _ in range(int(count) - 1)]
+            suffix += ('\n' if spare else '').join([''] + copies)
+            print(f"{prefix}{json.dumps(data, indent=indent)}{suffix}", file=results)
         elif out == "str":
-            print("NO JSON OUTPUT")
+            print("NO JSON OUTPUT", file=results)
         elif out == "bad_json":
             del data["hosts"][0]["ip"]
-            print(f"{json.dumps(data)}")
+            print(f"{json.dumps(data)}", file=results)
     else:
         print(omit_everything, file=sys.stderr)
 
+    if sleep:
+        results.flush()
+        time.sleep(sleep)
     if err:
         print("Print by stderr", file=sys.stderr)
     if fails:
@@ -0,0 +1,34 @@
+# Copyright (C) 2019  Infobyte LLC (http://www.infobytesec.com/)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import sys
+import json
+
+from basic_executor import host_data, vuln_data
+
+
+def results_line(hosts: int):
+    host = dict(host_data, vulnerabilities=[vuln_data])
+    return json.dumps({"hosts": [host] * hosts}) + "\n"
+
+
+if __name__ == '__main__':
+    lines = int(os.getenv("EXECUTOR_CONFIG_LINES", 1))
+    hosts = int(os.getenv("EXECUTOR_CONFIG_HOSTS", 1))
+    line = results_line(hosts)
+    for _ in range(lines):
+        sys.stdout.write(line)
+    sys.stdout.flush()
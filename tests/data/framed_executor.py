@@ -0,0 +1,33 @@
+# Copyright (C) 2019  Infobyte LLC (http://www.infobytesec.com/)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from basic_executor import host_data, vuln_data  # noqa: E402
+from faraday_agent_dispatcher.worker import framed_results  # noqa: E402
+
+if __name__ == '__main__':
+    results = framed_results()
+    print("Stray output, it goes to stderr")
+    host = dict(host_data, vulnerabilities=[vuln_data])
+    count = int(os.getenv("EXECUTOR_CONFIG_COUNT", 1))
+    for index in range(count):
+        results.progress(f"{index + 1}/{count}")
+        results.send({"hosts": [host]})
+    results.log("Finished")
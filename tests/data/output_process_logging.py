@@ -0,0 +1,50 @@
+# Copyright (C) 2019  Infobyte LLC (http://www.infobytesec.com/)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Main module importing the cli as the faraday-dispatcher script, so the spawned output processes set up
+the dispatcher logging when they import it again. Prints the log messages the child forwards"""
+import sys
+import logging as std_logging
+import multiprocessing
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+import faraday_agent_dispatcher.cli  # noqa: E402, F401
+from faraday_agent_dispatcher import logger as logging  # noqa: E402
+from faraday_agent_dispatcher.output_processes import forward_logs, LOG  # noqa: E402
+
+
+def child(connection):
+    forward_logs(connection.send)
+    logging.get_logger().info("Logged once")
+    root_logger = std_logging.getLogger(logging.ROOT_LOGGER)
+    connection.send(("handlers", [handler.__class__.__name__ for handler in root_logger.handlers],
+                     logging.LISTENER is None))
+    connection.close()
+
+
+if __name__ == '__main__':
+    connection, child_connection = multiprocessing.get_context("spawn").Pipe()
+    process = multiprocessing.get_context("spawn").Process(target=child, args=(child_connection,))
+    process.start()
+    child_connection.close()
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            break
+        print(message[1]["msg"] if message[0] == LOG else message)
+    process.join()
@@ -0,0 +1,43 @@
+# Copyright (C) 2019  Infobyte LLC (http://www.infobytesec.com/)
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from basic_executor import host_data, vuln_data  # noqa: E402
+from faraday_agent_dispatcher.worker import serve  # noqa: E402
+
+
+def run(args, results):
+    if "crash" in args:
+        os._exit(3)
+    if "spin" in args:  # Burns CPU time
+        end = time.process_time() + float(args["spin"])
+        while time.process_time() < end:
+            pass
+    print("Stray output, it goes to stderr")
+    host = dict(host_data, vulnerabilities=[vuln_data])
+    for _ in range(int(args.get("count", 1))):
+        results.send({"hosts": [host]})
+    results.log(f"Job run by {os.getpid()}")
+    return 1 if "fails" in args else 0
+
+
+if __name__ == '__main__':
+    serve(run)
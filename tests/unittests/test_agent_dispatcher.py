@@ -18,15 +18,24 @@
 
 """Tests for `faraday_agent_dispatcher` package."""
 
+import asyncio
 import json
 import os
 import pytest
 import sys
+import websockets
 
+from http import HTTPStatus
 from pathlib import Path
+from aiohttp import RequestInfo
+from aiohttp.client_exceptions import ClientResponseError
+from multidict import CIMultiDict, CIMultiDictProxy
 from itsdangerous import TimestampSigner
+from yarl import URL
 
+from faraday_agent_dispatcher import metrics
 from faraday_agent_dispatcher.dispatcher import Dispatcher
+from faraday_agent_dispatcher.workers import Worker
 from faraday_agent_dispatcher.config import (
     reset_config,
     save_config,
@@ -39,6 +48,27 @@ from tests.utils.testing_faraday_server import FaradayTestConfig, test_config, t
     test_logger_handler, test_logger_folder
 
 
+
+def set_server_config(test_config: FaradayTestConfig, agent_token: bool = True):
+    """Points the dispatcher to the test server, registered unless agent_token is False"""
+    configuration.set(Sections.SERVER, "api_port", str(test_config.client.port))
+    configuration.set(Sections.SERVER, "host", test_config.client.host)
+    configuration.set(Sections.SERVER, "workspace", test_config.workspace)
+    configuration.set(Sections.TOKENS, "registration", test_config.registration_token)
+    if agent_token:
+        configuration.set(Sections.TOKENS, "agent", test_config.agent_token)
+
+
+def set_executor_config(executor_file: str, params=(), **options):
+    """Sets ex1 to run the executor of the tests data folder, with the given not mandatory params and
+    executor options"""
+    executor_section = Sections.EXECUTOR_DATA.format("ex1")
+    configuration.set(executor_section, "cmd", f"python {Path(__file__).parent.parent / 'data' / executor_file}")
+    for param in params:
+        configuration.set(Sections.EXECUTOR_PARAMS.format("ex1"), param, "False")
+    for option, value in options.items():
+        configuration.set(executor_section, option, value)
+
 @pytest.mark.parametrize('config_changes_dict',
                          [{"remove": {Sections.SERVER: ["host"]},
                            "replace": {},
@@ -59,6 +89,18 @@ from tests.utils.testing_faraday_server import FaradayTestConfig, test_config, t
                            "expected_exception": ValueError},
                           {"remove": {},
                            "replace": {Sections.SERVER: {"websocket_port": "9001"}}},  # None error as parse int
+                          {"remove": {},
+                           "replace": {Sections.SERVER: {"upload_retries": "many"}},
+                           "expected_exception": ValueError},
+                          {"remove": {},
+                           "replace": {Sections.SERVER: {"upload_backoff": "0.5"}}},
+                          {"remove": {},
+                           "replace": {Sections.SERVER: {"upload_compression": "zip"}},
+                           "expected_exception": ValueError},
+                          {"remove": {},
+                           "replace": {Sections.SERVER: {"upload_compression": "gzip"}}},
+                          {"remove": {},
+                           "replace": {Sections.AGENT: {"metrics_port": "9494", "metrics_host": "0.0.0.0"}}},
                           {"remove": {Sections.SERVER: ["workspace"]},
                            "replace": {},
                            "expected_exception": ValueError},
@@ -90,6 +132,29 @@ from tests.utils.testing_faraday_server import FaradayTestConfig, test_config, t
                           {"remove": {},
                            "replace": {Sections.EXECUTOR_DATA.format("ex1"): {"max_size": "ASDASD"}},
                            "expected_exception": ValueError},
+                          {"remove": {},
+                           "replace": {Sections.EXECUTOR_DATA.format("ex1"): {"batch_objects": "ASDASD"}},
+                           "expected_exception": ValueError},
+                          {"remove": {},
+                           "replace": {Sections.EXECUTOR_DATA.format("ex1"): {"batch_delay": "ASDASD"}},
+                           "expected_exception": ValueError},
+                          {"remove": {},
+                           "replace": {Sections.EXECUTOR_DATA.format("ex1"): {"batch_delay": "0.5"}}},
+                          {"remove": {},
+                           "replace": {Sections.EXECUTOR_DATA.format("ex1"): {"timeout": "ASDASD"}},
+                           "expected_exception": ValueError},
+                          {"remove": {},
+                           "replace": {Sections.EXECUTOR_DATA.format("ex1"): {
+                               "timeout": "60", "max_memory": "1073741824", "nice": "5"
+                           }}},
+                          {"remove": {},
+                           "replace": {Sections.EXECUTOR_DATA.format("ex1"): {"cpu_time": "1.5"}},
+                           "expected_exception": ValueError},
+                          {"remove": {},
+                           "replace": {Sections.EXECUTOR_DATA.format("ex1"): {"stream_results": "5"}},
+                           "expected_exception": ValueError},
+                          {"remove": {},
+                           "replace": {Sections.EXECUTOR_DATA.format("ex1"): {"stream_results": "True"}}},
                           {"remove": {},
                            "replace": {Sections.EXECUTOR_PARAMS.format("ex1"): {"param1": "ASDASD"}},
                            "expected_exception": ValueError},
@@ -99,6 +164,31 @@ from tests.utils.testing_faraday_server import FaradayTestConfig, test_config, t
                           {"remove": {},
                            "replace": {Sections.EXECUTOR_PARAMS.format("ex1"): {"param1": "True"}}
                            },
+                          {"remove": {},
+                           "replace": {Sections.EXECUTOR_PARAMS.format("ex1"): {"param1": "True, integer, 5"}}
+                           },
+                          {"remove": {},
+                           "replace": {Sections.EXECUTOR_PARAMS.format("ex1"): {"param1": "True, date"}},
+                           "expected_exception": ValueError},
+                          {"remove": {},
+                           "replace": {Sections.AGENT: {"targets": "second"}},
+                           "expected_exception": ValueError},
+                          {"remove": {},
+                           "replace": {Sections.AGENT: {"targets": "second"},
+                                       Sections.TARGET.format("second"): {"workspace": "other",
+                                                                          "api_port": "port"}},
+                           "expected_exception": ValueError},
+                          {"remove": {},
+                           "replace": {Sections.AGENT: {"targets": "second"},
+                                       Sections.TARGET.format("second"): {"workspace": "other"}}},
+                          {"remove": {},
+                           "replace": {Sections.EXECUTOR_DATA.format("ex1"): {
+                               "cmd": "not_a_command --help", "shell": "False"
+                           }},
+                           "expected_exception": ValueError},
+                          {"remove": {},
+                           "replace": {Sections.EXECUTOR_PARAMS.format("ex1"): {"param1": "False, integer, five"}},
+                           "expected_exception": ValueError},
                           {"remove": {Sections.AGENT: ["agent_name"]},
                            "replace": {},
                            "expected_exception": ValueError},
@@ -260,6 +350,7 @@ async def test_start_with_bad_config(test_config: FaradayTestConfig, tmp_default
                                      {"levelname": "ERROR", "msg": "JSON Parsing error: Extra data"},
                                      {"levelname": "INFO", "msg": "Executor ex1 finished successfully"}
                                  ],
+                                 "agent_config": {"json_backend": "json"},  # Checks the messages of the json module
                                  "ws_responses": [
                                      {
                                          "action": "RUN_STATUS",
@@ -353,9 +444,9 @@ async def test_start_with_bad_config(test_config: FaradayTestConfig, tmp_default
                                  },
                                  "logs": [
                                      {"levelname": "INFO", "msg": "Running ex1 executor"},
-                                     {"levelname": "ERROR",
-                                      "msg": "Invalid data supplied by the executor to the bulk create endpoint. "
-                                             "Server responded: "},
+                                     {"levelname": "ERROR", "msg": "Invalid result discarded: hosts[0] ip is missing"},
+                                     {"levelname": "INFO", "msg": "Data sent to bulk create", "max_count": 0,
+                                      "min_count": 0},
                                      {"levelname": "INFO", "msg": "Executor ex1 finished successfully"}
                                  ],
                                  "ws_responses": [
@@ -381,6 +472,7 @@ async def test_start_with_bad_config(test_config: FaradayTestConfig, tmp_default
                                      {"levelname": "ERROR", "msg": "JSON Parsing error: Expecting value"},
                                      {"levelname": "INFO", "msg": "Executor ex1 finished successfully"}
                                  ],
+                                 "agent_config": {"json_backend": "json"},  # Checks the messages of the json module
                                  "ws_responses": [
                                      {
                                          "action": "RUN_STATUS",
@@ -548,11 +640,16 @@ async def test_start_with_bad_config(test_config: FaradayTestConfig, tmp_default
                                  },
                                  "logs": [
                                      {"levelname": "INFO", "msg": "Running ex1 executor"},
+                                     {"levelname": "WARNING", "msg": "Bulk create failed (500", "min_count": 2,
+                                      "max_count": 2},
                                      {"levelname": "ERROR",
-                                      "msg": "Invalid data supplied by the executor to the bulk create endpoint. "
-                                             "Server responded: "},
+                                      "msg": "Data not sent to bulk create after 2 retries. Server responded: 500"},
+                                     {"levelname": "WARNING", "msg": "Data spooled"},
+                                     {"levelname": "ERROR", "msg": "Invalid data supplied by the executor",
+                                      "max_count": 0, "min_count": 0},
                                      {"levelname": "INFO", "msg": "Executor ex1 finished successfully"}
                                  ],
+                                 "server_config": {"upload_retries": "2", "upload_backoff": "0.01"},
                                  "workspace": "error500",
                                  "ws_responses": [
                                      {
@@ -574,11 +671,13 @@ async def test_start_with_bad_config(test_config: FaradayTestConfig, tmp_default
                                  },
                                  "logs": [
                                      {"levelname": "INFO", "msg": "Running ex1 executor"},
+                                     {"levelname": "WARNING", "msg": "Bulk create failed (429", "min_count": 1,
+                                      "max_count": 1},
                                      {"levelname": "ERROR",
-                                      "msg": "Invalid data supplied by the executor to the bulk create endpoint. "
-                                             "Server responded: "},
+                                      "msg": "Data not sent to bulk create after 1 retries. Server responded: 429"},
                                      {"levelname": "INFO", "msg": "Executor ex1 finished successfully"}
                                  ],
+                                 "server_config": {"upload_retry_budget": "1", "upload_backoff": "60"},
                                  "workspace": "error429",
                                  "ws_responses": [
                                      {
@@ -684,6 +783,398 @@ async def test_start_with_bad_config(test_config: FaradayTestConfig, tmp_default
                                  ],
                                  "extra": ["add_ex1"]
                              },
+                             {  # 21
+                                 "data": {
+                                     "action": "RUN", "agent_id": 1, "executor": "ex1",
+                                     "args": {"out": "json", "count": "5", "spare": "T"}
+                                 },
+                                 "logs": [
+                                     {"levelname": "INFO", "msg": "Running ex1 executor"},
+                                     {"levelname": "INFO", "msg": "Data sent to bulk create", "max_count": 1},
+                                     {"levelname": "INFO", "msg": "Executor ex1 finished successfully"}
+                                 ],
+                                 "executor_config": {"batch_objects": "100"},
+                                 "ws_responses": [
+                                     {
+                                         "action": "RUN_STATUS",
+                                         "executor_name": "ex1",
+                                         "running": True,
+                                         "message": "Running ex1 executor from unnamed_agent agent"
+                                     }, {
+                                         "action": "RUN_STATUS",
+                                         "executor_name": "ex1",
+                                         "successful": True,
+                                         "message": "Executor ex1 from unnamed_agent finished successfully"
+                                     }
+                                 ]
+                             },
+                             {  # 22
+                                 "data": {
+                                     "action": "RUN", "agent_id": 1, "executor": "ex1",
+                                     "args": {"out": "json", "count": "5", "pretty": "T"}
+                                 },
+                                 "logs": [
+                                     {"levelname": "INFO", "msg": "Running ex1 executor"},
+                                     {"levelname": "INFO", "msg": "Data sent to bulk create", "min_count": 1,
+                                      "max_count": 1},
+                                     {"levelname": "ERROR", "msg": "JSON Parsing error", "max_count": 0,
+                                      "min_count": 0},
+                                     {"levelname": "INFO", "msg": "Executor ex1 finished successfully"}
+                                 ],
+                                 "max_size": "1024",
+                                 "executor_config": {"stream_results": "True"},
+                                 "ws_responses": [
+                                     {
+                                         "action": "RUN_STATUS",
+                                         "executor_name": "ex1",
+                                         "running": True,
+                                         "message": "Running ex1 executor from unnamed_agent agent"
+                                     }, {
+                                         "action": "RUN_STATUS",
+                                         "executor_name": "ex1",
+                                         "successful": True,
+                                         "message": "Executor ex1 from unnamed_agent finished successfully"
+                                     }
+                                 ]
+                             },
+                             {  # 23
+                                 "data": {
+                                     "action": "RUN", "agent_id": 1, "executor": "ex1", "args": {"out": "str"}
+                                 },
+                                 "logs": [
+                                     {"levelname": "INFO", "msg": "Running ex1 executor"},
+                                     {"levelname": "ERROR", "msg": "JSON Parsing error: Expecting a JSON document"},
+                                     {"levelname": "INFO", "msg": "Executor ex1 finished successfully"}
+                                 ],
+                                 "executor_config": {"stream_results": "True"},
+                                 "ws_responses": [
+                                     {
+                                         "action": "RUN_STATUS",
+                                         "executor_name": "ex1",
+                                         "running": True,
+                                         "message": "Running ex1 executor from unnamed_agent agent"
+                                     }, {
+                                         "action": "RUN_STATUS",
+                                         "executor_name": "ex1",
+                                         "successful": True,
+                                         "message": "Executor ex1 from unnamed_agent finished successfully"
+                                     }
+                                 ]
+                             },
+                             {  # 24
+                                 "data": {
+                                     "action": "RUN", "agent_id": 1, "executor": "ex1",
+                                     "args": {"out": "json", "count": "2", "spare": "T"}
+                                 },
+                                 "logs": [
+                                     {"levelname": "INFO", "msg": "Running ex1 executor"},
+                                     {"levelname": "INFO", "msg": "Data sent to bulk create", "min_count": 2},
+                                     {"levelname": "INFO", "msg": "Executor ex1 finished successfully"}
+                                 ],
+                                 "server_config": {"upload_compression": "gzip"},
+                                 "bulk_create_encodings": ["gzip", "gzip"],
+                                 "ws_responses": [
+                                     {
+                                         "action": "RUN_STATUS",
+                                         "executor_name": "ex1",
+                                         "running": True,
+                                         "message": "Running ex1 executor from unnamed_agent agent"
+                                     }, {
+                                         "action": "RUN_STATUS",
+                                         "executor_name": "ex1",
+                                         "successful": True,
+                                         "message": "Executor ex1 from unnamed_agent finished successfully"
+                                     }
+                                 ]
+                             },
+                             {  # 25
+                                 "data": {
+                                     "action": "RUN", "agent_id": 1, "executor": "ex1",
+                                     "args": {"out": "json", "count": "2", "spare": "T"}
+                                 },
+                                 "logs": [
+                                     {"levelname": "INFO", "msg": "Running ex1 executor"},
+                                     {"levelname": "WARNING", "msg": "Server responded 415 to a deflate body",
+                                      "max_count": 1},
+                                     {"levelname": "WARNING", "msg": "disabling compression", "max_count": 1},
+                                     {"levelname": "INFO", "msg": "Data sent to bulk create", "min_count": 2},
+                                     {"levelname": "INFO", "msg": "Executor ex1 finished successfully"}
+                                 ],
+                                 "server_config": {"upload_compression": "deflate"},
+                                 "workspace": "nocompression",
+                                 "bulk_create_encodings": ["deflate", None, None],
+                                 "ws_responses": [
+                                     {
+                                         "action": "RUN_STATUS",
+                                         "executor_name": "ex1",
+                                         "running": True,
+                                         "message": "Running ex1 executor from unnamed_agent agent"
+                                     }, {
+                                         "action": "RUN_STATUS",
+                                         "executor_name": "ex1",
+                                         "successful": True,
+                                         "message": "Executor ex1 from unnamed_agent finished successfully"
+                                     }
+                                 ]
+                             },
+                             {  # 26
+                                 "data": {"action": "CANCEL", "agent_id": 1, "execution_id": "not_running"},
+                                 "logs": [
+                                     {"levelname": "ERROR", "msg": "No running execution to cancel"},
+                                 ],
+                                 "ws_responses": [
+                                     {
+                                         "action": "CANCEL_STATUS",
+                                         "cancelled": False,
+                                         "message": "No running execution to cancel in unnamed_agent agent"
+                                     }
+                                 ]
+                             },
+                             {  # 27
+                                 "data": {
+                                     "action": "RUN", "agent_id": 1, "executor": "ex1",
+                                     "args": {"out": "json", "sleep": "30"}
+                                 },
+                                 "logs": [
+                                     {"levelname": "INFO", "msg": "Running ex1 executor"},
+                                     {"levelname": "WARNING", "msg": "Executor ex1 still running after 0.5 seconds"},
+                                     {"levelname": "WARNING", "msg": "Executor ex1 reached its timeout limit"}
+                                 ],
+                                 "executor_config": {"timeout": "0.5"},
+                                 "ws_responses": [
+                                     {
+                                         "action": "RUN_STATUS",
+                                         "executor_name": "ex1",
+                                         "running": True,
+                                         "message": "Running ex1 executor from unnamed_agent agent"
+                                     }, {
+                                         "action": "RUN_STATUS",
+                                         "executor_name": "ex1",
+                                         "successful": False,
+                                         "limit_reached": "timeout",
+                                         "message": "Executor ex1 from unnamed_agent was stopped, it reached its "
+                                                    "timeout limit"
+                                     }
+                                 ]
+                             },
+                             {  # 28
+                                 "data": {"action": "RUN", "agent_id": 1, "executor": "ex1",
+                                          "args": {"out": "json", "err": "T"}},
+                                 "logs": [
+                                     {"levelname": "INFO", "msg": "Running ex1 executor"},
+                                     {"levelname": "DEBUG", "msg": "Output line", "max_count": 0, "min_count": 0},
+                                     {"levelname": "DEBUG", "msg": "Error line", "max_count": 0, "min_count": 0},
+                                     {"levelname": "INFO", "msg": "Data sent to bulk create"},
+                                     {"levelname": "INFO", "msg": "Executor ex1 finished successfully"}
+                                 ],
+                                 "agent_config": {"quiet": "True"},
+                                 "ws_responses": [
+                                     {
+                                         "action": "RUN_STATUS",
+                                         "executor_name": "ex1",
+                                         "running": True,
+                                         "message": "Running ex1 executor from unnamed_agent agent"
+                                     }, {
+                                         "action": "RUN_STATUS",
+                                         "executor_name": "ex1",
+                                         "successful": True,
+                                         "message": "Executor ex1 from unnamed_agent finished successfully"
+                                     }
+                                 ]
+                             },
+                             {  # 29
+                                 "data": {
+                                     "action": "RUN", "agent_id": 1, "executor": "ex1",
+                                     "args": {"out": "json", "count": "3", "spare": "T"}
+                                 },
+                                 "logs": [
+                                     {"levelname": "INFO", "msg": "Running ex1 executor"},
+                                     {"levelname": "INFO", "msg": "Data sent to bulk create", "min_count": 3,
+                                      "max_count": 3},
+                                     {"levelname": "INFO", "msg": "Executor ex1 finished successfully"}
+                                 ],
+                                 "executor_config": {"passthrough": "True"},
+                                 "ws_responses": [
+                                     {
+                                         "action": "RUN_STATUS",
+                                         "executor_name": "ex1",
+                                         "running": True,
+                                         "message": "Running ex1 executor from unnamed_agent agent"
+                                     }, {
+                                         "action": "RUN_STATUS",
+                                         "executor_name": "ex1",
+                                         "successful": True,
+                                         "message": "Executor ex1 from unnamed_agent finished successfully"
+                                     }
+                                 ]
+                             },
+                             {  # 30
+                                 "data": {
+                                     "action": "RUN", "agent_id": 1, "executor": "ex1",
+                                     "args": {"out": "json", "count": "2", "spare": "T"}
+                                 },
+                                 "logs": [
+                                     {"levelname": "INFO", "msg": "Running ex1 executor"},
+                                     {"levelname": "INFO", "msg": "Data sent to bulk create", "min_count": 2,
+                                      "max_count": 2},
+                                     {"levelname": "INFO", "msg": "Executor ex1 finished successfully"}
+                                 ],
+                                 "executor_config": {"shell": "False"},
+                                 "ws_responses": [
+                                     {
+                                         "action": "RUN_STATUS",
+                                         "executor_name": "ex1",
+                                         "running": True,
+                                         "message": "Running ex1 executor from unnamed_agent agent"
+                                     }, {
+                                         "action": "RUN_STATUS",
+                                         "executor_name": "ex1",
+                                         "successful": True,
+                                         "message": "Executor ex1 from unnamed_agent finished successfully"
+                                     }
+                                 ]
+                             },
+                             {  # 31
+                                 "data": {
+                                     "action": "RUN", "agent_id": 1, "executor": "ex1",
+                                     "args": {"out": "json", "count": "3", "spare": "T"}
+                                 },
+                                 "logs": [
+                                     {"levelname": "INFO", "msg": "Running ex1 executor"},
+                                     {"levelname": "INFO", "msg": "Data sent to bulk create", "min_count": 1,
+                                      "max_count": 1},
+                                     {"levelname": "INFO", "msg": "Executor ex1 finished successfully"}
+                                 ],
+                                 "executor_config": {"passthrough": "True"},
+                                 "agent_config": {"dedup_size": "1000"},  # Only the first of the equal results is sent
+                                 "ws_responses": [
+                                     {
+                                         "action": "RUN_STATUS",
+                                         "executor_name": "ex1",
+                                         "running": True,
+                                         "message": "Running ex1 executor from unnamed_agent agent"
+                                     }, {
+                                         "action": "RUN_STATUS",
+                                         "executor_name": "ex1",
+                                         "successful": True,
+                                         "message": "Executor ex1 from unnamed_agent finished successfully"
+                                     }
+                                 ]
+                             },
+                             {  # 32
+                                 "data": {
+                                     "action": "RUN", "agent_id": 1, "executor": "ex1",
+                                     "args": {"out": "json", "count": "3", "spare": "T"}
+                                 },
+                                 "logs": [
+                                     {"levelname": "INFO", "msg": "Running ex1 executor"},
+                                     {"levelname": "INFO", "msg": "Data sent to bulk create", "min_count": 1,
+                                      "max_count": 1},
+                                     {"levelname": "INFO", "msg": "Executor ex1 finished successfully"}
+                                 ],
+                                 "executor_config": {"merge_hosts": "True"},  # The three hosts have the same ip
+                                 "ws_responses": [
+                                     {
+                                         "action": "RUN_STATUS",
+                                         "executor_name": "ex1",
+                                         "running": True,
+                                         "message": "Running ex1 executor from unnamed_agent agent"
+                                     }, {
+                                         "action": "RUN_STATUS",
+                                         "executor_name": "ex1",
+                                         "successful": True,
+                                         "message": "Executor ex1 from unnamed_agent finished successfully"
+                                     }
+                                 ]
+                             },
+                             {  # 33
+                                 "data": {
+                                     "action": "RUN", "agent_id": 1, "executor": "ex1", "args": {"out": "bad_json"}
+                                 },
+                                 "logs": [
+                                     {"levelname": "INFO", "msg": "Running ex1 executor"},
+                                     {"levelname": "ERROR",
+                                      "msg": "Invalid data supplied by the executor to the bulk create endpoint. "
+                                             "Server responded: "},
+                                     {"levelname": "INFO", "msg": "Executor ex1 finished successfully"}
+                                 ],
+                                 "executor_config": {"validate_results": "False"},  # The server rejects it
+                                 "ws_responses": [
+                                     {
+                                         "action": "RUN_STATUS",
+                                         "executor_name": "ex1",
+                                         "running": True,
+                                         "message": "Running ex1 executor from unnamed_agent agent"
+                                     }, {
+                                         "action": "RUN_STATUS",
+                                         "executor_name": "ex1",
+                                         "successful": True,
+                                         "message": "Executor ex1 from unnamed_agent finished successfully"
+                                     }
+                                 ]
+                             },
+                             {  # 34
+                                 "data": {
+                                     "action": "RUN", "agent_id": 1, "executor": "ex1",
+                                     "args": {"out": "json", "count": "2", "spare": "T"}
+                                 },
+                                 "logs": [
+                                     {"levelname": "INFO", "msg": "Running ex1 executor"},
+                                     {"levelname": "DEBUG", "msg": "Output line: Log noise"},
+                                     {"levelname": "ERROR", "msg": "JSON Parsing error", "max_count": 0,
+                                      "min_count": 0},
+                                     {"levelname": "ERROR", "msg": "ValueError raised processing", "max_count": 0,
+                                      "min_count": 0},
+                                     {"levelname": "INFO", "msg": "Data sent to bulk create", "min_count": 2,
+                                      "max_count": 2},
+                                     {"levelname": "INFO", "msg": "Executor ex1 finished successfully"}
+                                 ],
+                                 "max_size": "100",  # The results are longer, but not limited in the result channel
+                                 "executor_config": {"result_channel": "True"},
+                                 "ws_responses": [
+                                     {
+                                         "action": "RUN_STATUS",
+                                         "executor_name": "ex1",
+                                         "running": True,
+                                         "message": "Running ex1 executor from unnamed_agent agent"
+                                     }, {
+                                         "action": "RUN_STATUS",
+                                         "executor_name": "ex1",
+                                         "successful": True,
+                                         "message": "Executor ex1 from unnamed_agent finished successfully"
+                                     }
+                                 ]
+                             },
+                             {  # 35
+                                 "data": {
+                                     "action": "RUN", "agent_id": 1, "executor": "ex1", "args": {"out": "bad_json"}
+                                 },
+                                 "logs": [
+                                     {"levelname": "INFO", "msg": "Running ex1 executor"},
+                                     {"levelname": "WARNING", "msg": "sending it uncompressed", "max_count": 0,
+                                      "min_count": 0},
+                                     {"levelname": "ERROR",
+                                      "msg": "Invalid data supplied by the executor to the bulk create endpoint. "
+                                             "Server responded: 400"},
+                                     {"levelname": "INFO", "msg": "Executor ex1 finished successfully"}
+                                 ],
+                                 "executor_config": {"validate_results": "False"},
+                                 "server_config": {"upload_compression": "gzip"},
+                                 "bulk_create_encodings": ["gzip"],  # Not sent again uncompressed
+                                 "ws_responses": [
+                                     {
+                                         "action": "RUN_STATUS",
+                                         "executor_name": "ex1",
+                                         "running": True,
+                                         "message": "Running ex1 executor from unnamed_agent agent"
+                                     }, {
+                                         "action": "RUN_STATUS",
+                                         "executor_name": "ex1",
+                                         "successful": True,
+                                         "message": "Executor ex1 from unnamed_agent finished successfully"
+                                     }
+                                 ]
+                             },
                          ])
 async def test_run_once(test_config: FaradayTestConfig, tmp_default_config, test_logger_handler,
                         test_logger_folder, executor_options):
@@ -694,6 +1185,10 @@ async def test_run_once(test_config: FaradayTestConfig, tmp_default_config, test
     configuration.set(Sections.SERVER, "workspace", workspace)
     configuration.set(Sections.TOKENS, "registration", test_config.registration_token)
     configuration.set(Sections.TOKENS, "agent", test_config.agent_token)
+    for option, value in executor_options.get("server_config", {}).items():
+        configuration.set(Sections.SERVER, option, value)
+    for option, value in executor_options.get("agent_config", {}).items():
+        configuration.set(Sections.AGENT, option, value)
     path_to_basic_executor = (
             Path(__file__).parent.parent /
             'data' / 'basic_executor.py'
@@ -711,13 +1206,15 @@ async def test_run_once(test_config: FaradayTestConfig, tmp_default_config, test
         configuration.set(executor_section, "cmd", "python {}".format(path_to_basic_executor))
         configuration.set(params_section, "out", "True")
         [configuration.set(params_section, param, "False") for param in [
-            "count", "spare", "spaced_before", "spaced_middle", "err", "fails"]]
+            "count", "spare", "spaced_before", "spaced_middle", "err", "fails", "pretty", "sleep"]]
         if "varenvs" in executor_options:
             for varenv in executor_options["varenvs"]:
                 configuration.set(varenvs_section, varenv, executor_options["varenvs"][varenv])
 
         max_size = str(64 * 1024) if "max_size" not in executor_options else executor_options["max_size"]
         configuration.set(executor_section, "max_size", max_size)
+        for option, value in executor_options.get("executor_config", {}).items():
+            configuration.set(executor_section, option, value)
 
     tmp_default_config.save()
 
@@ -731,6 +1228,8 @@ async def test_run_once(test_config: FaradayTestConfig, tmp_default_config, test
     await dispatcher.run_once(json.dumps(executor_options["data"]), ws_messages_checker)
     history = test_logger_handler.history
     assert len(executor_options["ws_responses"]) == 0
+    if "bulk_create_encodings" in executor_options:
+        assert test_config.bulk_create_encodings == executor_options["bulk_create_encodings"]
     for l in executor_options["logs"]:
         min_count = 1 if "min_count" not in l else l["min_count"]
         max_count = sys.maxsize if "max_count" not in l else l["max_count"]
@@ -801,3 +1300,392 @@ async def test_connect(test_config: FaradayTestConfig, tmp_default_config, test_
     await dispatcher.connect(ws_messages_checker)
 
     assert len(ws_responses) == 0
+
+
+async def test_run_once_queued(test_config: FaradayTestConfig, tmp_default_config, test_logger_handler,
+                               test_logger_folder):
+    set_server_config(test_config)
+    configuration.set(Sections.AGENT, "max_concurrent_runs", "1")
+    set_executor_config("basic_executor.py", ["out"])
+    tmp_default_config.save()
+
+    ws_responses = []
+
+    async def ws_messages_checker(msg):
+        ws_responses.append(json.loads(msg))
+
+    dispatcher = Dispatcher(test_config.client.session, tmp_default_config.config_file_path)
+    run_data = json.dumps({"action": "RUN", "agent_id": 1, "executor": "ex1", "args": {"out": "json"}})
+    await asyncio.gather(
+        dispatcher.run_once(run_data, ws_messages_checker),
+        dispatcher.run_once(run_data, ws_messages_checker),
+    )
+
+    queued_responses = [response for response in ws_responses if response.get("queued", False)]
+    assert len(queued_responses) == 1
+    assert queued_responses[0]["message"] == "Executor ex1 from unnamed_agent agent queued, waiting for a free slot"
+    assert len(ws_responses) == 5
+    assert [response.get("successful") for response in ws_responses if "successful" in response] == [True, True]
+    assert dispatcher.scheduler.running == 0
+
+
+async def test_cancel_execution(test_config: FaradayTestConfig, tmp_default_config, test_logger_handler,
+                                test_logger_folder):
+    set_server_config(test_config)
+    set_executor_config("basic_executor.py", ["out", "sleep"])
+    tmp_default_config.save()
+
+    ws_responses = []
+
+    async def ws_messages_checker(msg):
+        ws_responses.append(json.loads(msg))
+
+    dispatcher = Dispatcher(test_config.client.session, tmp_default_config.config_file_path)
+    run = asyncio.create_task(dispatcher.run_once(json.dumps({
+        "action": "RUN", "agent_id": 1, "executor": "ex1", "execution_id": "id1",
+        "args": {"out": "json", "sleep": "60"}
+    }), ws_messages_checker))
+    for _ in range(100):
+        if ws_responses:
+            break
+        await asyncio.sleep(0.05)
+    assert ws_responses == [{
+        "action": "RUN_STATUS",
+        "executor_name": "ex1",
+        "running": True,
+        "message": "Running ex1 executor from unnamed_agent agent",
+        "execution_id": "id1"
+    }]
+    assert dispatcher.executions.get("id1").pid is not None
+
+    await dispatcher.run_once(json.dumps({"action": "CANCEL", "agent_id": 1, "execution_id": "id1"}),
+                              ws_messages_checker)
+    await asyncio.wait_for(run, 10)
+
+    assert {
+        "action": "CANCEL_STATUS",
+        "cancelled": True,
+        "execution_ids": ["id1"],
+        "message": "1 execution(s) cancelled in unnamed_agent agent"
+    } in ws_responses
+    assert {
+        "action": "RUN_STATUS",
+        "executor_name": "ex1",
+        "successful": False,
+        "cancelled": True,
+        "message": "Executor ex1 from unnamed_agent was cancelled",
+        "execution_id": "id1"
+    } in ws_responses
+    assert len(dispatcher.executions) == 0
+    assert metrics.RUNS.labels("ex1", "cancelled").value >= 1
+    assert "faraday_dispatcher_running_executions 0\n" in metrics.REGISTRY.render()
+
+
+async def test_reconnect(test_config: FaradayTestConfig, tmp_default_config, test_logger_handler,
+                         test_logger_folder):
+    set_server_config(test_config)
+    configuration.set(Sections.SERVER, "reconnect_backoff", "0.2")
+    configuration.set(Sections.EXECUTOR_DATA.format("ex1"), "cmd", "exit 1")
+
+    received = []
+    dropped = asyncio.Event()
+    joined = asyncio.Event()
+
+    async def websocket_handler(websocket):
+        received.append(json.loads(await websocket.recv()))
+        if len(received) == 1:
+            await websocket.close()  # Drops the first connection just after the JOIN_AGENT
+            dropped.set()
+            return
+        received.append(await websocket.recv())
+        joined.set()
+        await websocket.wait_closed()
+
+    async with websockets.serve(websocket_handler, test_config.client.host, 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        configuration.set(Sections.SERVER, "websocket_port", str(port))
+        tmp_default_config.save()
+        dispatcher = Dispatcher(test_config.client.session, tmp_default_config.config_file_path)
+        await dispatcher.register()
+        connection = asyncio.create_task(dispatcher.connect())
+        await asyncio.wait_for(dropped.wait(), 10)
+        await dispatcher.send("status sent while disconnected")
+        await asyncio.wait_for(joined.wait(), 10)
+        connection.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await connection
+
+    assert [message["action"] for message in received[:2]] == ["JOIN_AGENT", "JOIN_AGENT"]
+    assert received[2] == "status sent while disconnected"
+    assert dispatcher.connections == 2
+    history = test_logger_handler.history
+    assert len([record for record in history if "reconnecting in" in record.message]) == 1
+
+
+@pytest.mark.parametrize("rejected_by", ["websocket", "token"])
+async def test_reconnect_stops_when_the_token_is_rejected(rejected_by, test_config: FaradayTestConfig,
+                                                          tmp_default_config, test_logger_handler, test_logger_folder):
+    set_server_config(test_config)
+    configuration.set(Sections.SERVER, "reconnect_backoff", "0.1")
+    configuration.set(Sections.EXECUTOR_DATA.format("ex1"), "cmd", "exit 1")
+    connections = []
+
+    def process_request(connection, request):
+        connections.append(request)
+        return connection.respond(HTTPStatus.FORBIDDEN, "Invalid token\n")
+
+    async def websocket_handler(websocket):
+        await websocket.wait_closed()
+
+    async with websockets.serve(websocket_handler, test_config.client.host, 0,
+                                process_request=process_request) as server:
+        configuration.set(Sections.SERVER, "websocket_port", str(server.sockets[0].getsockname()[1]))
+        tmp_default_config.save()
+        dispatcher = Dispatcher(test_config.client.session, tmp_default_config.config_file_path)
+        await dispatcher.register()
+        if rejected_by == "token":
+            async def reset_websocket_token():
+                url = URL(f"http://{test_config.client.host}/_api/v2/agent_websocket_token/")
+                raise ClientResponseError(RequestInfo(url, "POST", CIMultiDictProxy(CIMultiDict()), url), (),
+                                          status=401)
+
+            dispatcher.websocket_token = None
+            dispatcher.reset_websocket_token = reset_websocket_token
+        with pytest.raises((websockets.InvalidStatus, ClientResponseError)):
+            await asyncio.wait_for(dispatcher.keep_connected(), 10)
+
+    assert len(connections) == (1 if rejected_by == "websocket" else 0)
+    history = test_logger_handler.history
+    assert not [record for record in history if "reconnecting in" in record.message]
+    assert [record for record in history if "rejected the agent token" in record.message]
+
+
+async def test_persistent_executor(test_config: FaradayTestConfig, tmp_default_config, test_logger_handler,
+                                   test_logger_folder):
+    set_server_config(test_config)
+    set_executor_config("worker_executor.py", ["count", "fails", "crash"], persistent="True", max_jobs="3")
+    tmp_default_config.save()
+
+    ws_responses = []
+
+    async def ws_messages_checker(msg):
+        ws_responses.append(json.loads(msg))
+
+    dispatcher = Dispatcher(test_config.client.session, tmp_default_config.config_file_path)
+    pool = dispatcher.worker_pools["ex1"]
+    try:
+        await pool.start()
+        pid, = [worker.process.pid for worker in pool.workers]
+        for args in [{"count": "2"}, {"fails": "T"}, {"crash": "T"}, {}]:
+            await dispatcher.run_once(json.dumps({"action": "RUN", "agent_id": 1, "executor": "ex1", "args": args}),
+                                      ws_messages_checker)
+        outcomes = [response.get("successful") for response in ws_responses if "successful" in response]
+        assert outcomes == [True, False, False, True]
+        assert len(test_config.bulk_create_encodings) == 4  # Every job but the crashed one sends results
+        assert pool.restarts == 1  # The crashed worker
+        assert len(pool.workers) == 1 and pid not in [worker.process.pid for worker in pool.workers]
+        job_pids = [record.message.split()[-1] for record in test_logger_handler.history
+                    if "Job run by" in record.message]
+        assert len(job_pids) == 3 and job_pids[0] == job_pids[1] != job_pids[2]  # Warm until it crashed
+    finally:
+        await dispatcher.close_workers()
+    assert len(pool.workers) == 0
+
+
+async def test_persistent_executor_cpu_time_by_job(test_config: FaradayTestConfig, tmp_default_config,
+                                                   test_logger_handler, test_logger_folder):
+    set_server_config(test_config)
+    set_executor_config("worker_executor.py", ["spin"], persistent="True", cpu_time="1")
+    tmp_default_config.save()
+
+    ws_responses = []
+
+    async def ws_messages_checker(msg):
+        ws_responses.append(json.loads(msg))
+
+    dispatcher = Dispatcher(test_config.client.session, tmp_default_config.config_file_path)
+    pool = dispatcher.worker_pools["ex1"]
+    try:
+        await pool.start()
+        for spin in ["0.6", "0.6", "0.6", "3"]:  # More than the limit in total, but not by job but the last
+            await dispatcher.run_once(json.dumps({"action": "RUN", "agent_id": 1, "executor": "ex1",
+                                                  "args": {"spin": spin}}), ws_messages_checker)
+        outcomes = [response.get("successful") for response in ws_responses if "successful" in response]
+        assert outcomes == [True, True, True, False]
+        assert [response.get("limit_reached") for response in ws_responses if "limit_reached" in response] \
+            == ["cpu_time"]
+        job_pids = [record.message.split()[-1] for record in test_logger_handler.history
+                    if "Job run by" in record.message]
+        assert len(job_pids) == 3 and len(set(job_pids)) == 1  # The same worker until the last job
+    finally:
+        await dispatcher.close_workers()
+
+
+async def test_framed_output(test_config: FaradayTestConfig, tmp_default_config, test_logger_handler,
+                             test_logger_folder):
+    set_server_config(test_config)
+    set_executor_config("framed_executor.py", ["count"], framed_output="True",
+                        max_size="100")  # Smaller than the results
+    tmp_default_config.save()
+
+    ws_responses = []
+
+    async def ws_messages_checker(msg):
+        ws_responses.append(json.loads(msg))
+
+    dispatcher = Dispatcher(test_config.client.session, tmp_default_config.config_file_path)
+    await dispatcher.run_once(json.dumps({"action": "RUN", "agent_id": 1, "executor": "ex1", "args": {"count": "3"}}),
+                              ws_messages_checker)
+    assert ws_responses[-1]["successful"] is True
+    assert len(test_config.bulk_create_encodings) == 3
+    messages = [record.message for record in test_logger_handler.history]
+    assert [message for message in messages if message.startswith("Progress of ex1")] == \
+        ["Progress of ex1: 1/3", "Progress of ex1: 2/3", "Progress of ex1: 3/3"]
+    assert "ex1: Finished" in messages
+    assert not [message for message in messages if "Parsing error" in message or "broken" in message]
+
+
+async def test_persistent_executor_health_check(test_config: FaradayTestConfig, tmp_default_config,
+                                                test_logger_handler, test_logger_folder, monkeypatch):
+    set_server_config(test_config)
+    set_executor_config("worker_executor.py", ["count"], persistent="True", health_interval="0.01")
+    tmp_default_config.save()
+
+    ping = Worker.ping
+
+    async def slow_ping(worker, *args):
+        await asyncio.sleep(0.2)
+        return await ping(worker, *args)
+
+    monkeypatch.setattr(Worker, "ping", slow_ping)
+
+    async def ws_messages_checker(msg):
+        pass
+
+    dispatcher = Dispatcher(test_config.client.session, tmp_default_config.config_file_path)
+    pool = dispatcher.worker_pools["ex1"]
+    try:
+        await pool.start()
+        await asyncio.sleep(0.05)  # The only worker is under health check
+        await dispatcher.run_once(json.dumps({"action": "RUN", "agent_id": 1, "executor": "ex1", "args": {}}),
+                                  ws_messages_checker)
+        await asyncio.sleep(0.3)
+        assert len(pool.workers) == 1 and len(pool.idle) <= 1  # The job waited for the checked worker
+    finally:
+        await dispatcher.close_workers()
+
+
+async def test_several_targets(test_config: FaradayTestConfig, tmp_default_config, test_logger_handler,
+                               test_logger_folder):
+    set_server_config(test_config, agent_token=False)
+    configuration.set(Sections.AGENT, "targets", "second")
+    configuration.add_section(Sections.TARGET.format("second"))
+    configuration.set(Sections.TARGET.format("second"), "workspace", f"{test_config.workspace}_second")
+    set_executor_config("basic_executor.py", ["out"])
+    tmp_default_config.save()
+
+    dispatcher = Dispatcher(test_config.client.session, tmp_default_config.config_file_path)
+    second, = dispatcher.targets
+    assert second.executors is dispatcher.executors and second.scheduler is dispatcher.scheduler
+    await dispatcher.register()
+    assert dispatcher.websocket_token is not None and second.websocket_token is not None
+    assert configuration.get(Sections.TARGET.format("second"), "agent") == test_config.agent_token
+
+    ws_responses = []
+
+    async def ws_messages_checker(msg):
+        ws_responses.append(json.loads(msg))
+
+    run = json.dumps({"action": "RUN", "agent_id": 1, "executor": "ex1", "args": {"out": "json"}})
+    await second.run_once(run, ws_messages_checker)
+    await dispatcher.run_once(run, ws_messages_checker)
+    assert [response.get("successful") for response in ws_responses if "successful" in response] == [True, True]
+    assert test_config.bulk_create_workspaces == [f"{test_config.workspace}_second", test_config.workspace]
+
+
+async def test_several_targets_one_down(test_config: FaradayTestConfig, tmp_default_config, test_logger_handler,
+                                        test_logger_folder):
+    set_server_config(test_config)
+    configuration.set(Sections.SERVER, "upload_retries", "0")
+    configuration.set(Sections.AGENT, "targets", "second")
+    configuration.add_section(Sections.TARGET.format("second"))
+    configuration.set(Sections.TARGET.format("second"), "workspace", "error500")  # Its server is down
+    configuration.set(Sections.TARGET.format("second"), "agent", test_config.agent_token)
+    set_executor_config("basic_executor.py", ["out"])
+    tmp_default_config.save()
+
+    dispatcher = Dispatcher(test_config.client.session, tmp_default_config.config_file_path)
+    second, = dispatcher.targets
+    assert second.executions is not dispatcher.executions
+
+    async def ws_messages_checker(msg):
+        pass
+
+    run = json.dumps({"action": "RUN", "agent_id": 1, "executor": "ex1", "args": {"out": "json"}})
+    await second.run_once(run, ws_messages_checker)
+    assert second.spool.pending and not dispatcher.spool.pending
+    await dispatcher.run_once(run, ws_messages_checker)  # Sent, not held back by the spool of the other target
+    assert not dispatcher.spool.pending
+    assert test_config.bulk_create_workspaces == [test_config.workspace]
+
+    replayed = []
+
+    async def replay_send(workspace, data, target=None):
+        replayed.append((workspace, target))
+        return True
+
+    assert await second.spool.replay(replay_send)
+    assert replayed == [("error500", "second")]
+
+
+async def test_multiprocess_output(test_config: FaradayTestConfig, tmp_default_config, test_logger_handler,
+                                   test_logger_folder):
+    set_server_config(test_config)
+    configuration.set(Sections.AGENT, "multiprocess_output", "True")
+    configuration.set(Sections.AGENT, "output_processes", "2")
+    set_executor_config("basic_executor.py", ["out", "count", "spare"])
+    tmp_default_config.save()
+
+    ws_responses = []
+
+    async def ws_messages_checker(msg):
+        ws_responses.append(json.loads(msg))
+
+    dispatcher = Dispatcher(test_config.client.session, tmp_default_config.config_file_path)
+    finished = []
+    remove_execution = dispatcher.executions.remove
+    dispatcher.executions.remove = lambda execution: (finished.append(execution), remove_execution(execution))
+    responses = metrics.BULK_CREATE_RESPONSES.labels("201").value
+    uploads = sum(metrics.BULK_CREATE_DURATION.labels().counts)
+    lines = metrics.STDOUT_LINES.labels("ex1").value
+    try:
+        run = json.dumps({"action": "RUN", "agent_id": 1, "executor": "ex1",
+                          "args": {"out": "json", "count": "3", "spare": "T"}})
+        await asyncio.wait_for(asyncio.gather(*[dispatcher.run_once(run, ws_messages_checker) for _ in range(3)]),
+                               60)
+        assert len(dispatcher.output_processes.processes) == 2
+    finally:
+        await dispatcher.close_workers()
+    assert [response.get("successful") for response in ws_responses if "successful" in response] == [True] * 3
+    assert len(test_config.bulk_create_encodings) == 9
+    # The metrics of the output processes are added to the ones of the dispatcher
+    assert metrics.BULK_CREATE_RESPONSES.labels("201").value - responses == 9
+    assert sum(metrics.BULK_CREATE_DURATION.labels().counts) - uploads == 9
+    assert len(finished) == 3 and all(execution.bytes_processed > 0 for execution in finished)
+    assert metrics.STDOUT_LINES.labels("ex1").value - lines == sum(
+        execution.output_read["lines"] for execution in finished
+    ) > 0
+    # The logs of the output processes are written by the dispatcher
+    assert len([record for record in test_logger_handler.history
+                if record.message == "Data sent to bulk create"]) == 9
+    assert len(dispatcher.output_processes.processes) == 0
+
+
+async def test_output_process_only_forwards_logs():
+    # Under the faraday-dispatcher script, the spawned output processes set up the dispatcher logging
+    # importing the main module again
+    script = Path(__file__).parent.parent / 'data' / 'output_process_logging.py'
+    process = await asyncio.create_subprocess_exec(sys.executable, str(script), stdout=asyncio.subprocess.PIPE)
+    stdout, _ = await asyncio.wait_for(process.communicate(), 60)
+    assert process.returncode == 0
+    assert stdout.decode().splitlines() == ["Logged once", "('handlers', ['ForwardingHandler'], True)"]
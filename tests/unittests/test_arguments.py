@@ -0,0 +1,41 @@
+import pytest
+
+from faraday_agent_dispatcher.arguments import ArgumentSchema, ArgumentError, parse_param
+
+
+def schema():
+    return ArgumentSchema({
+        "target": (True, "string", None),
+        "port": (False, "integer", "80"),
+        "rate": (False, "float", None),
+        "verbose": (False, "boolean", None),
+    })
+
+
+def test_parse_param():
+    assert parse_param("True") == ("True", "string", None)
+    assert parse_param("False, integer, 80") == ("False", "integer", "80")
+
+
+def test_validate_coerces_and_fills_defaults():
+    args = schema().validate({"target": "10.0.0.1", "rate": "0.5", "verbose": "T"})
+    assert args == {"target": "10.0.0.1", "port": 80, "rate": 0.5, "verbose": True}
+
+
+def test_validate_matches_exact_names():
+    with pytest.raises(ArgumentError) as error:
+        schema().validate({"target": "10.0.0.1", "target_port": "22"})
+    assert error.value.unexpected == ["target_port"]
+
+
+def test_validate_reports_every_problem():
+    with pytest.raises(ArgumentError) as error:
+        schema().validate({"port": "http", "other": "1"})
+    assert error.value.unexpected == ["other"]
+    assert error.value.missing == ["target"]
+    assert error.value.invalid == ["port"]
+
+
+def test_validate_rejects_non_dict_args():
+    with pytest.raises(ArgumentError):
+        schema().validate(["target"])
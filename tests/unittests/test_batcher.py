@@ -0,0 +1,129 @@
+import asyncio
+
+from faraday_agent_dispatcher.batcher import ResultBatcher, HostTree, count_objects
+from faraday_agent_dispatcher.utils.json_utils import EncodedDocument
+
+
+def host(ip, vulns=0):
+    return {"ip": ip, "vulnerabilities": [{"name": f"vuln{i}"} for i in range(vulns)]}
+
+
+def test_count_objects():
+    assert count_objects([]) == 0
+    assert count_objects([host("10.0.0.1")]) == 1
+    assert count_objects([
+        host("10.0.0.1", 2),
+        {"ip": "10.0.0.2", "services": [{"port": 80, "vulnerabilities": [{}]}]},
+    ]) == 6
+
+
+async def test_batcher_flushes_by_objects_and_at_close():
+    sent = []
+
+    async def flush_f(payload):
+        sent.append(payload)
+
+    batcher = ResultBatcher(flush_f, max_objects=4, max_delay=60)
+    await batcher.add({"hosts": [host("10.0.0.1", 1)]})
+    assert sent == []
+    await batcher.add({"hosts": [host("10.0.0.2", 1)]})
+    assert sent == [{"hosts": [host("10.0.0.1", 1), host("10.0.0.2", 1)]}]
+    await batcher.add({"hosts": [host("10.0.0.3")]})
+    await batcher.close()
+    assert sent[1] == {"hosts": [host("10.0.0.3")]}
+
+
+async def test_batcher_keeps_order_with_non_mergeable_documents():
+    sent = []
+
+    async def flush_f(payload):
+        sent.append(payload)
+
+    batcher = ResultBatcher(flush_f, max_objects=100, max_delay=60)
+    await batcher.add({"hosts": [host("10.0.0.1")]})
+    await batcher.add({"hosts": [], "command": {"tool": "nmap"}})
+    await batcher.close()
+    assert sent == [{"hosts": [host("10.0.0.1")]}, {"hosts": [], "command": {"tool": "nmap"}}]
+
+
+async def test_batcher_flushes_by_size_and_delay():
+    sent = []
+
+    async def flush_f(payload):
+        sent.append(payload)
+
+    batcher = ResultBatcher(flush_f, max_objects=100, max_size=10, max_delay=0.05)
+    await batcher.add({"hosts": [host("10.0.0.1")]}, size=11)
+    assert len(sent) == 1
+    await batcher.add({"hosts": [host("10.0.0.2")]}, size=1)
+    assert len(sent) == 1
+    await asyncio.sleep(0.2)
+    assert sent[1] == {"hosts": [host("10.0.0.2")]}
+    await batcher.close()
+    assert len(sent) == 2
+
+
+async def test_batcher_close_waits_for_the_timer_flush():
+    sent = []
+
+    async def slow_flush_f(payload):
+        await asyncio.sleep(0.1)
+        sent.append(payload)
+
+    batcher = ResultBatcher(slow_flush_f, max_objects=100, max_delay=0.05)
+    await batcher.add({"hosts": [host("10.0.0.1")]})
+    await asyncio.sleep(0.07)  # The timer is sending the batch
+    await batcher.close()
+    assert sent == [{"hosts": [host("10.0.0.1")]}]
+
+
+async def test_batcher_sends_raw_documents_sent_on_their_own():
+    sent = []
+
+    async def flush_f(payload):
+        sent.append(payload)
+
+    batcher = ResultBatcher(flush_f, max_objects=2, max_delay=60)
+    await batcher.add({"hosts": [host("10.0.0.1", 1)]}, raw=b"raw1")  # Reaches max_objects alone
+    await batcher.add({"hosts": [host("10.0.0.2")]}, raw=b"raw2")  # Merged
+    await batcher.add({"command": {}}, raw=b"raw3")
+    assert isinstance(sent[0], EncodedDocument)
+    assert (sent[0].raw, sent[0].document) == (b"raw1", {"hosts": [host("10.0.0.1", 1)]})
+    assert sent[1] == {"hosts": [host("10.0.0.2")]}
+    assert sent[2].raw == b"raw3"
+
+
+def test_host_tree_merges_by_ip_port_and_name():
+    tree = HostTree()
+    assert tree.add(host("10.0.0.1", 1)) == 2
+    assert tree.add({"ip": "10.0.0.1", "os": "linux", "hostnames": ["a.com"],
+                     "vulnerabilities": [{"name": "vuln0"}, {"name": "other"}],
+                     "services": [{"port": 80, "protocol": "tcp", "vulnerabilities": [{"name": "vuln0"}]}]}) == 3
+    assert tree.add({"ip": "10.0.0.1", "services": [{"port": "80", "protocol": "tcp", "name": "http",
+                                                     "vulnerabilities": [{"name": "vuln0"}, {"name": "xss"}]}]}) == 1
+    assert tree.add(host("10.0.0.2")) == 1
+    assert tree.hosts == [
+        {"ip": "10.0.0.1", "os": "linux", "hostnames": ["a.com"],
+         "vulnerabilities": [{"name": "vuln0"}, {"name": "other"}],
+         "services": [{"port": 80, "protocol": "tcp", "name": "http",
+                       "vulnerabilities": [{"name": "vuln0"}, {"name": "xss"}]}]},
+        {"ip": "10.0.0.2"},
+    ]
+    assert tree.merged == 5
+
+
+async def test_batcher_merges_hosts():
+    sent = []
+
+    async def flush_f(payload):
+        sent.append(payload)
+
+    batcher = ResultBatcher(flush_f, max_objects=3, max_delay=60, merge_hosts=True)
+    await batcher.add({"hosts": [host("10.0.0.1", 1)]})
+    await batcher.add({"hosts": [host("10.0.0.1", 1)]})
+    assert sent == []
+    await batcher.add({"hosts": [host("10.0.0.1", 2)]})
+    assert sent == [{"hosts": [host("10.0.0.1", 2)]}]
+    await batcher.add({"hosts": [{"hostnames": ["no ip"]}]})
+    await batcher.close()
+    assert sent[1] == {"hosts": [{"hostnames": ["no ip"]}]}
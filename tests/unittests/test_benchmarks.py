@@ -0,0 +1,18 @@
+from tests.benchmarks.benchmark_dispatcher import run_scenario, compare
+
+
+async def test_benchmark_scenario_runs():
+    result = await run_scenario({"lines": 20, "hosts": 2, "runs": 2, "executor_config": {"batch_objects": "10"}})
+    assert result["failed_runs"] == 0
+    assert result["lines"] == 40
+    assert result["objects"] == 160
+    assert result["uploads"] == 14  # Batches of 3 lines, 12 objects
+    assert result["upload_latency_p99"] >= result["upload_latency_p50"] > 0
+
+
+def test_compare_finds_regressions():
+    baseline = {"small": {"lines_per_s": 1000, "upload_latency_p99": 0.1}}
+    assert compare({"small": {"lines_per_s": 950, "upload_latency_p99": 0.105}}, baseline, 0.1) == []
+    regressions = compare({"small": {"lines_per_s": 800, "upload_latency_p99": 0.2}}, baseline, 0.1)
+    assert len(regressions) == 2
+    assert regressions[0].startswith("small lines_per_s")
@@ -0,0 +1,92 @@
+from faraday_agent_dispatcher.dedup import DedupCache
+
+
+def host(ip="10.0.0.1", vulns=("vuln",), services=()):
+    return {
+        "ip": ip,
+        "description": "host",
+        "vulnerabilities": [{"name": name, "severity": "low"} for name in vulns],
+        "services": list(services),
+    }
+
+
+def service(port=80, vulns=()):
+    return {
+        "name": "http",
+        "port": port,
+        "protocol": "tcp",
+        "vulnerabilities": [{"name": name, "severity": "low"} for name in vulns],
+    }
+
+
+def sent(cache, document, scope=""):
+    """Filters the document as the uploader does, remembering it as sent"""
+    filtered, new_keys = cache.filter(document, scope)
+    cache.remember(new_keys)
+    return filtered
+
+
+def test_repeated_document_is_skipped():
+    cache = DedupCache(100)
+    assert sent(cache, {"hosts": [host()]}, "ws") == {"hosts": [host()]}
+    assert sent(cache, {"hosts": [host()]}, "ws") is None
+    assert sent(cache, {"hosts": [host()]}, "other_ws") == {"hosts": [host()]}
+
+
+def test_keys_order_does_not_matter():
+    cache = DedupCache(100)
+    sent(cache, {"hosts": [host()]})
+    reordered = dict(reversed(list(host().items())))
+    assert sent(cache, {"hosts": [reordered]}) is None
+
+
+def test_only_new_children_are_sent():
+    cache = DedupCache(100)
+    sent(cache, {"hosts": [host(services=[service(vulns=["a"])])]})
+    filtered = sent(cache, {"hosts": [host(vulns=["vuln", "new"], services=[service(vulns=["a", "b"])])]})
+    assert filtered == {"hosts": [{
+        "ip": "10.0.0.1",
+        "description": "host",
+        "vulnerabilities": [{"name": "new", "severity": "low"}],
+        "services": [{
+            "name": "http",
+            "port": 80,
+            "protocol": "tcp",
+            "vulnerabilities": [{"name": "b", "severity": "low"}],
+        }],
+    }]}
+
+
+def test_same_vuln_of_other_host_is_sent():
+    cache = DedupCache(100)
+    sent(cache, {"hosts": [host()]})
+    assert sent(cache, {"hosts": [host(ip="10.0.0.2")]}) == {"hosts": [host(ip="10.0.0.2")]}
+
+
+def test_other_keys_are_kept():
+    cache = DedupCache(100)
+    sent(cache, {"hosts": [host()]})
+    assert sent(cache, {"hosts": [host()], "command": {"tool": "nmap"}}) == {"hosts": [], "command": {"tool": "nmap"}}
+    assert sent(cache, {"command": {"tool": "nmap"}}) == {"command": {"tool": "nmap"}}
+
+
+def test_expired_and_evicted_objects_are_sent_again():
+    cache = DedupCache(100, ttl=0)
+    sent(cache, {"hosts": [host()]})
+    assert sent(cache, {"hosts": [host()]}) == {"hosts": [host()]}
+
+    cache = DedupCache(2)
+    sent(cache, {"hosts": [host(ip="10.0.0.1", vulns=[])]})
+    sent(cache, {"hosts": [host(ip="10.0.0.2", vulns=[])]})
+    sent(cache, {"hosts": [host(ip="10.0.0.3", vulns=[])]})
+    assert len(cache) == 2
+    assert sent(cache, {"hosts": [host(ip="10.0.0.1", vulns=[])]}) is not None
+    assert cache.hits == 0
+
+
+def test_objects_not_remembered_are_sent_again():
+    cache = DedupCache(100)
+    filtered, new_keys = cache.filter({"hosts": [host(), host()]})
+    assert filtered == {"hosts": [host()]}  # Duplicated in the same document
+    assert len(new_keys) == 2
+    assert cache.filter({"hosts": [host()]})[0] == {"hosts": [host()]}
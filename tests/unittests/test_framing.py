@@ -0,0 +1,53 @@
+import io
+import asyncio
+
+import pytest
+
+from faraday_agent_dispatcher.executor_helper import StdOutLineProcessor, PipeOutput
+from faraday_agent_dispatcher.utils.framing import encode_frame, read_frame, read_frame_sync, RESULT, DONE
+from tests.utils.testing_faraday_server import tmp_default_config  # noqa: F401
+
+
+def reader_of(data: bytes):
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    return reader
+
+
+async def test_read_frames():
+    reader = reader_of(encode_frame(RESULT, b'{"hosts": []}') + encode_frame(DONE))
+    assert await read_frame(reader) == (RESULT, b'{"hosts": []}')
+    assert await read_frame(reader) == (DONE, b"")
+    assert await read_frame(reader) is None
+
+
+async def test_read_truncated_frame():
+    with pytest.raises(ValueError):
+        await read_frame(reader_of(encode_frame(RESULT, b"0123456789")[:-1]))
+
+
+async def test_read_unknown_frame_type():
+    with pytest.raises(ValueError):
+        await read_frame(reader_of(encode_frame(99)))
+
+
+def test_read_frames_sync():
+    stream = io.BytesIO(encode_frame(RESULT, b"{}") + encode_frame(DONE)[:2])
+    assert read_frame_sync(stream) == (RESULT, b"{}")
+    with pytest.raises(ValueError):
+        read_frame_sync(stream)
+
+
+async def test_processor_skips_frames_not_utf8(tmp_default_config):  # noqa: F811
+    reader = reader_of(encode_frame(RESULT, b'{"hosts": ["\xff"]}') + encode_frame(RESULT, b'{"hosts": []}'))
+    processor = StdOutLineProcessor(PipeOutput(reader), None)
+    processed = []
+
+    async def processing(line):
+        processed.append(line)
+
+    processor.processing = processing
+    await processor.process_frames()
+    assert processed == ['{"hosts": []}']
+    assert processor.read_lines == 2
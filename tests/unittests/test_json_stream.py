@@ -0,0 +1,70 @@
+import json
+import random
+
+import pytest
+
+from faraday_agent_dispatcher.utils.json_stream import HostsStreamParser, HOST_EVENT, DOCUMENT_EVENT, ERROR_EVENT
+
+hosts = [
+    {
+        "ip": f"10.0.{i}.1",
+        "description": 'Escaped \\" chars and brackets } ] { [ inside strings',
+        "services": [{"port": 80, "protocol": "tcp", "vulnerabilities": [{"name": "vuln", "refs": []}]}],
+    }
+    for i in range(20)
+]
+command = {"tool": "nmap", "duration": 1.5, "finished": True, "user": None}
+
+
+def parse_in_chunks(text, max_chunk=64):
+    parser = HostsStreamParser()
+    events = []
+    index = 0
+    while index < len(text):
+        size = random.randint(1, max_chunk)
+        events += parser.feed(text[index:index + size])
+        index += size
+    return events + parser.close()
+
+
+@pytest.mark.parametrize("indent", [None, 2])
+def test_hosts_are_parsed_one_by_one(indent):
+    text = json.dumps({"hosts": hosts, "command": command}, indent=indent) + "\n"
+    events = parse_in_chunks(text)
+    assert [value for event, value, _ in events if event == HOST_EVENT] == hosts
+    assert [value for event, value, _ in events if event == DOCUMENT_EVENT] == [{"command": command}]
+    assert [event for event, _, _ in events if event == ERROR_EVENT] == []
+
+
+def test_log_lines_and_invalid_hosts_are_reported():
+    text = "Starting scan\n" + json.dumps({"hosts": [hosts[0]]}) + '\n{"hosts": [{"ip": "10.0.0.2"}, wrong]}\n' \
+        + json.dumps({"hosts": [hosts[1]]}) + "\n"
+    events = parse_in_chunks(text)
+    assert [value for event, value, _ in events if event == HOST_EVENT] == [hosts[0], {"ip": "10.0.0.2"}, hosts[1]]
+    assert len([event for event, _, _ in events if event == ERROR_EVENT]) == 2
+
+
+def test_incomplete_document_is_reported():
+    parser = HostsStreamParser()
+    assert parser.feed('{"hosts": [{"ip": "10.0.0.1"}, {"ip"') == [(HOST_EVENT, {"ip": "10.0.0.1"}, 18)]
+    assert [event for event, _, _ in parser.close()] == [ERROR_EVENT]
+
+
+def test_element_bigger_than_max_size():
+    parser = HostsStreamParser(max_element_size=20)
+    events = parser.feed('{"hosts": [{"ip": "10.0.0.1"}, {"ip": "10.0.0.2", "description": "long host')
+    assert events == [(HOST_EVENT, {"ip": "10.0.0.1"}, 18),
+                      (ERROR_EVENT, "JSON element bigger than 20 bytes, skipping it", 0)]
+    assert parser.feed(' and the rest of it", "services": [{"port": 80}]}, {"ip": "10.0.0.3"}], "command": {}}\n') \
+        == [(HOST_EVENT, {"ip": "10.0.0.3"}, 18), (DOCUMENT_EVENT, {"command": {}}, 0)]
+    assert parser.close() == []
+
+
+def test_value_bigger_than_max_size_is_skipped_with_its_key():
+    parser = HostsStreamParser(max_element_size=10)
+    assert parser.feed('{"command": {"tool": "nmap"') == [
+        (ERROR_EVENT, "JSON element bigger than 10 bytes, skipping it", 0)
+    ]
+    assert parser.feed(', "params": "-sV"}, "hosts": [{"ip": 1}]}\n') == [
+        (HOST_EVENT, {"ip": 1}, 9), (DOCUMENT_EVENT, {}, 0)
+    ]
@@ -0,0 +1,40 @@
+import pytest
+
+from faraday_agent_dispatcher.utils import json_utils
+
+
+@pytest.fixture
+def json_backend():
+    backend = json_utils.backend
+    yield json_utils.set_backend
+    json_utils.set_backend(backend)
+
+
+@pytest.mark.parametrize("name", [json_utils.JSON, pytest.param(json_utils.ORJSON, marks=pytest.mark.skipif(
+    json_utils.orjson is None, reason="orjson is not installed"))])
+def test_backends_round_trip(json_backend, name):
+    json_backend(name)
+    assert json_utils.backend == name
+    document = {"hosts": [{"ip": "10.0.0.1", "hostnames": ["á.com"]}]}
+    assert json_utils.loads(json_utils.dumps(document)) == document
+    assert json_utils.loads(json_utils.dumps_bytes(document)) == document
+    assert isinstance(json_utils.dumps(document), str)
+    with pytest.raises(json_utils.JSONDecodeError):
+        json_utils.loads('{"hosts": ')
+
+
+def test_auto_backend(json_backend):
+    json_backend(json_utils.AUTO)
+    assert json_utils.backend == (json_utils.ORJSON if json_utils.orjson is not None else json_utils.JSON)
+
+
+def test_default_backend_accepts_what_json_does(json_backend):
+    json_backend()
+    assert json_utils.backend == json_utils.JSON
+    document = json_utils.loads('{"port": 18446744073709551616, "score": NaN, "max": Infinity}')
+    assert document["port"] == 2 ** 64 and document["max"] == float("inf")
+
+
+def test_unknown_backend(json_backend):
+    with pytest.raises(ValueError):
+        json_backend("simplejson")
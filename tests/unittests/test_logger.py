@@ -0,0 +1,26 @@
+import logging
+
+from faraday_agent_dispatcher import logger as dispatcher_logging
+
+
+def test_records_are_written_by_the_background_listener(tmp_path):
+    dispatcher_logging.reset_logger(tmp_path)
+    try:
+        logger = dispatcher_logging.get_logger()
+        handler_names = [handler.name for handler in logger.handlers]
+        assert "QUEUE_HANDLER" in handler_names
+        assert "FILE_HANDLER" not in handler_names
+        logger.info("Written by the listener")
+        dispatcher_logging.stop_queue_logging()
+        assert "Written by the listener" in (tmp_path / "faraday-dispatcher.log").read_text()
+    finally:
+        dispatcher_logging.reset_logger("./logs")
+
+
+def test_console_level_is_still_settable():
+    level = dispatcher_logging.LVL_SETTABLE_HANDLERS[0].level
+    dispatcher_logging.set_logging_level(logging.WARNING)
+    try:
+        assert all(handler.level == logging.WARNING for handler in dispatcher_logging.LVL_SETTABLE_HANDLERS)
+    finally:
+        dispatcher_logging.set_logging_level(level)
@@ -0,0 +1,80 @@
+from aiohttp import ClientSession
+
+from faraday_agent_dispatcher.metrics import MetricsRegistry, MetricsServer, Counter, Gauge, Histogram
+
+
+def test_render_counter_and_gauge():
+    registry = MetricsRegistry()
+    counter = Counter("runs_total", "Runs", ["executor", "outcome"], registry=registry)
+    counter.labels("ex1", "successful").inc()
+    counter.labels("ex1", "successful").inc(2)
+    counter.labels('e"x', "failed").inc()
+    gauge = Gauge("queued", "Queued", registry=registry)
+    gauge.set_function(lambda: 7)
+
+    assert registry.render() == (
+        '# HELP runs_total Runs\n'
+        '# TYPE runs_total counter\n'
+        'runs_total{executor="ex1",outcome="successful"} 3\n'
+        'runs_total{executor="e\\"x",outcome="failed"} 1\n'
+        '# HELP queued Queued\n'
+        '# TYPE queued gauge\n'
+        'queued 7\n'
+    )
+
+
+def test_render_histogram():
+    histogram = Histogram("latency_seconds", "Latency", buckets=[0.1, 1], registry=MetricsRegistry())
+    for value in [0.05, 0.1, 0.5, 3]:
+        histogram.observe(value)
+    assert histogram.render().split("\n")[2:] == [
+        'latency_seconds_bucket{le="0.1"} 2',
+        'latency_seconds_bucket{le="1"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        'latency_seconds_sum 3.65',
+        'latency_seconds_count 4',
+    ]
+
+
+def test_merge_the_metrics_added_by_another_process():
+    def build_registry():
+        registry = MetricsRegistry()
+        Counter("runs_total", "Runs", ["executor"], registry=registry)
+        Gauge("queued", "Queued", registry=registry)
+        Histogram("latency_seconds", "Latency", buckets=[0.1, 1], registry=registry)
+        return registry
+
+    child, parent = build_registry(), build_registry()
+    runs, queued, latency = child.metrics
+    runs.labels("ex1").inc(2)
+    queued.set(4)
+    latency.observe(0.5)
+    first = child.snapshot()
+    parent.merge(child.delta(first, {}))
+    runs.labels("ex1").inc()
+    runs.labels("ex2").inc()
+    latency.observe(3)
+    parent.merge(child.delta(child.snapshot(), first))
+
+    parent_runs, parent_queued, parent_latency = parent.metrics
+    assert parent_runs.snapshot() == {("ex1",): 3, ("ex2",): 1}
+    assert parent_queued.children == {}  # Only kept by the process which sets it
+    assert parent_latency.snapshot() == {(): ((0, 1, 1), 3.5)}
+    assert child.delta(child.snapshot(), child.snapshot()) == {}
+
+
+async def test_metrics_server():
+    registry = MetricsRegistry()
+    counter = Counter("reconnects_total", "Reconnects", registry=registry)
+    counter.inc()
+    server = MetricsServer(0, registry=registry)
+    await server.start()
+    try:
+        host, port = server.runner.addresses[0][:2]
+        async with ClientSession() as session:
+            async with session.get(f"http://{host}:{port}/metrics") as response:
+                assert response.status == 200
+                assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+                assert "reconnects_total 1\n" in await response.text()
+    finally:
+        await server.stop()
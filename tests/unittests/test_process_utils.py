@@ -0,0 +1,47 @@
+import sys
+import shutil
+import signal
+import asyncio
+
+import pytest
+
+from faraday_agent_dispatcher.utils.process_utils import resource_limits, limits_setter, exit_signal, resolve_argv
+
+
+async def run_limited(code, **limits):
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-c", code,
+        stdout=asyncio.subprocess.PIPE,
+        preexec_fn=limits_setter(resource_limits(**limits)),
+    )
+    stdout, _ = await process.communicate()
+    return process.returncode, stdout.decode()
+
+
+async def test_cpu_time_limit_kills_with_sigxcpu():
+    returncode, _ = await asyncio.wait_for(run_limited("while True: pass", cpu_time=1), 30)
+    assert exit_signal(returncode) == signal.SIGXCPU
+
+
+async def test_open_files_limit():
+    code = "import resource; print(resource.getrlimit(resource.RLIMIT_NOFILE)[0])"
+    returncode, stdout = await run_limited(code, max_open_files=32)
+    assert returncode == 0
+    assert stdout.strip() == "32"
+
+
+def test_no_limits():
+    assert limits_setter(resource_limits()) is None
+
+
+def test_exit_signal():
+    assert exit_signal(0) is None
+    assert exit_signal(1) is None
+    assert exit_signal(-signal.SIGKILL) == signal.SIGKILL
+    assert exit_signal(128 + signal.SIGXCPU) == signal.SIGXCPU
+
+
+def test_resolve_argv():
+    assert resolve_argv("python -c 'print(1)'") == [shutil.which("python"), "-c", "print(1)"]
+    with pytest.raises(ValueError):
+        resolve_argv("not_a_command --help")
@@ -0,0 +1,46 @@
+import json
+import time
+import pstats
+import asyncio
+
+from faraday_agent_dispatcher import config
+from faraday_agent_dispatcher.profiling import profile_execution, CPROFILE, SAMPLING
+
+
+def busy(seconds):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        pass
+
+
+async def test_sampling_profile_and_loop_lag(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "LOGS_PATH", tmp_path)
+    async with profile_execution(SAMPLING, "ex1-1"):
+        await asyncio.sleep(0.1)
+        busy(0.3)  # Blocks the event loop
+        await asyncio.sleep(0.1)
+
+    folded, = (tmp_path / "profiles").glob("ex1-1-*.folded")
+    assert "busy" in folded.read_text()
+    lag_file, = (tmp_path / "profiles").glob("ex1-1-*.lag.json")
+    lag = json.loads(lag_file.read_text())
+    assert lag["profiler"] == SAMPLING
+    assert lag["max_lag"] >= 0.2
+    slow_callback, = lag["slow_callbacks"]
+    assert any(frame.startswith("busy ") for frame in slow_callback["stack"])  # The blocking one
+
+
+async def test_cprofile_profiles_one_execution_at_a_time(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "LOGS_PATH", tmp_path)
+
+    async def execution(name):
+        async with profile_execution(CPROFILE, name):
+            busy(0.01)
+            await asyncio.sleep(0.05)
+
+    await asyncio.gather(execution("ex1-1"), execution("ex1-2"))
+
+    profile, = (tmp_path / "profiles").glob("*.prof")
+    assert profile.name.startswith("ex1-1-")
+    assert pstats.Stats(str(profile)).total_calls > 0
+    assert not list((tmp_path / "profiles").glob("ex1-2-*"))
@@ -0,0 +1,37 @@
+import datetime
+from email.utils import format_datetime
+
+from faraday_agent_dispatcher.utils.retry_utils import RetryPolicy, is_retryable_status, parse_retry_after
+
+
+def test_retryable_status():
+    assert is_retryable_status(429)
+    assert is_retryable_status(500)
+    assert is_retryable_status(503)
+    assert not is_retryable_status(400)
+    assert not is_retryable_status(404)
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("7") == 7
+    assert parse_retry_after("not a date") is None
+    date = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=30)
+    assert 20 < parse_retry_after(format_datetime(date, usegmt=True)) <= 30
+
+
+def test_retry_policy_backoff_and_budget():
+    policy = RetryPolicy(max_retries=3, budget=4, backoff=1, max_backoff=3)
+    assert 0 <= policy.next_delay(0) <= 1
+    assert 0 <= policy.next_delay(2) <= 3
+    assert policy.next_delay(3) is None  # Max retries reached
+    assert policy.next_delay(0, retry_after=10) == 3
+    assert policy.next_delay(1, retry_after=0) == 0
+    assert policy.budget == 0
+    assert policy.next_delay(0) is None  # Budget exhausted
+
+
+def test_retry_policy_without_limits():
+    policy = RetryPolicy(max_retries=None, budget=None, backoff=1, max_backoff=3)
+    assert 0 <= policy.next_delay(10000) <= 3
+    assert policy.budget is None
@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+from faraday_agent_dispatcher.scheduler import JobScheduler, QueueFullError
+
+
+async def test_global_limit_and_priority():
+    scheduler = JobScheduler(max_running=1)
+    order = []
+
+    async def job(name, priority=0):
+        async with scheduler.slot("ex", priority):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    first = asyncio.create_task(job("first"))
+    await asyncio.sleep(0)
+    others = [asyncio.create_task(job("low")), asyncio.create_task(job("high", priority=10))]
+    await asyncio.sleep(0)
+    assert scheduler.running == 1 and scheduler.queued == 2
+    await asyncio.gather(first, *others)
+    assert order == ["first", "high", "low"]
+    assert scheduler.running == 0
+
+
+async def test_executor_limit_does_not_block_other_executors():
+    scheduler = JobScheduler(max_running=3, executor_limits={"slow": 1})
+    queued = []
+
+    async def on_queued(position):
+        queued.append(position)
+
+    await scheduler.acquire("slow")
+    waiting = asyncio.create_task(scheduler.acquire("slow", on_queued=on_queued))
+    await asyncio.sleep(0)
+    assert queued == [0]
+    await asyncio.wait_for(scheduler.acquire("fast"), 1)
+    assert scheduler.running == 2
+    scheduler.release("slow")
+    await asyncio.wait_for(waiting, 1)
+    assert scheduler.running_by_executor == {"slow": 1, "fast": 1}
+
+
+async def test_queue_limit_and_cancellation():
+    scheduler = JobScheduler(max_running=1, max_queued=1)
+    await scheduler.acquire("ex")
+    waiting = asyncio.create_task(scheduler.acquire("ex"))
+    await asyncio.sleep(0)
+    with pytest.raises(QueueFullError):
+        await scheduler.acquire("ex")
+    waiting.cancel()
+    await asyncio.gather(waiting, return_exceptions=True)
+    assert scheduler.queued == 0
+    scheduler.release("ex")
+    assert scheduler.running == 0
@@ -0,0 +1,77 @@
+import os
+import threading
+
+from faraday_agent_dispatcher.spool import Spool
+
+
+def results(i):
+    return {"hosts": [{"ip": f"10.0.0.{i}"}]}
+
+
+async def test_spool_replays_in_order_and_resumes(tmp_path):
+    spool = Spool(tmp_path, segment_size=100)
+    for i in range(5):
+        spool.append("ws", results(i))
+    assert spool.pending
+    assert len(spool.segments) > 1
+
+    sent = []
+    reachable = False
+
+    async def send_f(workspace, data):
+        if not reachable and len(sent) == 2:
+            return False
+        sent.append((workspace, data))
+        return True
+
+    assert not await spool.replay(send_f)
+    assert spool.pending
+    reachable = True
+    assert await spool.replay(send_f)
+    assert sent == [("ws", results(i)) for i in range(5)]
+    assert not spool.pending
+    assert spool.size == 0
+    assert list(tmp_path.iterdir()) == []
+
+
+async def test_spool_recovers_existing_segments(tmp_path):
+    spool = Spool(tmp_path)
+    spool.append("ws", results(1))
+    spool.close()
+
+    recovered = Spool(tmp_path)
+    assert recovered.pending
+    recovered.append("ws", results(2))
+    sent = []
+
+    async def send_f(workspace, data):
+        sent.append(data)
+        return True
+
+    assert await recovered.replay(send_f)
+    assert sent == [results(1), results(2)]
+
+
+def test_spool_evicts_oldest_segments(tmp_path):
+    spool = Spool(tmp_path, max_size=300, segment_size=100)
+    for i in range(20):
+        spool.append("ws", results(i))
+    spool.close()
+    assert spool.size <= 300
+    assert spool.size == sum(segment.stat().st_size for segment in spool.segments)
+    assert len(list(tmp_path.iterdir())) == len(spool.segments)
+
+
+def test_spool_syncs_in_writer_thread(tmp_path, monkeypatch):
+    threads = []
+    fsync = os.fsync
+
+    def recording_fsync(fd):
+        threads.append(threading.current_thread().name)
+        fsync(fd)
+
+    monkeypatch.setattr(os, "fsync", recording_fsync)
+    spool = Spool(tmp_path)
+    spool.append("ws", results(1))
+    spool.close()
+    assert threads and all(name.startswith("spool-writer") for name in threads)
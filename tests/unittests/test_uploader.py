@@ -0,0 +1,68 @@
+import asyncio
+
+from faraday_agent_dispatcher.dedup import DedupCache
+from faraday_agent_dispatcher.uploader import BulkCreateUploader, UploadQueue
+from faraday_agent_dispatcher.utils.retry_utils import RetryPolicy
+from tests.utils.testing_faraday_server import tmp_default_config  # noqa: F401
+
+
+async def test_upload_queue_only_blocks_when_full():
+    release = asyncio.Event()
+    uploaded = []
+
+    async def slow_upload(payload):
+        await release.wait()
+        uploaded.append(payload)
+
+    upload_queue = UploadQueue(slow_upload, workers=2, max_size=2)
+    for i in range(4):  # 2 taken by the workers, 2 waiting in the queue
+        await asyncio.wait_for(upload_queue.put(i), 1)
+
+    blocked_put = asyncio.create_task(upload_queue.put(4))
+    await asyncio.sleep(0.05)
+    assert not blocked_put.done()
+
+    release.set()
+    await asyncio.wait_for(blocked_put, 1)
+    await asyncio.wait_for(upload_queue.close(), 1)
+    assert sorted(uploaded) == [0, 1, 2, 3, 4]
+    assert upload_queue.put_wait > 0
+
+
+async def test_upload_queue_survives_upload_errors():
+    uploaded = []
+
+    async def failing_upload(payload):
+        if payload == "bad":
+            raise ValueError("Unexpected")
+        uploaded.append(payload)
+
+    upload_queue = UploadQueue(failing_upload)
+    await upload_queue.put("bad")
+    await upload_queue.put("good")
+    await asyncio.wait_for(upload_queue.close(), 1)
+    assert uploaded == ["good"]
+
+
+class FakeServerUploader(BulkCreateUploader):
+    """Answers the posts with the given statuses instead of sending them"""
+
+    def __init__(self, statuses, dedup):
+        super().__init__(None, retry_policy=RetryPolicy(max_retries=0), dedup=dedup)
+        self.statuses = statuses
+        self.posted = []
+
+    async def post(self, workspace, body: bytes, encoding: str = None):
+        self.posted.append(body)
+        return self.statuses.pop(0), "", {}
+
+
+async def test_dedup_only_remembers_uploaded_results(tmp_default_config):  # noqa: F811
+    document = {"hosts": [{"ip": "10.0.0.1", "vulnerabilities": [{"name": "vuln"}]}]}
+    uploader = FakeServerUploader([400, 500, 201, 201], DedupCache(100))
+    await uploader.upload(document)  # Rejected
+    await uploader.upload(document)  # Not sent after the retries, without spool
+    await uploader.upload(document)
+    await uploader.upload(document)  # Already sent
+    assert len(uploader.posted) == 3
+    assert uploader.statuses == [201]
@@ -0,0 +1,42 @@
+from faraday_agent_dispatcher.validation import validate_document
+
+
+def host(ip="10.0.0.1", **children):
+    return {"ip": ip, "hostnames": ["test.com"], **children}
+
+
+def test_valid_document_is_not_copied():
+    document = {"hosts": [host(services=[{"name": "http", "port": "80", "protocol": "tcp"}],
+                               vulnerabilities=[{"name": "xss", "severity": "high"}])],
+                "command": {"tool": "nmap"}}
+    valid_document, errors = validate_document(document)
+    assert valid_document is document
+    assert errors == []
+
+
+def test_only_invalid_objects_are_discarded():
+    document = {"hosts": [
+        {"description": "no ip"},
+        host(services=[{"name": "http", "port": 80, "protocol": "tcp", "vulnerabilities": [{"desc": "no name"}]},
+                       {"name": "http", "port": 70000, "protocol": "tcp"}],
+             credentials=[{"username": "admin"}]),
+        host("10.0.0.2", hostnames="test.com"),
+    ]}
+    valid_document, errors = validate_document(document)
+    assert valid_document == {"hosts": [host(services=[{"name": "http", "port": 80, "protocol": "tcp",
+                                                        "vulnerabilities": []}],
+                                             credentials=[])]}
+    assert errors == [
+        "hosts[0] ip is missing",
+        "hosts[1].services[0].vulnerabilities[0] name is missing",
+        "hosts[1].services[1] port is not valid",
+        "hosts[1].credentials[0] password is missing",
+        "hosts[2] hostnames is not valid",
+    ]
+    assert document["hosts"][1]["credentials"] == [{"username": "admin"}]
+
+
+def test_nothing_left_to_send():
+    assert validate_document({"hosts": [{"ip": 1}]}) == (None, ["hosts[0] ip is not valid"])
+    assert validate_document({"hosts": {}, "command": {}}) == ({"command": {}}, ["hosts is not a list"])
+    assert validate_document([]) == (None, ["The document is not an object"])
@@ -1,15 +1,18 @@
 import json
 import os
+import asyncio
 import shutil
 import pytest
 import random
 import pathlib
+import tempfile
 from aiohttp import web
 from aiohttp.web_request import Request
 from itsdangerous import TimestampSigner
 import logging
 from logging import StreamHandler
 from faraday_agent_dispatcher.logger import get_logger, reset_logger
+from faraday_agent_dispatcher import config as dispatcher_config
 from queue import Queue
 
 from faraday_agent_dispatcher.config import (
@@ -35,6 +38,9 @@ class FaradayTestConfig:
             "SECRET_KEY": 'SECRET_KEY',
         }
         self.changes_queue = Queue()
+        self.bulk_create_encodings = []
+        self.bulk_create_workspaces = []
+        self.bulk_create_delay = 0
 
     def run_agent_to_websocket(self):
         self.changes_queue.put({
@@ -98,13 +104,21 @@ def get_bulk_create(test_config: FaradayTestConfig):
         if "error500" in request.url.path:
             return web.HTTPInternalServerError()
         if "error429" in request.url.path:
-            return web.HTTPTooManyRequests()
-
-        if test_config.workspace not in request.url.path:
+            return web.HTTPTooManyRequests(headers={"Retry-After": "0"})
+
+        encoding = request.headers.get("Content-Encoding")
+        test_config.bulk_create_encodings.append(encoding)
+        test_config.bulk_create_workspaces.append(request.url.path.split("/")[4])
+        if "nocompression" in request.url.path:
+            if encoding is not None:
+                return web.HTTPUnsupportedMediaType()
+        elif "slow" in request.url.path:
+            await asyncio.sleep(test_config.bulk_create_delay)
+        elif test_config.workspace not in request.url.path:
             return web.HTTPNotFound()
         _host_data = host_data.copy()
         _host_data["vulnerabilities"] = [vuln_data.copy()]
-        data = json.loads((await request.read()).decode())
+        data = json.loads((await request.read()).decode())  # aiohttp decompresses gzip and deflate bodies
         if "ip" not in data["hosts"][0]:
             return web.HTTPBadRequest()
         assert _host_data == data["hosts"][0]
@@ -123,9 +137,19 @@ async def test_config(aiohttp_client, aiohttp_server, loop):
 class TmpConfig:
     config_file_path = f"/tmp/{fuzzy_string(10)}.ini"
 
+    def __init__(self):
+        self.spool_path = pathlib.Path(tempfile.mkdtemp())
+        self.__original_spool_path = dispatcher_config.SPOOL_PATH
+        dispatcher_config.SPOOL_PATH = self.spool_path
+
     def save(self):
         save_config(self.config_file_path)
 
+    def clean(self):
+        os.remove(self.config_file_path)
+        shutil.rmtree(self.spool_path, ignore_errors=True)
+        dispatcher_config.SPOOL_PATH = self.__original_spool_path
+
 
 @pytest.fixture
 def tmp_default_config():
@@ -133,7 +157,7 @@ def tmp_default_config():
     shutil.copyfile(EXAMPLE_CONFIG_FILENAME, config.config_file_path)
     reset_config(config.config_file_path)
     yield config
-    os.remove(config.config_file_path)
+    config.clean()
 
 @pytest.fixture
 def tmp_custom_config(config=None):
@@ -145,18 +169,28 @@ def tmp_custom_config(config=None):
     shutil.copyfile(ini_path, config.config_file_path)
     reset_config(config.config_file_path)
     yield config
-    os.remove(config.config_file_path)
+    config.clean()
 
 
-async def aiohttp_faraday_client(aiohttp_client, aiohttp_server, test_config: FaradayTestConfig):
+def faraday_app(test_config: FaradayTestConfig):
     app = web.Application()
     app.router.add_post(f"/_api/v2/ws/{test_config.workspace}/agent_registration/",
                         get_agent_registration(test_config))
     app.router.add_post('/_api/v2/agent_websocket_token/', get_agent_websocket_token(test_config))
     app.router.add_post(f"/_api/v2/ws/{test_config.workspace}/bulk_create/", get_bulk_create(test_config))
-    app.router.add_post(f"/_api/v2/ws/error500/bulk_create/", get_bulk_create(test_config))
-    app.router.add_post(f"/_api/v2/ws/error429/bulk_create/", get_bulk_create(test_config))
-    server = await aiohttp_server(app)
+    # Another workspace of the same server, for the dispatchers with several targets
+    app.router.add_post(f"/_api/v2/ws/{test_config.workspace}_second/agent_registration/",
+                        get_agent_registration(test_config))
+    app.router.add_post(f"/_api/v2/ws/{test_config.workspace}_second/bulk_create/", get_bulk_create(test_config))
+    app.router.add_post("/_api/v2/ws/error500/bulk_create/", get_bulk_create(test_config))
+    app.router.add_post("/_api/v2/ws/error429/bulk_create/", get_bulk_create(test_config))
+    app.router.add_post("/_api/v2/ws/nocompression/bulk_create/", get_bulk_create(test_config))
+    app.router.add_post("/_api/v2/ws/slow/bulk_create/", get_bulk_create(test_config))
+    return app
+
+
+async def aiohttp_faraday_client(aiohttp_client, aiohttp_server, test_config: FaradayTestConfig):
+    server = await aiohttp_server(faraday_app(test_config))
     client = await aiohttp_client(server)
     return client
 